@@ -1,7 +1,12 @@
 import asyncio
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from bleak import BleakScanner, BleakClient, BLEDevice
 from logger import get_logger
+from src.bluetooth.ble_communication import scan_devices_stream, resolve_device
+from src.bluetooth.notify_dispatcher import get_dispatcher, release_dispatchers
+from src.bluetooth.command_handler import DeviceInfo, decode_response
+from src.bluetooth.command_queue import get_command_queue
+from src.bluetooth.retry_policy import default_retry_policy, circuit_breakers
 
 # 创建日志记录器
 logger = get_logger('ble_model')
@@ -13,6 +18,8 @@ class BLEModel:
         self.client: Optional[BleakClient] = None
         self.connected_device: Optional[BLEDevice] = None
         self._scan_results: List[BLEDevice] = []
+        # 地址 -> 扫描时得到的设备信息（名称、信号强度、广播数据）
+        self._scan_info: Dict[str, Dict[str, Any]] = {}
         
         # 定义特征UUID
         self.APP_CHARACTERISTIC_UUID = "00002c10-0000-1000-8000-00805f9b34fb"
@@ -29,27 +36,44 @@ class BLEModel:
             设备信息列表，每个设备包含名称、地址和信号强度
         """
         logger.info(f"开始扫描蓝牙设备，超时时间: {timeout}秒")
-        all_devices = await BleakScanner.discover()
-        
-        # 只保留名称为"zk301"的设备
-        self._scan_results = [device for device in all_devices if device.name and device.name.strip() == "zk301"]
+        self._scan_results = []
         
         devices_info = []
-        for device in self._scan_results:
-            device_info = {
-                "name": device.name,
-                "address": device.address,
-                "rssi": device.rssi,
-                "metadata": device.metadata
-            }
+        async for device_info in self.scan_devices_stream(timeout):
             devices_info.append(device_info)
-            logger.info(f"发现zk301设备: {device_info['name']} ({device_info['address']})")
         
         if not devices_info:
             logger.info("未发现zk301设备")
         
         return devices_info
 
+    async def scan_devices_stream(self, timeout: float = 10.0,
+                                  addresses: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式扫描zk301设备，每发现一个设备立即返回其信息
+        
+        Args:
+            timeout: 最长扫描时间（秒）
+            addresses: 要查找的设备地址，全部发现后提前结束扫描
+            
+        Returns:
+            异步生成器，依次产生设备信息字典
+        """
+        async for device, advertisement_data in scan_devices_stream(timeout, "zk301", addresses):
+            self._scan_results.append(device)
+            device_info = {
+                "name": device.name or advertisement_data.local_name,
+                "address": device.address,
+                "rssi": advertisement_data.rssi,
+                "metadata": {
+                    "uuids": advertisement_data.service_uuids,
+                    "manufacturer_data": advertisement_data.manufacturer_data
+                }
+            }
+            self._scan_info[device.address] = device_info
+            logger.info(f"发现zk301设备: {device_info['name']} ({device_info['address']})")
+            yield device_info
+
     async def connect(self, address: str) -> bool:
         """
         连接到指定的蓝牙设备
@@ -60,11 +84,23 @@ class BLEModel:
         Returns:
             连接是否成功
         """
+        # 连续失败的设备在熔断期内直接跳过
+        breaker = circuit_breakers.get(address)
+        if not breaker.allow_request():
+            logger.warning(f"设备连续失败，熔断中，跳过连接: {address}")
+            return False
         try:
-            self.client = BleakClient(address)
+            # 优先使用最近的广播缓存，避免BleakClient内部再扫描一次
+            device = await resolve_device(address)
+            if device is None:
+                logger.error(f"找不到设备: {address}")
+                breaker.record_failure()
+                return False
+            self.client = BleakClient(device)
             await self.client.connect()
             
             if self.client and self.client.is_connected:
+                breaker.record_success()
                 # 查找对应的设备信息
                 for device in self._scan_results:
                     if device.address == address:
@@ -72,27 +108,33 @@ class BLEModel:
                         break
                 logger.info(f"成功连接到设备: {address}")
                 return True
+            breaker.record_failure()
             return False
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
         except Exception as e:
             logger.error(f"连接设备失败: {e}")
+            breaker.record_failure()
             return False
 
     async def disconnect(self):
         """断开当前连接的设备"""
         if self.client and self.client.is_connected:
+            await release_dispatchers(self.client)
             await self.client.disconnect()
             self.client = None
             self.connected_device = None
             logger.info("已断开设备连接")
 
-    async def send_command(self, command: str, char_uuid: str = None, max_retries: int = 3) -> Optional[str]:
+    async def send_command(self, command: str, char_uuid: str = None, max_retries: Optional[int] = None) -> Optional[str]:
         """
         发送命令并接收响应
         
         Args:
             command: 要发送的命令字符串
             char_uuid: 特征UUID，默认使用APP特征
-            max_retries: 最大重试次数
+            max_retries: 最大尝试次数，默认使用全局重试策略的设置
             
         Returns:
             设备返回的响应
@@ -103,45 +145,58 @@ class BLEModel:
             
         if char_uuid is None:
             char_uuid = self.APP_CHARACTERISTIC_UUID
+
+        breaker = circuit_breakers.get(self.client.address)
+        if not breaker.allow_request():
+            logger.warning(f"设备连续失败，熔断中，跳过命令: {self.client.address}")
+            return None
+        if max_retries is None:
+            max_retries = default_retry_policy.max_attempts
             
+        # 准备命令，确保以$\r\n结尾
+        command = command.rstrip("\r\n").rstrip("$") + "$\r\n"
+
+        # 与其他调用方共用同一连接的命令队列，重复的查询命令共享一次收发
+        queue = get_command_queue(self.client, char_uuid)
+        try:
+            response = await queue.submit(command, lambda: self._send_with_retries(command, char_uuid, max_retries))
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except BaseException:
+            breaker.record_failure()
+            raise
+        if response is None:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def _send_with_retries(self, command: str, char_uuid: str, max_retries: int) -> Optional[str]:
+        """写入命令并等待响应，失败时按全局重试策略退避后重试"""
+        # 每个连接只订阅一次通知，响应按命令名与请求匹配
+        dispatcher = get_dispatcher(self.client, char_uuid)
+
         for attempt in range(max_retries):
             try:
-                # 确保服务发现已经完成
-                await self.client.get_services()
-
-                # 创建一个 Future，用于等待通知返回
-                loop = asyncio.get_running_loop()
-                response_future = loop.create_future()
-
-                # 通知回调函数
-                def notification_handler(sender, data):
-                    try:
-                        result = data.decode()
-                    except UnicodeDecodeError:
-                        result = data.hex()
-                    logger.debug(f"收到通知: {result}")
-                    if not response_future.done():
-                        response_future.set_result(result)
-
-                # 准备命令，确保以$\r\n结尾
-                command = command.rstrip("\r\n").rstrip("$") + "$\r\n"
-
-                # 启动通知并发送命令
-                await self.client.start_notify(char_uuid, notification_handler)            
                 logger.info(f"发送命令: {command.strip()}")
-                await self.client.write_gatt_char(char_uuid, command.encode(), response=True)
+                response_future = await dispatcher.send(command)
                 
                 # 等待响应
                 try:
-                    response = await asyncio.wait_for(response_future, timeout=15.0)
-                    await self.client.stop_notify(char_uuid)
+                    response = await dispatcher.wait(response_future, timeout=default_retry_policy.timeout)
+                    logger.info(f"命令耗时: {dispatcher.last_latency}")
                     return response
                 except asyncio.TimeoutError:
-                    await self.client.stop_notify(char_uuid)
                     logger.warning(f"第{attempt+1}次尝试超时")
             except Exception as e:
                 logger.error(f"第{attempt+1}次尝试失败: {e}")
-                await asyncio.sleep(1.0)
+                # 订阅可能已失效，下一次尝试重新订阅
+                await dispatcher.reset()
+                if not self.client or not self.client.is_connected:
+                    break
+            if attempt + 1 < max_retries:
+                await asyncio.sleep(default_retry_policy.delay(attempt))
         
         logger.error("所有重试均失败")
         return None
@@ -175,6 +230,19 @@ class BLEModel:
         command = f"AT+BKINF={password},0"
         return await self.send_command(command)
 
+    async def get_device_status(self, password: str) -> Optional[DeviceInfo]:
+        """
+        获取解码后的设备信息
+        
+        Args:
+            password: 设备密码
+            
+        Returns:
+            DeviceInfo记录（锁状态、速度、里程、电量、头灯状态等），失败返回None
+        """
+        record = decode_response(await self.get_device_info(password))
+        return record if isinstance(record, DeviceInfo) else None
+
     async def get_headlight_status(self, password: str) -> Optional[str]:
         """
         获取头灯状态
@@ -186,14 +254,9 @@ class BLEModel:
             头灯状态信息
         """
         # 通过获取设备信息来获取头灯状态
-        info = await self.get_device_info(password)
+        info = await self.get_device_status(password)
         if info:
-            # 解析设备信息中的头灯状态
-            # 格式: +ACK:BKINF,<Lock Status>,<Scooter Speed>,<Current Mileage>,<Total Mileage>,<Ride Time>,<Scooter Battery Percentage>,<Headlamp Status>
-            parts = info.split(",")
-            if len(parts) >= 7:
-                headlamp_status = parts[6].strip()
-                return "开启" if headlamp_status == "1" else "关闭"
+            return "开启" if info.headlamp_on else "关闭"
         return None
 
     async def send_warning(self, password: str) -> Optional[str]:
@@ -210,10 +273,10 @@ class BLEModel:
     def connected_device_info(self) -> Optional[Dict[str, Any]]:
         """获取当前连接设备的信息"""
         if self.connected_device:
-            return {
+            return self._scan_info.get(self.connected_device.address, {
                 "name": self.connected_device.name or "未知设备",
                 "address": self.connected_device.address,
-                "rssi": self.connected_device.rssi,
-                "metadata": self.connected_device.metadata
-            }
-        return None 
\ No newline at end of file
+                "rssi": None,
+                "metadata": {}
+            })
+        return None
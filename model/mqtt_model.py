@@ -1,8 +1,14 @@
+import asyncio
 import json
 import time
 import paho.mqtt.client as mqtt
 from typing import Dict, Any, Optional, Callable, List, Tuple
 from logger import get_logger
+from src.mqtt.async_transport import AsyncMQTTTransport
+from src.mqtt.connection import ConnectionStateMachine
+from src.mqtt.dispatcher import MessageDispatcher, message_key
+from src.mqtt.publisher import PublishWindow
+from src.mqtt.topic_router import TopicRouter
 
 # 创建日志记录器
 logger = get_logger('mqtt_model')
@@ -30,11 +36,16 @@ class MQTTModel:
         
         # 客户端状态
         self.client = None
-        self.connected = False
+        # 连接状态与自动重连
+        self.connection = ConnectionStateMachine()
         self.subscribed_topics = set()
+        # 切换到asyncio传输后由事件循环驱动客户端，见 use_asyncio_transport
+        self.transport: Optional[AsyncMQTTTransport] = None
         
-        # 回调函数字典，用于处理特定主题的消息
-        self.topic_handlers = {}
+        # 主题过滤器（支持+/#）-> 处理函数，一个过滤器可以有多个处理函数
+        self.topic_handlers = TopicRouter()
+        # 处理函数在工作线程中执行，同一锁控制器的消息保持顺序
+        self.dispatcher = MessageDispatcher()
         
         # 初始化客户端
         self._init_client()
@@ -43,7 +54,8 @@ class MQTTModel:
         """初始化MQTT客户端和连接"""
         # 创建客户端，使用时间戳作为客户端ID
         client_id = f"mqtt_controller_{int(time.time())}"
-        self.client = mqtt.Client(client_id=client_id)
+        # 重连由状态机按退避策略安排，不使用paho网络线程内置的重连
+        self.client = mqtt.Client(client_id=client_id, reconnect_on_failure=False)
         
         # 设置认证信息
         self.client.username_pw_set(self.username, self.password)
@@ -52,12 +64,20 @@ class MQTTModel:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        # 批量发布时按消息ID跟踪PUBACK
+        self.publisher = PublishWindow(self.client)
         
         # 启动连接
         self._connect()
     
+    @property
+    def connected(self) -> bool:
+        """是否已连接"""
+        return self.connection.is_connected
+    
     def _connect(self):
         """连接到MQTT服务器"""
+        self.connection.mark_connecting()
         try:
             logger.info(f"正在连接MQTT服务器: {self.host}:{self.port}")
             self.client.connect(self.host, self.port, keepalive=60)
@@ -65,16 +85,57 @@ class MQTTModel:
             self.client.loop_start()
         except Exception as e:
             logger.error(f"MQTT连接异常: {e}")
-            self.connected = False
+            self._schedule_reconnect()
+    
+    def _schedule_reconnect(self):
+        """按退避策略安排下一次重连"""
+        if self.transport is not None:
+            self.connection.schedule_reconnect(self._async_reconnect, self.transport.loop)
+        else:
+            self.connection.schedule_reconnect(self._reconnect)
+    
+    def _reconnect(self):
+        """重连一次（在重连定时器线程中执行）"""
+        if self.connection.closed:
+            return
+        if self.transport is not None:
+            asyncio.run_coroutine_threadsafe(self._async_reconnect(), self.transport.loop)
+            return
+        self.connection.mark_connecting()
+        try:
+            # 异常断开后paho网络线程已退出，重连后重新启动
+            self.client.loop_stop()
+            self.client.reconnect()
+            self.client.loop_start()
+        except Exception as e:
+            logger.error(f"MQTT重连失败: {e}")
+            self._schedule_reconnect()
+    
+    async def _async_reconnect(self):
+        """在事件循环中重连一次"""
+        if self.connection.closed:
+            return
+        self.connection.mark_connecting()
+        try:
+            connected = await self.transport.reconnect()
+        except Exception as e:
+            logger.error(f"MQTT重连失败: {e}")
+            connected = False
+        if not connected:
+            self._schedule_reconnect()
     
     def _on_connect(self, client, userdata, flags, rc):
         """连接建立回调函数"""
         if rc == 0:
             logger.info("MQTT连接成功")
-            self.connected = True
+            # 服务器不保留会话，重连后重新订阅之前的主题
+            if self.subscribed_topics:
+                client.subscribe([(topic, 0) for topic in sorted(self.subscribed_topics)])
+                logger.info(f"已重新订阅主题: {', '.join(sorted(self.subscribed_topics))}")
+            self.connection.mark_connected()
         else:
+            # 连接被拒绝后paho会接着调用断开回调，由那里安排重连
             logger.error(f"MQTT连接失败，返回码: {rc}")
-            self.connected = False
     
     def _on_message(self, client, userdata, msg):
         """消息接收回调函数"""
@@ -83,9 +144,16 @@ class MQTTModel:
             payload = msg.payload.decode()
             logger.debug(f"收到MQTT消息: 主题={topic}, 内容={payload}")
             
-            # 如果有特定主题的处理函数，则调用它
-            if topic in self.topic_handlers:
-                self.topic_handlers[topic](topic, payload)
+            # 匹配该主题的处理函数交给工作线程调用
+            handlers = self.topic_handlers.match(topic)
+            if handlers:
+                try:
+                    data = json.loads(payload)
+                except json.JSONDecodeError:
+                    data = None
+                key = message_key(topic, data)
+                for handler in handlers:
+                    self.dispatcher.submit(key, handler, topic, payload)
                 
         except Exception as e:
             logger.error(f"处理MQTT消息时出错: {e}")
@@ -93,10 +161,93 @@ class MQTTModel:
     def _on_disconnect(self, client, userdata, rc):
         """断开连接回调函数"""
         logger.info(f"MQTT连接断开, 返回码: {rc}")
-        self.connected = False
         if rc != 0:
-            logger.warning("尝试重新连接...")
-            self._connect()
+            self._schedule_reconnect()
+        else:
+            self.connection.mark_disconnected()
+    
+    async def use_asyncio_transport(self) -> bool:
+        """
+        改由当前事件循环驱动MQTT客户端，停止loop_start()后台线程
+        
+        Returns:
+            是否已切换到asyncio传输
+        """
+        if self.transport is not None:
+            return True
+        transport = AsyncMQTTTransport(self.client)
+        try:
+            await transport.start()
+        except NotImplementedError as e:
+            logger.warning(f"无法使用asyncio传输，继续使用后台线程: {e}")
+            return False
+        self.transport = transport
+        logger.info("MQTT已切换到asyncio传输")
+        if self.connection.state == ConnectionStateMachine.DISCONNECTED:
+            self.connection.mark_connecting()
+            try:
+                await transport.connect(self.host, self.port, keepalive=60)
+            except Exception as e:
+                logger.error(f"MQTT连接异常: {e}")
+                self._schedule_reconnect()
+        return True
+    
+    async def async_publish(self, topic: str, payload: Dict[str, Any], qos: int = 1,
+                            timeout: float = 10.0) -> bool:
+        """
+        异步发布消息，QoS>0时等待服务器确认（需要先调用 use_asyncio_transport）
+        
+        Args:
+            topic: 主题
+            payload: 消息内容（字典）
+            qos: 服务质量等级
+            timeout: 等待连接和确认的超时时间（秒）
+            
+        Returns:
+            是否发布成功
+        """
+        if self.transport is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.publish, topic, payload, qos)
+        if not await self.connection.wait_connected_async(timeout):
+            logger.error("无法发布消息: MQTT未连接")
+            return False
+        try:
+            latency = await self.transport.publish(topic, payload, qos=qos, timeout=timeout)
+        except Exception as e:
+            logger.error(f"发布消息时出错: {e or '等待确认超时'}")
+            return False
+        logger.info(f"发送MQTT命令: {topic}, 确认时延 {latency * 1000:.0f}ms")
+        return True
+    
+    async def async_subscribe(self, topic: str, callback: Optional[Callable[[str, str], None]] = None,
+                              timeout: float = 10.0) -> bool:
+        """
+        异步订阅主题并等待服务器确认（需要先调用 use_asyncio_transport）
+        
+        Args:
+            topic: 要订阅的主题
+            callback: 收到消息时的回调函数，接收(topic, payload)两个参数
+            timeout: 等待连接和确认的超时时间（秒）
+            
+        Returns:
+            是否订阅成功
+        """
+        if self.transport is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.subscribe, topic, callback)
+        if topic not in self.subscribed_topics:
+            if not await self.connection.wait_connected_async(timeout):
+                logger.error(f"无法订阅主题 {topic}: MQTT未连接")
+                return False
+            try:
+                await self.transport.subscribe(topic, timeout=timeout)
+            except Exception as e:
+                logger.error(f"订阅主题 {topic} 失败: {e or '等待确认超时'}")
+                return False
+            logger.info(f"已订阅主题: {topic}")
+            self.subscribed_topics.add(topic)
+        if callback:
+            self.topic_handlers.add(topic, callback)
+        return True
     
     def _ensure_connected(self, timeout: float = 5.0) -> bool:
         """
@@ -108,24 +259,13 @@ class MQTTModel:
         Returns:
             是否已连接
         """
-        start_time = time.time()
-        while not self.connected and time.time() - start_time < timeout:
-            time.sleep(0.1)
-        
-        if not self.connected:
-            logger.warning("MQTT未连接，尝试重连...")
+        # 连接中或退避中时等待状态机通知，只有没有安排重连时才主动发起连接
+        if self.connection.state == ConnectionStateMachine.DISCONNECTED:
             self._connect()
-            start_time = time.time()
-            # 再次等待连接
-            while not self.connected and time.time() - start_time < timeout:
-                time.sleep(0.1)
-                
-            if self.connected:
-                logger.info("MQTT重连成功")
-            else:
-                logger.error("MQTT重连失败")
-        
-        return self.connected
+        if self.connection.wait_connected(timeout):
+            return True
+        logger.error(f"MQTT未连接（{self.connection.state}）")
+        return False
     
     def _subscribe_topic(self, topic: str) -> bool:
         """
@@ -180,12 +320,35 @@ class MQTTModel:
             logger.error(f"发布消息时出错: {e}")
             return False
     
+    def publish_many(self, messages: List[Tuple[str, Dict[str, Any]]], qos: int = 1,
+                     window: int = 20, timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        流水线发布多条消息，在途消息数不超过窗口大小，并等待每条消息的确认
+        
+        Args:
+            messages: (主题, 消息内容字典) 列表
+            qos: 服务质量等级
+            window: 最多同时在途的消息数
+            timeout: 单条消息等待PUBACK的超时时间（秒）
+            
+        Returns:
+            每条消息的PUBACK时延和失败原因，格式见 PublishWindow.publish_many
+        """
+        if not self._ensure_connected():
+            logger.error("无法批量发布消息: MQTT未连接")
+            return {"results": [], "acked": 0, "failed": len(messages), "elapsed": 0.0, "throughput": 0.0}
+        
+        summary = self.publisher.publish_many(messages, window=window, timeout=timeout, qos=qos)
+        logger.info(f"批量发布: 确认{summary['acked']}条, 失败{summary['failed']}条, "
+                    f"吞吐量{summary['throughput']:.0f}条/秒")
+        return summary
+    
     def subscribe(self, topic: str, callback: Optional[Callable[[str, str], None]] = None) -> bool:
         """
-        订阅主题并设置回调函数
+        订阅主题并添加回调函数，已有的回调函数保留
         
         Args:
-            topic: 要订阅的主题
+            topic: 要订阅的主题，可以带+/#通配符
             callback: 收到消息时的回调函数，接收(topic, payload)两个参数
             
         Returns:
@@ -194,20 +357,26 @@ class MQTTModel:
         success = self._subscribe_topic(topic)
         
         if success and callback:
-            self.topic_handlers[topic] = callback
+            self.topic_handlers.add(topic, callback)
             
         return success
     
-    def unsubscribe(self, topic: str) -> bool:
+    def unsubscribe(self, topic: str, callback: Optional[Callable[[str, str], None]] = None) -> bool:
         """
         取消订阅主题
         
         Args:
             topic: 要取消订阅的主题
+            callback: 只移除这个回调函数；该主题还有其他回调函数时保留订阅
             
         Returns:
             是否取消订阅成功
         """
+        if callback is not None:
+            self.topic_handlers.remove(topic, callback)
+            if topic in self.topic_handlers.filters():
+                return True
+        
         if topic not in self.subscribed_topics:
             return True
         
@@ -219,8 +388,7 @@ class MQTTModel:
         if result == mqtt.MQTT_ERR_SUCCESS:
             logger.info(f"已取消订阅主题: {topic}")
             self.subscribed_topics.remove(topic)
-            if topic in self.topic_handlers:
-                del self.topic_handlers[topic]
+            self.topic_handlers.remove(topic)
             return True
         else:
             logger.error(f"取消订阅主题 {topic} 失败")
@@ -228,6 +396,8 @@ class MQTTModel:
     
     def close(self):
         """关闭MQTT连接"""
+        self.connection.close()
+        self.dispatcher.stop()
         if self.client:
             self.client.loop_stop()
             self.client.disconnect()
@@ -258,6 +428,24 @@ class MQTTModel:
         payload = {"taskId":1,"payload":{"SLN":sub_lock_number}}
         return self.publish(topic, payload)
     
+    def unlock_locks(self, controller_id: str, sub_lock_numbers: List[int],
+                     window: int = 20, timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        一次打开同一控制器的多个子锁
+        
+        Args:
+            controller_id: 控制器ID
+            sub_lock_numbers: 子锁号码列表
+            window: 最多同时在途的消息数
+            timeout: 单条消息等待PUBACK的超时时间（秒）
+            
+        Returns:
+            批量发布结果，results与sub_lock_numbers一一对应
+        """
+        topic = f"ULC{controller_id}"
+        messages = [(topic, {"taskId":1,"payload":{"SLN":sub_lock_number}}) for sub_lock_number in sub_lock_numbers]
+        return self.publish_many(messages, window=window, timeout=timeout)
+    
     def query_lock_status(self, controller_id: str, sub_lock_number: int = 1) -> bool:
         """
         查询指定控制器的指定子锁状态
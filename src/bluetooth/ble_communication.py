@@ -2,18 +2,140 @@
 import asyncio
 from bleak import BleakScanner, BleakClient
 
+from src.bluetooth.command_queue import get_command_queue
+from src.bluetooth.gatt_cache import gatt_cache
+from src.bluetooth.notify_dispatcher import get_dispatcher
+from src.bluetooth.presence_cache import presence_cache
+from src.bluetooth.retry_policy import default_retry_policy, circuit_breakers
+
 # 固定特征UUID
 APP_CHARACTERISTIC_UUID = "00002c10-0000-1000-8000-00805f9b34fb"
 
 # 设备发现与连接
-async def discover_devices():
-    """扫描附近的蓝牙设备并返回设备列表。"""
-    devices = await BleakScanner.discover()
+async def scan_devices_stream(timeout=10.0, name_filter=None, addresses=None, detection_callback=None):
+    """流式扫描附近的蓝牙设备，每发现一个新设备立即返回。
+    
+    同一地址只返回一次。提供addresses时，这些地址全部出现后立即结束扫描。
+    
+    :param timeout: 最长扫描时间（秒）
+    :param name_filter: 可选。只返回名称等于该值的设备，如"zk301"
+    :param addresses: 可选。要查找的设备地址集合，全部发现后提前结束
+    :param detection_callback: 可选。每收到一条广播都会调用，接收(device, advertisement_data)
+    :return: 异步生成器，依次产生 (device, advertisement_data)
+    """
+    queue = asyncio.Queue()
+    seen = set()
+    remaining = {address.upper() for address in addresses} if addresses else None
+
+    def on_detection(device, advertisement_data):
+        presence_cache.update(device, advertisement_data)
+        if detection_callback is not None:
+            try:
+                detection_callback(device, advertisement_data)
+            except Exception as e:
+                print(f"广播回调出错: {e}")
+        if device.address in seen:
+            return
+        if name_filter is not None:
+            name = device.name or advertisement_data.local_name
+            if not name or name.strip() != name_filter:
+                return
+        seen.add(device.address)
+        queue.put_nowait((device, advertisement_data))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with BleakScanner(detection_callback=on_detection):
+        while True:
+            if remaining is not None and not remaining:
+                break
+            wait_time = deadline - loop.time()
+            if wait_time <= 0:
+                break
+            try:
+                device, advertisement_data = await asyncio.wait_for(queue.get(), timeout=wait_time)
+            except asyncio.TimeoutError:
+                break
+            if remaining is not None:
+                remaining.discard(device.address.upper())
+            yield device, advertisement_data
+
+async def discover_devices(timeout=5.0, name_filter=None, addresses=None):
+    """扫描附近的蓝牙设备并返回设备列表。
+    
+    :param timeout: 最长扫描时间（秒）
+    :param name_filter: 可选。只返回名称等于该值的设备
+    :param addresses: 可选。要查找的设备地址集合，全部发现后提前结束
+    """
+    devices = []
+    async for device, _ in scan_devices_stream(timeout, name_filter, addresses):
+        devices.append(device)
     return devices
 
-async def connect_to_device(address):
-    """连接到指定地址的蓝牙设备，并保持连接状态。"""
-    client = BleakClient(address)
+async def resolve_device(address, timeout=5.0):
+    """根据地址获取BLEDevice对象。
+    
+    优先使用最近的广播缓存，未命中时才针对该地址进行定向扫描。
+    
+    :param address: 设备地址
+    :param timeout: 定向扫描的超时时间（秒）
+    :return: BLEDevice对象，找不到返回None
+    """
+    device = presence_cache.get_device(address)
+    if device is not None:
+        return device
+
+    print(f"在场缓存未命中，定向扫描设备: {address}")
+    device = await BleakScanner.find_device_by_address(address, timeout=timeout)
+    if device is not None:
+        presence_cache.update(device)
+    return device
+
+async def connect_to_device(address, disconnected_callback=None):
+    """连接到指定地址的蓝牙设备，并保持连接状态。
+    
+    :param address: 设备地址或BLEDevice对象
+    :param disconnected_callback: 可选。连接断开时的回调函数，接收client参数
+    """
+    # 连续连接失败的设备在熔断期内直接跳过
+    breaker = circuit_breakers.get(address if isinstance(address, str) else address.address)
+    if not breaker.allow_request():
+        print(f"设备连续失败，熔断中，跳过连接: {address}")
+        return None
+
+    # 放行之后的每条退出路径都要记录结果，否则半开探测名额不会释放
+    try:
+        client = await _connect(address, disconnected_callback)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except BaseException:
+        breaker.record_failure()
+        raise
+    if client is None:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return client
+
+
+async def _connect(address, disconnected_callback):
+    """解析设备并建立连接，失败返回None"""
+    if isinstance(address, str):
+        device = await resolve_device(address)
+        if device is None:
+            print(f"找不到设备: {address}")
+            return None
+    else:
+        device = address
+    address = device.address
+
+    # 已缓存GATT信息的设备只发现需要的服务
+    service_uuids = gatt_cache.get_service_uuids(address)
+    if service_uuids:
+        client = BleakClient(device, disconnected_callback=disconnected_callback, services=service_uuids)
+    else:
+        client = BleakClient(device, disconnected_callback=disconnected_callback)
     await client.connect()
     if client.is_connected:
         print(f"成功连接到设备: {address}")
@@ -23,13 +145,16 @@ async def connect_to_device(address):
         return None
 
 # 发送和接收AT命令
-async def send_command(client, command, char_uuid=None, max_retries=3):
+async def send_command(client, command, char_uuid=None, max_retries=None, retry_policy=None):
     """通过BLE发送AT命令并接收响应。
     
+    设备连续失败后熔断器打开，在探测成功前直接返回None，不再占用等待时间。
+    
     :param client: BLE客户端对象
     :param command: 要发送的命令字符串
     :param char_uuid: 可选。指定写入/通知的特征UUID，默认使用APP特征
-    :param max_retries: 最大重试次数，默认为3
+    :param max_retries: 可选。最大尝试次数，默认使用重试策略的设置
+    :param retry_policy: 可选。重试策略RetryPolicy，默认使用全局策略
     """
     if client is None or not client.is_connected:
         print("设备未连接，无法发送命令")
@@ -39,45 +164,60 @@ async def send_command(client, command, char_uuid=None, max_retries=3):
     if char_uuid is None:
         char_uuid = APP_CHARACTERISTIC_UUID
         
-    for attempt in range(max_retries):
+    # 准备命令，确保以$\r\n结尾
+    command = command.rstrip("\r\n").rstrip("$") + "$\r\n"
+
+    breaker = circuit_breakers.get(client.address)
+    if not breaker.allow_request():
+        print(f"设备连续失败，熔断中，跳过命令: {client.address}")
+        return None
+
+    retry_policy = retry_policy or default_retry_policy
+    max_attempts = max_retries if max_retries is not None else retry_policy.max_attempts
+
+    # 同一连接上的命令排队逐条执行，重复的查询命令共享一次收发
+    queue = get_command_queue(client, char_uuid)
+    try:
+        response = await queue.submit(
+            command, lambda: _send_with_retries(client, command, char_uuid, max_attempts, retry_policy))
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except BaseException:
+        breaker.record_failure()
+        raise
+    if response is None:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+async def _send_with_retries(client, command, char_uuid, max_attempts, retry_policy):
+    """写入命令并等待响应，失败时按重试策略退避后重试"""
+    # 每个连接只订阅一次通知，响应按命令名与请求匹配
+    dispatcher = get_dispatcher(client, char_uuid)
+
+    for attempt in range(max_attempts):
         try:
-            # 确保服务发现已经完成
-            await client.get_services()
-
-            # 创建一个 Future，用于等待通知返回
-            loop = asyncio.get_running_loop()
-            response_future = loop.create_future()
-
-            # 通知回调函数
-            def notification_handler(sender, data):
-                try:
-                    result = data.decode()
-                except UnicodeDecodeError:
-                    result = data.hex()
-                print(f"收到通知: {result}")
-                if not response_future.done():
-                    response_future.set_result(result)
-
-            # 准备命令，确保以$\r\n结尾
-            command = command.rstrip("\r\n").rstrip("$") + "$\r\n"
-
-            # 启动通知并发送命令
-            await client.start_notify(char_uuid, notification_handler)            
             print(f"发送命令: {command.strip()}")
-            await client.write_gatt_char(char_uuid, command.encode(), response=True)
+            response_future = await dispatcher.send(command)
             
-            # 等待响应
-            await asyncio.sleep(3.0)
+            # 等待响应，收到通知即返回
             try:
-                response = await asyncio.wait_for(response_future, timeout=15.0)
-                await client.stop_notify(char_uuid)
+                response = await dispatcher.wait(response_future, timeout=retry_policy.timeout)
+                print(f"命令耗时: {dispatcher.last_latency}")
                 return response
             except asyncio.TimeoutError:
-                await client.stop_notify(char_uuid)
                 print(f"第{attempt+1}次尝试超时")
         except Exception as e:
             print(f"第{attempt+1}次尝试失败: {e}")
-            await asyncio.sleep(1.0)
+            # 订阅可能已失效，下一次尝试重新订阅
+            await dispatcher.reset()
+            if not client.is_connected:
+                break
+        if attempt + 1 < max_attempts:
+            await asyncio.sleep(retry_policy.delay(attempt))
     
     print("所有重试均失败")
-    return None 
\ No newline at end of file
+    return None
@@ -10,36 +10,184 @@ def format_command(command_type, *args):
     command = f"AT+{command_type}=" + ",".join(map(str, args))
     return command
 
+
+class AckRecord:
+    """
+    "+ACK:" 响应解码结果的基类。
+    子类通过 FIELDS 声明字段名和类型，可选字段缺失时为None。
+    raw 保存设备返回的原始字段文本，界面显示时按设备的原样输出数字。
+    """
+    __slots__ = ("raw",)
+    COMMAND = ""
+    # (字段名, 类型) 列表
+    FIELDS = ()
+    # 至少需要的字段数，少于此数视为格式错误
+    REQUIRED = 0
+
+    def __init__(self, *values):
+        self.raw = None
+        for (name, _), value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+        for name, _ in self.FIELDS[len(values):]:
+            setattr(self, name, None)
+
+    def values(self):
+        """按字段顺序返回全部字段值"""
+        return tuple(getattr(self, name) for name, _ in self.FIELDS)
+
+    def as_dict(self):
+        """转换为 字段名 -> 值 的字典"""
+        return {name: getattr(self, name) for name, _ in self.FIELDS}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __hash__(self):
+        return hash((type(self), self.values()))
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name, _ in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+    def text(self, name):
+        """字段的显示文本，有原始文本时使用原始文本"""
+        index = [field for field, _ in self.FIELDS].index(name)
+        if self.raw is not None and index < len(self.raw):
+            return self.raw[index].strip()
+        value = getattr(self, name)
+        return "" if value is None else str(value)
+
+    def describe(self):
+        """界面显示用的文本"""
+        if self.raw is not None:
+            return ",".join((self.COMMAND,) + self.raw)
+        return ",".join([self.COMMAND] + ["" if value is None else str(value) for value in self.values()])
+
+
+class LockResult(AckRecord):
+    """+ACK:BKSCT,<锁命令>,<结果>"""
+    __slots__ = ("lock_command", "result")
+    COMMAND = "BKSCT"
+    FIELDS = (("lock_command", int), ("result", int))
+    REQUIRED = 1
+
+
+class DeviceInfo(AckRecord):
+    """+ACK:BKINF,<锁状态>,<速度>,<当前里程>,<总里程>,<骑行时长>,<电量>,<头灯状态>"""
+    __slots__ = ("lock_status", "speed", "current_mileage", "total_mileage",
+                 "ride_time", "battery", "headlamp")
+    COMMAND = "BKINF"
+    FIELDS = (("lock_status", int), ("speed", float), ("current_mileage", float),
+              ("total_mileage", float), ("ride_time", int), ("battery", int), ("headlamp", int))
+    REQUIRED = 7
+
+    @property
+    def locked(self):
+        return self.lock_status != 0
+
+    @property
+    def headlamp_on(self):
+        return self.headlamp != 0
+
+    def describe(self):
+        return (f"锁状态: {'锁定' if self.locked else '解锁'}, "
+                f"速度: {self.text('speed')} km/h, "
+                f"当前里程: {self.text('current_mileage')} km, "
+                f"总里程: {self.text('total_mileage')} km, "
+                f"骑行时长: {self.text('ride_time')} s, "
+                f"电量: {self.text('battery')}%, "
+                f"头灯状态: {'开启' if self.headlamp_on else '关闭'}")
+
+
+class HeadlampResult(AckRecord):
+    """+ACK:BKLED,<结果>"""
+    __slots__ = ("result",)
+    COMMAND = "BKLED"
+    FIELDS = (("result", int),)
+    REQUIRED = 1
+
+
+class FirmwareVersion(AckRecord):
+    """+ACK:BKVER,<固件版本>"""
+    __slots__ = ("version",)
+    COMMAND = "BKVER"
+    FIELDS = (("version", str),)
+    REQUIRED = 1
+
+
+class PasswordResult(AckRecord):
+    """+ACK:BKPWD,<结果>"""
+    __slots__ = ("result",)
+    COMMAND = "BKPWD"
+    FIELDS = (("result", int),)
+    REQUIRED = 1
+
+
+class WarningResult(AckRecord):
+    """+ACK:BKWRN,<结果>"""
+    __slots__ = ("result",)
+    COMMAND = "BKWRN"
+    FIELDS = (("result", int),)
+    REQUIRED = 1
+
+
+class UnknownAck(AckRecord):
+    """表中没有的 "+ACK:" 响应，保留命令名和原始字段"""
+    __slots__ = ("command", "fields")
+    FIELDS = (("command", str), ("fields", tuple))
+
+    def describe(self):
+        return ",".join((self.command,) + self.fields)
+
+
+# 命令名 -> 解码记录类型
+RESPONSE_TYPES = {record.COMMAND: record for record in
+                  (LockResult, DeviceInfo, HeadlampResult, FirmwareVersion, PasswordResult, WarningResult)}
+
+_ACK_PREFIX = "+ACK:"
+
+
+def decode_response(response):
+    """
+    把设备返回的 "+ACK:" 响应解码为带数值字段的记录。
+    :param response: 设备返回的响应字符串，如 "+ACK:BKINF,0,0,0.0,12.5,0,80,0$"。
+    :return: AckRecord子类实例；不是 "+ACK:" 响应或格式错误时返回None。
+    """
+    if not response or not response.startswith(_ACK_PREFIX):
+        return None
+    parts = response[len(_ACK_PREFIX):].rstrip("$\r\n").split(",")
+    command = parts[0]
+    record_type = RESPONSE_TYPES.get(command)
+    if record_type is None:
+        return UnknownAck(command, tuple(parts[1:]))
+
+    values = parts[1:len(record_type.FIELDS) + 1]
+    if len(values) < record_type.REQUIRED:
+        return None
+    try:
+        record = record_type(*[cast(value.strip()) for (_, cast), value in zip(record_type.FIELDS, values)])
+    except ValueError:
+        return None
+    record.raw = tuple(parts[1:])
+    return record
+
+
+def decode_responses(responses):
+    """
+    批量解码响应。
+    :param responses: 响应字符串的可迭代对象。
+    :return: 与输入一一对应的解码结果列表，无法解码的位置为None。
+    """
+    return [decode_response(response) for response in responses]
+
+
 def parse_response(response):
     """
-    解析设备返回的响应。
+    解析设备返回的响应，生成界面显示用的文本。
     :param response: 设备返回的响应字符串。
     :return: 解析后的结果。
     """
-    if response.startswith("+ACK:BKINF,"):
-        # 去掉前缀和尾部的 "$"
-        content = response[len("+ACK:BKINF,"):].rstrip("$")
-        parts = content.split(",")
-        if len(parts) >= 7:
-            lock_status = parts[0].strip()
-            scooter_speed = parts[1].strip()
-            current_mileage = parts[2].strip()
-            total_mileage = parts[3].strip()
-            ride_time = parts[4].strip()
-            battery_percentage = parts[5].strip()
-            headlamp_status = parts[6].strip()
-
-            return (f"锁状态: {'解锁' if lock_status=='0' else '锁定'}, "
-                    f"速度: {scooter_speed} km/h, "
-                    f"当前里程: {current_mileage} km, "
-                    f"总里程: {total_mileage} km, "
-                    f"骑行时长: {ride_time} s, "
-                    f"电量: {battery_percentage}%, "
-                    f"头灯状态: {'关闭' if headlamp_status=='0' else '开启'}")
-        else:
-            return "响应格式错误"
-    elif response.startswith("+ACK:"):
-        # 其它命令返回，去掉前缀和尾部可能的 "$"
-        return response.split(":", 1)[1].rstrip("$")
-    else:
-        return "未知响应" 
\ No newline at end of file
+    if not response.startswith(_ACK_PREFIX):
+        return "未知响应"
+    record = decode_response(response)
+    return record.describe() if record else "响应格式错误"
@@ -0,0 +1,96 @@
+# 每台设备的命令队列：同一连接上的命令按顺序逐条执行，相同的查询命令合并为一次收发
+import asyncio
+import weakref
+
+from src.bluetooth.notify_dispatcher import command_name
+
+# 只读查询命令，多个调用方同时发送时可以共享同一次响应
+IDEMPOTENT_COMMANDS = frozenset({"BKINF", "BKVER"})
+
+# client -> {char_uuid: DeviceCommandQueue}
+_queues = weakref.WeakKeyDictionary()
+
+
+class DeviceCommandQueue:
+    """
+    单个连接、单个特征上的命令队列。
+
+    - 所有命令按提交顺序逐条执行，调用方不会在同一特征上交错写入
+    - 幂等查询命令在排队或执行期间再次提交时，直接共享正在进行的那一次的结果
+    """
+
+    def __init__(self, client, char_uuid):
+        self.client = client
+        self.char_uuid = char_uuid
+        self._lock = None
+        self._loop = None
+        # 规范化命令 -> 正在排队或执行的任务
+        self._inflight = {}
+
+        # 实际执行的命令数 / 被合并的命令数
+        self.executed = 0
+        self.coalesced = 0
+
+    def _bind_loop(self):
+        """绑定到当前事件循环，换了事件循环时丢弃旧循环中的状态"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._inflight.clear()
+
+    async def submit(self, command, send):
+        """
+        提交一条命令
+
+        Args:
+            command (str): 命令字符串
+            send: 无参函数，返回实际收发该命令的协程
+
+        Returns:
+            send协程的返回值（响应字符串）
+        """
+        self._bind_loop()
+        key = command.strip().rstrip("$")
+        if command_name(key) not in IDEMPOTENT_COMMANDS:
+            return await self._run(send)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            print(f"合并重复命令: {key}")
+        else:
+            task = asyncio.ensure_future(self._run(send))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        # 单个调用方取消等待时不影响其他共享该结果的调用方
+        return await asyncio.shield(task)
+
+    async def _run(self, send):
+        """排队并执行一次收发"""
+        async with self._lock:
+            self.executed += 1
+            return await send()
+
+    @property
+    def inflight_count(self):
+        """正在排队或执行的可合并命令数量"""
+        return len(self._inflight)
+
+
+def get_command_queue(client, char_uuid):
+    """
+    获取连接在指定特征上的命令队列，不存在则创建。
+    :param client: BLE客户端对象
+    :param char_uuid: 命令特征UUID
+    :return: DeviceCommandQueue
+    """
+    per_client = _queues.get(client)
+    if per_client is None:
+        per_client = {}
+        _queues[client] = per_client
+    queue = per_client.get(char_uuid)
+    if queue is None:
+        queue = DeviceCommandQueue(client, char_uuid)
+        per_client[char_uuid] = queue
+    return queue
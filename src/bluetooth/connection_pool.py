@@ -0,0 +1,258 @@
+# BLE连接池实现
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from src.bluetooth.ble_communication import connect_to_device
+from src.bluetooth.notify_dispatcher import release_dispatchers
+
+
+class BLEConnectionPool:
+    """
+    BLE连接池，复用已建立的BleakClient连接。
+
+    - 限制同时保持的连接数量，超出时按最近最少使用(LRU)顺序淘汰，正在使用的连接优先保留
+    - 通过断开回调及时感知连接丢失
+    - 后台保活任务：清理空闲连接，并为近期使用过的热点车辆重建掉线的连接
+    """
+
+    def __init__(self, max_connections=7, idle_timeout=120.0, keepalive_interval=15.0,
+                 keepalive_func=None):
+        """
+        初始化连接池
+
+        Args:
+            max_connections (int): 最大同时连接数（大多数蓝牙适配器上限为7左右）
+            idle_timeout (float): 连接空闲超过该时间（秒）后被保活任务断开
+            keepalive_interval (float): 保活任务的执行间隔（秒）
+            keepalive_func: 可选的保活协程函数，接收client参数，抛出异常视为连接失效
+        """
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_func = keepalive_func
+
+        # 地址 -> client，按使用时间排序，最近使用的在末尾
+        self._clients = OrderedDict()
+        # 地址 -> 最近一次使用的时间戳
+        self._last_used = {}
+        # 地址 -> 连接锁，避免同一设备被并发重复连接
+        self._connect_locks = {}
+        # 地址 -> 正在使用该连接的操作数
+        self._in_use = {}
+        self._loop = None
+        self._keepalive_task = None
+
+    def _bind_loop(self):
+        """
+        绑定到当前运行的事件循环。
+
+        BleakClient与创建它的事件循环绑定，如果调用方换了事件循环，
+        旧循环中建立的连接已不可用，需要全部丢弃。
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                print("事件循环已变更，丢弃旧连接")
+            self._clients.clear()
+            self._connect_locks.clear()
+            self._keepalive_task = None
+            self._loop = loop
+
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = loop.create_task(self._keepalive_loop())
+
+    def get(self, address):
+        """
+        获取已连接的客户端，不会发起新的连接
+
+        Args:
+            address (str): 设备地址
+
+        Returns:
+            client: 已连接的客户端对象，不存在或已断开则返回None
+        """
+        client = self._clients.get(address)
+        if client is None:
+            return None
+        if not client.is_connected:
+            self._clients.pop(address, None)
+            return None
+        self._touch(address)
+        return client
+
+    async def acquire(self, address):
+        """
+        获取指定设备的连接，必要时建立新连接
+
+        Args:
+            address (str): 设备地址
+
+        Returns:
+            client: 连接的客户端对象，失败则返回None
+        """
+        self._bind_loop()
+
+        client = self.get(address)
+        if client is not None:
+            return client
+
+        lock = self._connect_locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            # 等待锁期间可能已经由其他协程连接成功
+            client = self.get(address)
+            if client is not None:
+                return client
+
+            await self._evict_if_full()
+
+            try:
+                client = await connect_to_device(address, disconnected_callback=self._on_disconnected)
+            except Exception as e:
+                print(f"连接池连接设备 {address} 失败: {e}")
+                return None
+
+            if client is None or not client.is_connected:
+                return None
+
+            self._clients[address] = client
+            self._touch(address)
+            return client
+
+    @contextmanager
+    def in_use(self, address):
+        """
+        标记连接正在使用，期间淘汰时跳过该连接，避免断开正在收发命令的设备
+
+        用法：client = await pool.acquire(address) 之后立即 with pool.in_use(address): ...
+        结束时刷新最近使用时间，按命令完成的先后参与LRU排序。
+
+        Args:
+            address (str): 设备地址
+        """
+        self._in_use[address] = self._in_use.get(address, 0) + 1
+        try:
+            yield
+        finally:
+            count = self._in_use.pop(address) - 1
+            if count:
+                self._in_use[address] = count
+            self._touch(address)
+
+    async def release(self, address):
+        """
+        主动断开并移除指定设备的连接
+
+        Args:
+            address (str): 设备地址
+        """
+        client = self._clients.pop(address, None)
+        self._last_used.pop(address, None)
+        await self._disconnect(client)
+
+    async def close(self):
+        """断开连接池中的全部连接并停止保活任务"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+
+        clients = list(self._clients.values())
+        self._clients.clear()
+        self._last_used.clear()
+        for client in clients:
+            await self._disconnect(client)
+
+    def __contains__(self, address):
+        return self.get(address) is not None
+
+    def __len__(self):
+        return len(self._clients)
+
+    @property
+    def addresses(self):
+        """当前保持连接的设备地址列表，按最近使用时间从旧到新排序"""
+        return list(self._clients.keys())
+
+    def _touch(self, address):
+        """更新设备的最近使用时间"""
+        self._last_used[address] = time.monotonic()
+        if address in self._clients:
+            self._clients.move_to_end(address)
+
+    async def _evict_if_full(self):
+        """连接数达到上限时，淘汰最近最少使用的空闲连接；全部在使用时才淘汰最久未使用的连接"""
+        while len(self._clients) >= self.max_connections:
+            idle = [address for address in self._clients if not self._in_use.get(address)]
+            address = idle[0] if idle else next(iter(self._clients))
+            client = self._clients.pop(address)
+            self._last_used.pop(address, None)
+            print(f"连接池已满，淘汰最久未使用的设备: {address}")
+            await self._disconnect(client)
+
+    def _on_disconnected(self, client):
+        """BleakClient断开连接回调"""
+        address = client.address
+        if self._clients.get(address) is client:
+            self._clients.pop(address, None)
+            print(f"设备连接已断开: {address}")
+
+    async def _disconnect(self, client):
+        """安全地断开一个客户端"""
+        if client is None:
+            return
+        try:
+            if client.is_connected:
+                await release_dispatchers(client)
+                await client.disconnect()
+        except Exception as e:
+            print(f"断开设备 {client.address} 时出错: {e}")
+
+    def _is_hot(self, address, now):
+        """设备最近是否被使用过（在空闲超时时间内）"""
+        last_used = self._last_used.get(address)
+        return last_used is not None and now - last_used < self.idle_timeout
+
+    async def _keepalive_loop(self):
+        """后台保活任务"""
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                await self._keepalive_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"连接池保活任务出错: {e}")
+
+    async def _keepalive_once(self):
+        """执行一轮保活：断开空闲连接、探测活跃连接、重连掉线的热点设备"""
+        now = time.monotonic()
+
+        for address in list(self._last_used.keys()):
+            # 正在使用的连接由使用方负责，不做空闲检查和保活探测
+            if self._in_use.get(address):
+                continue
+            if not self._is_hot(address, now):
+                # 空闲过久，释放连接槽位
+                if address in self._clients:
+                    print(f"设备 {address} 空闲超时，断开连接")
+                await self.release(address)
+                continue
+
+            client = self._clients.get(address)
+            if client is not None and client.is_connected:
+                if self.keepalive_func is not None:
+                    try:
+                        await self.keepalive_func(client)
+                    except Exception as e:
+                        print(f"设备 {address} 保活失败: {e}")
+                        await self.release(address)
+                continue
+
+            # 热点设备掉线，后台重建连接，使下一次操作无需等待连接
+            self._clients.pop(address, None)
+            last_used = self._last_used.get(address)
+            if await self.acquire(address) is not None:
+                print(f"已重新连接热点设备: {address}")
+            # 重连不算作一次使用，保留原来的使用时间以便按时淘汰；连接失败则下一轮再试
+            self._last_used[address] = last_used
@@ -0,0 +1,178 @@
+# GATT服务/特征缓存，按设备地址和型号保存已解析的特征句柄
+import json
+import os
+import threading
+
+# 默认设备型号
+DEFAULT_MODEL = "zk301"
+
+
+class GATTCache:
+    """
+    GATT特征句柄缓存。
+
+    缓存项以 (设备地址, 型号) 为键，记录特征UUID对应的句柄和所属服务UUID。
+    同型号设备通常暴露相同的GATT表，因此还会记录一份型号级别的默认值，
+    新设备第一次连接时也可以直接使用。缓存的句柄在设备上找不到时调用 invalidate 作废该设备的缓存。
+    """
+
+    def __init__(self, path=None):
+        """
+        初始化缓存
+
+        Args:
+            path (str, optional): 持久化文件路径，不提供则只保存在内存中
+        """
+        self.path = path
+        # (地址, 型号) -> {"service_uuids": [...], "handles": {char_uuid: handle}}
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def _key(address, model):
+        return (address.upper() if address else "*", model or DEFAULT_MODEL)
+
+    def enable_persistence(self, path):
+        """
+        启用磁盘持久化并加载已有缓存
+
+        Args:
+            path (str): 持久化文件路径
+        """
+        self.path = path
+        self.load()
+
+    def get_handle(self, address, char_uuid, model=DEFAULT_MODEL):
+        """
+        查询特征句柄，先查设备级缓存，再查型号级缓存
+
+        Returns:
+            int: 特征句柄，未命中返回None
+        """
+        char_uuid = char_uuid.lower()
+        with self._lock:
+            for key in (self._key(address, model), self._key(None, model)):
+                entry = self._entries.get(key)
+                if entry and char_uuid in entry["handles"]:
+                    return entry["handles"][char_uuid]
+        return None
+
+    def get_service_uuids(self, address, model=DEFAULT_MODEL):
+        """
+        查询设备需要的服务UUID列表，可用于连接时只发现这些服务
+
+        Returns:
+            list: 服务UUID列表，未命中返回None
+        """
+        with self._lock:
+            for key in (self._key(address, model), self._key(None, model)):
+                entry = self._entries.get(key)
+                if entry and entry["service_uuids"]:
+                    return list(entry["service_uuids"])
+        return None
+
+    def put(self, address, char_uuid, handle, service_uuid=None, model=DEFAULT_MODEL):
+        """
+        记录特征句柄，同时更新型号级别的默认值
+        """
+        char_uuid = char_uuid.lower()
+        changed = False
+        with self._lock:
+            for key in (self._key(address, model), self._key(None, model)):
+                entry = self._entries.setdefault(key, {"service_uuids": [], "handles": {}})
+                if entry["handles"].get(char_uuid) != handle:
+                    entry["handles"][char_uuid] = handle
+                    changed = True
+                if service_uuid and service_uuid.lower() not in entry["service_uuids"]:
+                    entry["service_uuids"].append(service_uuid.lower())
+                    changed = True
+        if changed:
+            self.save()
+
+    def invalidate(self, address, model=DEFAULT_MODEL):
+        """
+        作废一台设备的缓存；型号级默认值保留，其他设备不受影响
+        """
+        with self._lock:
+            removed = self._entries.pop(self._key(address, model), None)
+        if removed:
+            print(f"已作废设备 {address} 的GATT缓存")
+            self.save()
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._entries.clear()
+        self.save()
+
+    async def resolve(self, client, char_uuid, model=DEFAULT_MODEL, refresh=False):
+        """
+        解析写入/通知使用的特征：优先返回缓存的句柄，否则从已发现的服务中查找并写入缓存
+
+        Args:
+            client: BLE客户端对象
+            char_uuid (str): 特征UUID
+            model (str): 设备型号
+            refresh (bool): 忽略缓存（包括型号级默认值），直接从已发现的服务中查找
+
+        Returns:
+            int或str: 特征句柄，无法解析时返回原UUID
+        """
+        address = client.address
+        handle = None if refresh else self.get_handle(address, char_uuid, model)
+        if handle is not None:
+            return handle
+
+        try:
+            characteristic = client.services.get_characteristic(char_uuid)
+        except Exception as e:
+            print(f"查找特征 {char_uuid} 失败: {e}")
+            return char_uuid
+
+        if characteristic is None:
+            return char_uuid
+
+        self.put(address, char_uuid, characteristic.handle,
+                 getattr(characteristic, "service_uuid", None), model)
+        return characteristic.handle
+
+    def load(self):
+        """从磁盘加载缓存"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                for item in data:
+                    key = (item["address"], item["model"])
+                    self._entries[key] = {
+                        "service_uuids": list(item.get("service_uuids", [])),
+                        "handles": {uuid: int(handle) for uuid, handle in item.get("handles", {}).items()}
+                    }
+        except Exception as e:
+            print(f"加载GATT缓存失败: {e}")
+
+    def save(self):
+        """把缓存写入磁盘（未启用持久化时什么也不做）"""
+        if not self.path:
+            return
+        with self._lock:
+            data = [
+                {"address": address, "model": model,
+                 "service_uuids": entry["service_uuids"], "handles": entry["handles"]}
+                for (address, model), entry in self._entries.items()
+            ]
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存GATT缓存失败: {e}")
+
+
+# 全局默认缓存，BLE通信模块和BLEModel共用
+gatt_cache = GATTCache()
@@ -0,0 +1,289 @@
+# BLE通知分发：每个连接保持一个长期通知订阅，并按命令名匹配请求与响应
+import asyncio
+import itertools
+import time
+import weakref
+from collections import deque
+
+from bleak.exc import BleakCharacteristicNotFoundError
+
+from src.bluetooth.gatt_cache import gatt_cache
+
+# 特征查找失败的异常：只有这类错误说明缓存的句柄已失效
+CHARACTERISTIC_LOOKUP_ERRORS = (BleakCharacteristicNotFoundError, KeyError)
+
+# client -> {char_uuid: NotificationDispatcher}
+_dispatchers = weakref.WeakKeyDictionary()
+
+
+def command_name(command):
+    """
+    提取AT命令的命令名。
+    :param command: 命令字符串，如 "AT+BKSCT=zk301,0"
+    :return: 命令名，如 "BKSCT"；无法识别时返回None
+    """
+    command = command.strip()
+    if not command.startswith("AT+"):
+        return None
+    return command[3:].split("=", 1)[0].rstrip("$\r\n").strip() or None
+
+
+def response_name(response):
+    """
+    提取响应对应的命令名。
+    :param response: 响应字符串，如 "+ACK:BKSCT,0$"
+    :return: 命令名，如 "BKSCT"；无法识别时返回None
+    """
+    if not response.startswith("+ACK:"):
+        return None
+    return response[5:].split(",", 1)[0].rstrip("$\r\n").strip() or None
+
+
+class CommandLatency:
+    """单条命令的耗时分解（秒）"""
+
+    __slots__ = ("command", "write", "first_notify", "parse", "total")
+
+    def __init__(self, command, write, first_notify, parse):
+        self.command = command
+        # 写入特征（含写响应）耗时
+        self.write = write
+        # 写入完成到收到第一个匹配通知的耗时
+        self.first_notify = first_notify
+        # 通知解码与请求匹配耗时
+        self.parse = parse
+        self.total = write + first_notify + parse
+
+    def __repr__(self):
+        return (f"CommandLatency({self.command}: 写入 {self.write * 1000:.1f}ms, "
+                f"首个通知 {self.first_notify * 1000:.1f}ms, "
+                f"解析 {self.parse * 1000:.3f}ms, 总计 {self.total * 1000:.1f}ms)")
+
+
+class NotificationDispatcher:
+    """
+    单个连接、单个特征上的通知分发器。
+
+    只在第一次使用时订阅一次通知，之后每条命令只需一次写入和一次通知。
+    收到 "+ACK:<CMD>" 响应时按命令名交给最早发出的同名请求，
+    因此同一连接上可以同时有多条不同的命令在等待响应。
+    没有命令名的通知交给最早发出的请求；命令名没有对应请求的响应直接丢弃。
+    """
+
+    def __init__(self, client, char_uuid):
+        self.client = client
+        self.char_uuid = char_uuid
+        # 实际用于写入/通知的特征：缓存的句柄或UUID
+        self._char = None
+        # 缓存的句柄失效后，下一次直接从已发现的服务中解析
+        self._refresh = False
+        self._subscribed = False
+        self._subscribe_lock = None
+        # 命令名 -> deque[(序号, future)]
+        self._pending = {}
+        self._sequence = itertools.count()
+        # future -> [开始时间, 写入完成时间, 收到通知时间, 解析完成时间]
+        self._timings = {}
+        # 最近一条完成的命令的耗时分解
+        self.last_latency = None
+
+    async def start(self):
+        """订阅通知（只执行一次）"""
+        if self._subscribed:
+            return
+        if self._subscribe_lock is None:
+            self._subscribe_lock = asyncio.Lock()
+        async with self._subscribe_lock:
+            if self._subscribed:
+                return
+            if self._char is None:
+                self._char = await gatt_cache.resolve(self.client, self.char_uuid, refresh=self._refresh)
+                self._refresh = False
+            try:
+                await self.client.start_notify(self._char, self._handle_notification)
+            except CHARACTERISTIC_LOOKUP_ERRORS:
+                self._invalidate_char()
+                raise
+            self._subscribed = True
+
+    async def stop(self):
+        """取消通知订阅，并让所有等待中的请求失败"""
+        if self._subscribed:
+            self._subscribed = False
+            try:
+                if self.client.is_connected:
+                    await self.client.stop_notify(self._char)
+            except Exception as e:
+                print(f"取消通知订阅失败: {e}")
+        self._fail_all(ConnectionError("通知订阅已关闭"))
+
+    async def reset(self):
+        """取消当前订阅，下一次发送前会重新订阅；等待中的请求保留，重新订阅后仍可收到响应"""
+        if not self._subscribed:
+            return
+        self._subscribed = False
+        try:
+            # 先取消旧订阅，避免后端重复注册回调
+            if self.client.is_connected:
+                await self.client.stop_notify(self._char)
+        except Exception as e:
+            print(f"取消通知订阅失败: {e}")
+
+    def _invalidate_char(self):
+        """缓存的特征句柄在设备上找不到时作废该设备的缓存，下一次从已发现的服务重新解析"""
+        if self._char is not None and self._char != self.char_uuid:
+            gatt_cache.invalidate(self.client.address)
+            self._refresh = True
+        self._char = None
+
+    async def send(self, command):
+        """
+        发送命令，返回等待响应的future。
+        :param command: 已带结束符的命令字符串
+        :return: 收到匹配响应时完成的future
+        """
+        await self.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        name = command_name(command)
+        self._pending.setdefault(name, deque()).append((next(self._sequence), future))
+        timing = [time.perf_counter(), None, None, None]
+        self._timings[future] = timing
+
+        try:
+            await self.client.write_gatt_char(self._char, command.encode(), response=True)
+        except Exception as e:
+            self._discard(name, future)
+            self._timings.pop(future, None)
+            # 普通写入错误（超时、断开等）不说明句柄失效，不作废缓存
+            if isinstance(e, CHARACTERISTIC_LOOKUP_ERRORS):
+                self._invalidate_char()
+            raise
+        timing[1] = time.perf_counter()
+        return future
+
+    async def wait(self, future, timeout):
+        """
+        等待send返回的future完成。
+        :param future: send返回的future
+        :param timeout: 超时时间（秒）
+        :return: 响应字符串
+        """
+        try:
+            result = await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            timing = self._timings.pop(future, None)
+            for name, queue in list(self._pending.items()):
+                if any(f is future for _, f in queue):
+                    self._discard(name, future)
+                    break
+
+        if timing is not None and None not in timing:
+            start, written, notified, parsed = timing
+            # 通知可能早于写响应到达
+            written = min(written, notified)
+            self.last_latency = CommandLatency(
+                response_name(result) or "?",
+                written - start, notified - written, parsed - notified
+            )
+        return result
+
+    async def request(self, command, timeout):
+        """发送命令并等待匹配的响应"""
+        future = await self.send(command)
+        return await self.wait(future, timeout)
+
+    @property
+    def pending_count(self):
+        """等待响应的请求数量"""
+        return sum(len(queue) for queue in self._pending.values())
+
+    def _handle_notification(self, sender, data):
+        """通知回调：把响应交给对应的等待请求"""
+        notified = time.perf_counter()
+        try:
+            result = data.decode()
+        except UnicodeDecodeError:
+            result = data.hex()
+        print(f"收到通知: {result}")
+
+        name = response_name(result)
+        if name is not None:
+            queue = self._pending.get(name)
+        else:
+            # 没有命令名的通知无法按名匹配，交给最早发出的请求
+            queue = self._oldest_queue()
+        if not queue:
+            # 迟到的响应（请求已超时）或其他命令的响应，不能交给别的请求
+            print(f"收到未匹配的通知: {result}")
+            return
+
+        while queue:
+            _, future = queue.popleft()
+            if not future.done():
+                timing = self._timings.get(future)
+                if timing is not None:
+                    timing[2] = notified
+                    timing[3] = time.perf_counter()
+                future.set_result(result)
+                return
+
+    def _oldest_queue(self):
+        """返回队首请求最早发出的等待队列"""
+        oldest = None
+        for queue in self._pending.values():
+            if queue and (oldest is None or queue[0][0] < oldest[0][0]):
+                oldest = queue
+        return oldest
+
+    def _discard(self, name, future):
+        """从等待队列中移除一个请求"""
+        queue = self._pending.get(name)
+        if not queue:
+            return
+        for item in queue:
+            if item[1] is future:
+                queue.remove(item)
+                break
+        if not queue:
+            self._pending.pop(name, None)
+
+    def _fail_all(self, exc):
+        """让所有等待中的请求以异常结束"""
+        for queue in self._pending.values():
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(exc)
+        self._pending.clear()
+        self._timings.clear()
+
+
+def get_dispatcher(client, char_uuid):
+    """
+    获取连接在指定特征上的通知分发器，不存在则创建。
+    :param client: BLE客户端对象
+    :param char_uuid: 通知/写入特征UUID
+    :return: NotificationDispatcher
+    """
+    per_client = _dispatchers.get(client)
+    if per_client is None:
+        per_client = {}
+        _dispatchers[client] = per_client
+    dispatcher = per_client.get(char_uuid)
+    if dispatcher is None:
+        dispatcher = NotificationDispatcher(client, char_uuid)
+        per_client[char_uuid] = dispatcher
+    return dispatcher
+
+
+async def release_dispatchers(client):
+    """
+    关闭并移除连接上的全部通知分发器（断开连接前调用）。
+    :param client: BLE客户端对象
+    """
+    per_client = _dispatchers.pop(client, None)
+    if not per_client:
+        return
+    for dispatcher in per_client.values():
+        await dispatcher.stop()
@@ -0,0 +1,159 @@
+# 设备在场缓存：记录最近收到的广播，连接已知设备时无需重新扫描；按平滑后的信号强度给出远近排序
+import threading
+import time
+
+
+class PresenceEntry:
+    """一个设备最近一次被看到时的信息"""
+
+    __slots__ = ("device", "rssi", "smoothed_rssi", "last_seen")
+
+    def __init__(self, device, rssi, last_seen, smoothed_rssi=None):
+        self.device = device
+        # 最近一次广播的RSSI
+        self.rssi = rssi
+        # 指数平滑后的RSSI，用于远近排序，避免单次广播的波动
+        self.smoothed_rssi = rssi if smoothed_rssi is None else smoothed_rssi
+        self.last_seen = last_seen
+
+
+class PresenceCache:
+    """
+    最近广播缓存：地址 -> (BLEDevice, RSSI, 最后看到时间)。
+
+    超过TTL的记录视为设备已不在附近。可以直接作为扫描的detection_callback使用。
+    """
+
+    def __init__(self, ttl=60.0, rssi_alpha=0.3):
+        """
+        初始化缓存
+
+        Args:
+            ttl (float): 记录有效期（秒）
+            rssi_alpha (float): RSSI指数平滑系数，越大越偏向最新一次广播
+        """
+        self.ttl = ttl
+        self.rssi_alpha = rssi_alpha
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, device, advertisement_data):
+        """作为扫描回调使用"""
+        self.update(device, advertisement_data)
+
+    def update(self, device, advertisement_data=None, rssi=None):
+        """
+        记录一条广播
+
+        Args:
+            device: BLEDevice对象
+            advertisement_data: 广播数据，用于获取RSSI
+            rssi (int, optional): 没有广播数据时直接指定RSSI
+        """
+        if advertisement_data is not None:
+            rssi = advertisement_data.rssi
+        key = device.address.upper()
+        now = time.monotonic()
+        with self._lock:
+            previous = self._entries.get(key)
+            smoothed = rssi
+            # 只和有效期内的记录做平滑，设备离开后再回来时重新开始
+            if previous is not None and now - previous.last_seen <= self.ttl:
+                if rssi is None:
+                    smoothed = previous.smoothed_rssi
+                elif previous.smoothed_rssi is not None:
+                    smoothed = self.rssi_alpha * rssi + (1 - self.rssi_alpha) * previous.smoothed_rssi
+            self._entries[key] = PresenceEntry(device, rssi, now, smoothed)
+
+    def get(self, address):
+        """
+        查询设备的最近记录
+
+        Args:
+            address (str): 设备地址
+
+        Returns:
+            PresenceEntry: 有效期内的记录，过期或不存在返回None
+        """
+        key = address.upper()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.last_seen > self.ttl:
+                del self._entries[key]
+                return None
+            return entry
+
+    def get_device(self, address):
+        """查询设备的BLEDevice对象，过期或不存在返回None"""
+        entry = self.get(address)
+        return entry.device if entry else None
+
+    def is_present(self, address):
+        """设备是否在有效期内被看到过"""
+        return self.get(address) is not None
+
+    def get_rssi(self, address):
+        """设备平滑后的RSSI，过期或未知返回None"""
+        entry = self.get(address)
+        return entry.smoothed_rssi if entry else None
+
+    def nearest(self, count=None, addresses=None):
+        """
+        按信号强度从强到弱列出附近的设备
+
+        Args:
+            count (int, optional): 最多返回的设备数
+            addresses (iterable, optional): 只在这些地址中选择，如已注册车辆的地址
+
+        Returns:
+            list: [(地址, 平滑后的RSSI)]，信号最强的在前
+        """
+        self.prune()
+        wanted = {address.upper() for address in addresses} if addresses is not None else None
+        with self._lock:
+            ranked = [(key, entry.smoothed_rssi) for key, entry in self._entries.items()
+                      if entry.smoothed_rssi is not None and (wanted is None or key in wanted)]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:count] if count is not None else ranked
+
+    def rank(self, addresses):
+        """
+        按信号强度对地址排序，信号强的在前；不在附近或没有RSSI的保持原有顺序排在最后
+
+        Args:
+            addresses (iterable): 设备地址
+
+        Returns:
+            list: 排序后的地址
+        """
+        rssi = {address: self.get_rssi(address) for address in addresses}
+        # sorted是稳定排序，相同优先级的地址保持原有顺序
+        return sorted(rssi, key=lambda address: (rssi[address] is None, -(rssi[address] or 0)))
+
+    def present_addresses(self):
+        """有效期内被看到过的全部设备地址"""
+        self.prune()
+        with self._lock:
+            return list(self._entries.keys())
+
+    def prune(self):
+        """清理过期记录"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now - entry.last_seen > self.ttl]
+            for key in expired:
+                del self._entries[key]
+
+    def clear(self):
+        """清空全部记录"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 全局默认缓存，扫描结果会自动写入
+presence_cache = PresenceCache()
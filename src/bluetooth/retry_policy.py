@@ -0,0 +1,156 @@
+# BLE重试策略与按设备地址的熔断器
+import random
+import threading
+import time
+
+
+class RetryPolicy:
+    """
+    重试策略：每次尝试有独立超时，两次尝试之间按指数退避并加随机抖动。
+    """
+
+    def __init__(self, max_attempts=3, timeout=5.0, base_delay=0.5, max_delay=8.0, jitter=0.5):
+        """
+        初始化重试策略
+
+        Args:
+            max_attempts (int): 最大尝试次数
+            timeout (float): 每次尝试等待响应的超时（秒）
+            base_delay (float): 第一次重试前的退避时间（秒）
+            max_delay (float): 退避时间上限（秒）
+            jitter (float): 抖动比例，0.5表示退避时间在[50%, 100%]之间随机
+        """
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        第attempt次尝试（从0开始）失败后的退避时间
+
+        Args:
+            attempt (int): 已失败的尝试序号
+
+        Returns:
+            float: 退避时间（秒）
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+
+class CircuitBreaker:
+    """
+    单个设备的熔断器。
+
+    - 关闭：正常放行，连续失败达到阈值后打开
+    - 打开：直接拒绝，经过reset_timeout后进入半开
+    - 半开：只放行一次探测，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "关闭"
+    OPEN = "打开"
+    HALF_OPEN = "半开"
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        """
+        初始化熔断器
+
+        Args:
+            failure_threshold (int): 打开熔断器所需的连续失败次数
+            reset_timeout (float): 打开后多久允许一次探测（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self):
+        """
+        是否放行一次请求
+
+        Returns:
+            bool: 放行返回True，熔断中返回False
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """记录一次成功，熔断器关闭"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """放弃一次已放行但没有结果的请求（如被取消），不计入成败，释放半开探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次失败，连续失败达到阈值或半开探测失败时打开熔断器"""
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class CircuitBreakerRegistry:
+    """按设备地址管理熔断器"""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, address):
+        """获取设备的熔断器，不存在则创建"""
+        key = address.upper()
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[key] = breaker
+            return breaker
+
+    def open_addresses(self):
+        """当前处于熔断状态（打开或等待探测）的设备地址"""
+        with self._lock:
+            return [address for address, breaker in self._breakers.items()
+                    if breaker.state != CircuitBreaker.CLOSED]
+
+    def reset(self, address=None):
+        """清除指定设备（或全部设备）的熔断状态"""
+        with self._lock:
+            if address is None:
+                self._breakers.clear()
+            else:
+                self._breakers.pop(address.upper(), None)
+
+
+# 全局默认策略与熔断器，蓝牙通信模块、BLEModel和ScooterController共用
+default_retry_policy = RetryPolicy()
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,534 @@
+# 进程内模拟的zk301滑板车，用于在没有真实车辆时对BLE链路做压测
+import asyncio
+import random
+import struct
+import sys
+import time
+import zlib
+
+from bleak.exc import BleakCharacteristicNotFoundError
+
+from src.bluetooth.ble_communication import APP_CHARACTERISTIC_UUID
+from src.firmware.updater import OTA_CHARACTERISTIC_UUID, OTA_PACKET_HEADER
+from src.mqtt.metrics import percentile
+
+# 模拟的GATT表
+SIMULATED_SERVICE_UUID = "00002c00-0000-1000-8000-00805f9b34fb"
+SIMULATED_CHARACTERISTIC_HANDLE = 0x0010
+SIMULATED_OTA_HANDLE = 0x0014
+
+
+class SimulatedDevice:
+    """模拟的BLEDevice"""
+
+    __slots__ = ("address", "name", "details")
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+        self.details = None
+
+    def __repr__(self):
+        return f"SimulatedDevice({self.address}, {self.name})"
+
+
+class SimulatedAdvertisement:
+    """模拟的AdvertisementData"""
+
+    __slots__ = ("local_name", "rssi", "service_uuids", "manufacturer_data", "service_data", "tx_power")
+
+    def __init__(self, local_name, rssi):
+        self.local_name = local_name
+        self.rssi = rssi
+        self.service_uuids = [SIMULATED_SERVICE_UUID]
+        self.manufacturer_data = {}
+        self.service_data = {}
+        self.tx_power = None
+
+
+class SimulatedScooter:
+    """
+    模拟的zk301滑板车，实现AT命令协议：
+    BKSCT(锁控制)、BKINF(设备信息)、BKLED(头灯)、BKVER(版本)、BKPWD(修改密码)、BKWRN(警告)
+    """
+
+    def __init__(self, address, password="zk301", name="zk301", rssi=-60,
+                 latency=(0.05, 0.15), connect_latency=(0.2, 0.5),
+                 drop_rate=0.0, disconnect_rate=0.0, firmware_version="V1.0.0",
+                 ota_disconnect_at=None):
+        """
+        初始化模拟车辆
+
+        Args:
+            address (str): 蓝牙地址
+            password (str): BLE密码
+            name (str): 广播名称
+            rssi (int): 平均信号强度
+            latency (tuple): 命令响应延迟范围（秒）
+            connect_latency (tuple): 建立连接的延迟范围（秒）
+            drop_rate (float): 响应丢失的概率
+            disconnect_rate (float): 每条命令后连接被断开的概率
+            firmware_version (str): 固件版本号
+            ota_disconnect_at (int, optional): OTA接收到该偏移量时断开一次连接
+        """
+        self.address = address
+        self.password = password
+        self.name = name
+        self.rssi = rssi
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.firmware_version = firmware_version
+        self.ota_disconnect_at = ota_disconnect_at
+
+        # 车辆状态
+        self.locked = True
+        self.speed = 0
+        self.current_mileage = 0.0
+        self.total_mileage = round(random.uniform(10, 2000), 1)
+        self.ride_time = 0
+        self.battery = random.randint(20, 100)
+        self.headlamp = 0
+        self.warnings = 0
+
+        # OTA接收缓冲区
+        self.firmware_buffer = bytearray()
+
+        # 统计
+        self.commands_received = 0
+        self.responses_dropped = 0
+
+    def handle_command(self, command):
+        """
+        处理一条AT命令
+
+        Args:
+            command (str): 命令字符串，如 "AT+BKINF=zk301,0$\\r\\n"
+
+        Returns:
+            str: 响应字符串，无法识别的命令返回None
+        """
+        self.commands_received += 1
+        command = command.strip().rstrip("$")
+        if not command.startswith("AT+") or "=" not in command:
+            return None
+
+        name, args = command[3:].split("=", 1)
+        args = args.split(",")
+        password = args[0]
+        if password != self.password:
+            return f"+ACK:{name},0$"
+
+        if name == "BKSCT":
+            lock_command = int(args[1]) if len(args) > 1 else 0
+            if lock_command in (0, 2):
+                self.locked = False
+            elif lock_command == 1:
+                self.locked = True
+                self.speed = 0
+            return f"+ACK:BKSCT,{lock_command},1$"
+        if name == "BKINF":
+            return (f"+ACK:BKINF,{1 if self.locked else 0},{self.speed},{self.current_mileage},"
+                    f"{self.total_mileage},{self.ride_time},{self.battery},{self.headlamp}$")
+        if name == "BKLED":
+            self.headlamp = int(args[2]) if len(args) > 2 else 0
+            return "+ACK:BKLED,1$"
+        if name == "BKVER":
+            return f"+ACK:BKVER,{self.firmware_version}$"
+        if name == "BKPWD":
+            if len(args) > 1 and args[1]:
+                self.password = args[1]
+                return "+ACK:BKPWD,1$"
+            return "+ACK:BKPWD,0$"
+        if name == "BKWRN":
+            self.warnings += 1
+            return "+ACK:BKWRN,1$"
+        return None
+
+    def handle_ota_packet(self, packet):
+        """
+        处理一个OTA数据包（4字节偏移 + 数据），按偏移写入接收缓冲区
+
+        Returns:
+            bool: 是否需要模拟断开连接
+        """
+        offset = OTA_PACKET_HEADER.unpack_from(packet)[0]
+        payload = bytes(packet[OTA_PACKET_HEADER.size:])
+        if offset > len(self.firmware_buffer):
+            # 中间有数据丢失，丢弃该包
+            return False
+        self.firmware_buffer[offset:offset + len(payload)] = payload
+        if self.ota_disconnect_at is not None and offset + len(payload) >= self.ota_disconnect_at:
+            self.ota_disconnect_at = None
+            return True
+        return False
+
+    def firmware_crc(self):
+        """接收缓冲区的CRC32（4字节小端）"""
+        return struct.pack("<I", zlib.crc32(self.firmware_buffer) & 0xFFFFFFFF)
+
+    def sample_rssi(self):
+        """带随机抖动的信号强度"""
+        return self.rssi + random.randint(-6, 6)
+
+
+class SimulatedFleet:
+    """一组模拟车辆"""
+
+    def __init__(self, count=0, address_prefix="SIM", **scooter_kwargs):
+        """
+        初始化模拟车队
+
+        Args:
+            count (int): 车辆数量
+            address_prefix (str): 地址前缀，生成形如 "SIM:00:00:01" 的地址
+            scooter_kwargs: 传给 SimulatedScooter 的参数
+        """
+        self.scooters = {}
+        for index in range(count):
+            address = f"{address_prefix}:{(index >> 16) & 0xFF:02X}:{(index >> 8) & 0xFF:02X}:{index & 0xFF:02X}"
+            self.add(SimulatedScooter(address, rssi=random.randint(-90, -40), **scooter_kwargs))
+
+    def add(self, scooter):
+        """加入一辆模拟车辆"""
+        self.scooters[scooter.address.upper()] = scooter
+        return scooter
+
+    def get(self, address):
+        """按地址查找模拟车辆"""
+        return self.scooters.get(address.upper())
+
+    @property
+    def addresses(self):
+        return [scooter.address for scooter in self.scooters.values()]
+
+    def __len__(self):
+        return len(self.scooters)
+
+
+class _SimulatedCharacteristic:
+    __slots__ = ("uuid", "handle", "service_uuid")
+
+    def __init__(self, uuid, handle, service_uuid):
+        self.uuid = uuid
+        self.handle = handle
+        self.service_uuid = service_uuid
+
+
+class _SimulatedServices:
+    """模拟的BleakGATTServiceCollection，只支持按UUID或句柄查找特征"""
+
+    def __init__(self):
+        self._characteristics = [
+            _SimulatedCharacteristic(APP_CHARACTERISTIC_UUID, SIMULATED_CHARACTERISTIC_HANDLE, SIMULATED_SERVICE_UUID),
+            _SimulatedCharacteristic(OTA_CHARACTERISTIC_UUID, SIMULATED_OTA_HANDLE, SIMULATED_SERVICE_UUID),
+        ]
+
+    def get_characteristic(self, specifier):
+        for characteristic in self._characteristics:
+            if specifier in (characteristic.uuid, characteristic.handle):
+                return characteristic
+        return None
+
+
+class SimulatedBleakClient:
+    """模拟的BleakClient，与 SimulatedFleet 中的车辆通信"""
+
+    fleet = None
+
+    def __init__(self, address_or_ble_device, disconnected_callback=None, services=None, **kwargs):
+        if isinstance(address_or_ble_device, str):
+            self.address = address_or_ble_device
+        else:
+            self.address = address_or_ble_device.address
+        self._disconnected_callback = disconnected_callback
+        self._connected = False
+        self._notify_callbacks = {}
+        self.services = _SimulatedServices()
+        self.mtu_size = 247
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    def _scooter(self):
+        scooter = self.fleet.get(self.address) if self.fleet else None
+        if scooter is None:
+            raise ConnectionError(f"模拟设备不存在: {self.address}")
+        return scooter
+
+    async def connect(self, **kwargs):
+        scooter = self._scooter()
+        await asyncio.sleep(random.uniform(*scooter.connect_latency))
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        self._drop_link()
+        return True
+
+    def _drop_link(self):
+        """断开链路并触发断开回调"""
+        if not self._connected:
+            return
+        self._connected = False
+        self._notify_callbacks.clear()
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    def _check_characteristic(self, char_specifier):
+        characteristic = self.services.get_characteristic(char_specifier)
+        if characteristic is None:
+            raise BleakCharacteristicNotFoundError(char_specifier)
+        return characteristic
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        if not self._connected:
+            raise ConnectionError("设备未连接")
+        characteristic = self._check_characteristic(char_specifier)
+        self._notify_callbacks[characteristic.handle] = callback
+
+    async def stop_notify(self, char_specifier):
+        characteristic = self._check_characteristic(char_specifier)
+        self._notify_callbacks.pop(characteristic.handle, None)
+
+    async def write_gatt_char(self, char_specifier, data, response=None):
+        if not self._connected:
+            raise ConnectionError("设备未连接")
+        characteristic = self._check_characteristic(char_specifier)
+        scooter = self._scooter()
+        if characteristic.handle == SIMULATED_OTA_HANDLE:
+            if scooter.handle_ota_packet(data):
+                self._drop_link()
+                # 有响应写入在断开时会失败，无响应写入则静默丢失
+                if response:
+                    raise ConnectionError("设备连接已断开")
+            return
+
+        reply = scooter.handle_command(bytes(data).decode(errors="replace"))
+        if reply is None:
+            return
+
+        if random.random() < scooter.drop_rate:
+            scooter.responses_dropped += 1
+        else:
+            loop = asyncio.get_running_loop()
+            loop.call_later(random.uniform(*scooter.latency), self._deliver, characteristic, reply)
+
+        if random.random() < scooter.disconnect_rate:
+            loop = asyncio.get_running_loop()
+            loop.call_later(random.uniform(*scooter.latency) / 2, self._drop_link)
+
+    def _deliver(self, characteristic, reply):
+        callback = self._notify_callbacks.get(characteristic.handle)
+        if self._connected and callback is not None:
+            callback(characteristic, bytearray(reply.encode()))
+
+    async def read_gatt_char(self, char_specifier, **kwargs):
+        if not self._connected:
+            raise ConnectionError("设备未连接")
+        characteristic = self._check_characteristic(char_specifier)
+        if characteristic.handle == SIMULATED_OTA_HANDLE:
+            return bytearray(self._scooter().firmware_crc())
+        return bytearray()
+
+
+class SimulatedBleakScanner:
+    """模拟的BleakScanner，周期性地为模拟车队中的每辆车产生广播"""
+
+    fleet = None
+    # 每辆车的广播间隔（秒）
+    advertising_interval = 0.5
+
+    def __init__(self, detection_callback=None, service_uuids=None, **kwargs):
+        self._detection_callback = detection_callback
+        self._task = None
+        self._devices = {}
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._advertise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    @property
+    def discovered_devices(self):
+        return list(self._devices.values())
+
+    async def _advertise(self):
+        scooters = list(self.fleet.scooters.values()) if self.fleet else []
+        if not scooters:
+            return
+        # 把一个广播周期内的广播均匀打散
+        step = self.advertising_interval / len(scooters)
+        while True:
+            random.shuffle(scooters)
+            for scooter in scooters:
+                device = SimulatedDevice(scooter.address, scooter.name)
+                self._devices[scooter.address] = device
+                if self._detection_callback is not None:
+                    self._detection_callback(device, SimulatedAdvertisement(scooter.name, scooter.sample_rssi()))
+                await asyncio.sleep(step)
+
+    @classmethod
+    async def discover(cls, timeout=5.0, **kwargs):
+        scanner = cls(**kwargs)
+        async with scanner:
+            await asyncio.sleep(timeout)
+        return scanner.discovered_devices
+
+    @classmethod
+    async def find_device_by_address(cls, device_identifier, timeout=10.0, **kwargs):
+        scooter = cls.fleet.get(device_identifier) if cls.fleet else None
+        if scooter is None:
+            await asyncio.sleep(timeout)
+            return None
+        # 平均等待半个广播周期
+        await asyncio.sleep(random.uniform(0, cls.advertising_interval))
+        return SimulatedDevice(scooter.address, scooter.name)
+
+
+# 使用BleakClient/BleakScanner的模块
+_PATCH_TARGETS = ("src.bluetooth.ble_communication", "model.ble_model")
+
+
+class SimulatorInstallation:
+    """install_simulator 的返回值，调用 uninstall 恢复真实后端"""
+
+    def __init__(self, fleet, originals):
+        self.fleet = fleet
+        self._originals = originals
+
+    def uninstall(self):
+        for module, (client_cls, scanner_cls) in self._originals.items():
+            module.BleakClient = client_cls
+            module.BleakScanner = scanner_cls
+        self._originals = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+
+
+def install_simulator(fleet):
+    """
+    用模拟后端替换 ble_communication 和 BLEModel 使用的 BleakClient/BleakScanner
+
+    model.ble_model 只有在已导入时才会被替换，需要模拟BLEModel时请先导入它。
+
+    Args:
+        fleet (SimulatedFleet): 模拟车队
+
+    Returns:
+        SimulatorInstallation: 可作为上下文管理器使用，退出时恢复真实后端
+    """
+    client_cls = type("SimulatedBleakClient", (SimulatedBleakClient,), {"fleet": fleet})
+    scanner_cls = type("SimulatedBleakScanner", (SimulatedBleakScanner,), {"fleet": fleet})
+
+    originals = {}
+    for module_name in _PATCH_TARGETS:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        originals[module] = (module.BleakClient, module.BleakScanner)
+        module.BleakClient = client_cls
+        module.BleakScanner = scanner_cls
+    return SimulatorInstallation(fleet, originals)
+
+
+async def run_benchmark(count=1000, concurrency=50, max_connections=50, command="AT+BKINF=zk301,0",
+                        **scooter_kwargs):
+    """
+    对模拟车队做一轮命令压测：每辆车通过连接池连接并发送一条命令
+
+    Args:
+        count (int): 模拟车辆数
+        concurrency (int): 同时进行的操作数
+        max_connections (int): 连接池最大连接数
+        command (str): 每辆车发送的命令
+        scooter_kwargs: 传给 SimulatedScooter 的参数（延迟、丢包率、断开率等）
+
+    Returns:
+        dict: 压测统计结果
+    """
+    from src.bluetooth.ble_communication import send_command
+    from src.bluetooth.connection_pool import BLEConnectionPool
+    from src.bluetooth.presence_cache import presence_cache
+
+    fleet = SimulatedFleet(count, **scooter_kwargs)
+    with install_simulator(fleet):
+        # 预先填充在场缓存，模拟车辆已被扫描到
+        for scooter in fleet.scooters.values():
+            presence_cache.update(SimulatedDevice(scooter.address, scooter.name), rssi=scooter.rssi)
+
+        pool = BLEConnectionPool(max_connections=max_connections)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def run_one(address):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                client = await pool.acquire(address)
+                response = await send_command(client, command, max_retries=1) if client else None
+                if response is None:
+                    failures += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(run_one(address) for address in fleet.addresses))
+        elapsed = time.perf_counter() - start_time
+        await pool.close()
+
+    latencies.sort()
+    return {
+        "count": count,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "failed": failures,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50, default=0.0),
+        "p95": percentile(latencies, 95, default=0.0),
+        "p99": percentile(latencies, 99, default=0.0),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import os
+
+    parser = argparse.ArgumentParser(description="模拟zk301车队BLE压测")
+    parser.add_argument("--count", type=int, default=1000, help="模拟车辆数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发操作数")
+    parser.add_argument("--max-connections", type=int, default=50, help="连接池最大连接数")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="响应丢失概率")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="命令后断开概率")
+    args = parser.parse_args()
+
+    # 压测时屏蔽逐条命令的打印输出，出错退出时也会恢复标准输出
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        stats = asyncio.run(run_benchmark(
+            args.count, args.concurrency, args.max_connections,
+            drop_rate=args.drop_rate, disconnect_rate=args.disconnect_rate
+        ))
+
+    print(f"车辆数: {stats['count']}, 并发: {stats['concurrency']}")
+    print(f"成功: {stats['succeeded']}, 失败: {stats['failed']}, 耗时: {stats['elapsed']:.2f}秒")
+    print(f"吞吐量: {stats['throughput']:.1f} 次/秒")
+    print(f"延迟 p50={stats['p50'] * 1000:.1f}ms p95={stats['p95'] * 1000:.1f}ms p99={stats['p99'] * 1000:.1f}ms")
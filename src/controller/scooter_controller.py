@@ -10,26 +10,54 @@ import json
 # 将项目根目录添加到Python搜索路径中
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from src.bluetooth.ble_communication import discover_devices, connect_to_device, send_command
+from src.bluetooth.ble_communication import discover_devices, send_command
+from src.bluetooth.connection_pool import BLEConnectionPool
+from src.bluetooth.gatt_cache import gatt_cache
+from src.bluetooth.presence_cache import presence_cache
+from src.bluetooth.retry_policy import default_retry_policy
+from src.mqtt.data_report import parse_sn
 from src.mqtt.lock_controller import MQTTLockController
-from src.database.models import Database, ScooterManager, LockManager
+from src.database.models import Database, ScooterManager, LockManager, FirmwareRolloutManager, TelemetryManager, OutboxManager
+from src.firmware.rollout import FirmwareRollout
+from src.controller.telemetry_poller import TelemetryPoller
 
 class ScooterController:
     """
     滑板车控制器类，整合车辆和锁的控制
     """
     
-    def __init__(self):
+    def __init__(self, db=None, mqtt_controller=None, gatt_cache_path=None):
+        """
+        初始化控制器
+        
+        Args:
+            db (Database, optional): 使用的数据库，默认打开 scooter_manager.db
+            mqtt_controller (MQTTLockController, optional): 使用的MQTT锁控制器，默认连接配置的服务器
+            gatt_cache_path (str, optional): GATT特征缓存的持久化文件，默认不持久化
+        """
         # 初始化数据库
-        self.db = Database()
+        self.db = db if db is not None else Database()
         self.scooter_manager = ScooterManager(self.db)
         self.lock_manager = LockManager(self.db)
+        self.rollout_manager = FirmwareRolloutManager(self.db)
+        self.telemetry_manager = TelemetryManager(self.db)
+        self.telemetry_poller = None
         
-        # 初始化MQTT控制器
-        self.mqtt_controller = MQTTLockController()
+        # 初始化MQTT控制器，断线期间的命令存入数据库，重连后补发
+        self.outbox_manager = OutboxManager(self.db)
+        if mqtt_controller is None:
+            mqtt_controller = MQTTLockController(outbox=self.outbox_manager)
+        self.mqtt_controller = mqtt_controller
         
-        # 存储已连接的设备客户端
-        self.connected_clients = {}
+        # 蓝牙连接池，复用已建立的连接
+        self.connection_pool = BLEConnectionPool()
+        
+        # 蓝牙命令重试策略，与蓝牙通信模块共用；连续失败的设备由熔断器快速跳过
+        self.retry_policy = default_retry_policy
+        
+        # 持久化GATT特征缓存，重启后重连也可跳过完整的服务发现
+        if gatt_cache_path is not None:
+            gatt_cache.enable_persistence(gatt_cache_path)
         
         # 定义锁控制器映射关系
         self.controller_mapping = {
@@ -78,9 +106,12 @@ class ScooterController:
             db_scooters = self.scooter_manager.get_all_scooters()
             db_addresses = {scooter['bluetooth_address']: scooter for scooter in db_scooters}
             
-            # 匹配蓝牙设备和数据库记录
+            # 匹配蓝牙设备和数据库记录，信号最强（最近）的排在前面
             matched_scooters = []
-            for device in devices:
+            order = {address: index for index, address in
+                     enumerate(presence_cache.rank([device.address for device in devices]))}
+            for device in sorted(devices, key=lambda device: order[device.address]):
+                rssi = presence_cache.get_rssi(device.address)
                 if device.address in db_addresses:
                     scooter_info = db_addresses[device.address]
                     matched_scooters.append({
@@ -89,7 +120,8 @@ class ScooterController:
                         "scooter_name": scooter_info['scooter_name'],
                         "status": scooter_info['status'],
                         "lock_controller_id": scooter_info['lock_controller_id'],
-                        "sub_lock_number": scooter_info['sub_lock_number']
+                        "sub_lock_number": scooter_info['sub_lock_number'],
+                        "rssi": rssi
                     })
                 else:
                     # 未知设备，仅保留蓝牙信息
@@ -99,7 +131,8 @@ class ScooterController:
                         "scooter_name": device.name if device.name else "未知设备",
                         "status": "未注册",
                         "lock_controller_id": None,
-                        "sub_lock_number": None
+                        "sub_lock_number": None,
+                        "rssi": rssi
                     })
             
             return matched_scooters
@@ -108,22 +141,70 @@ class ScooterController:
             print(f"扫描车辆时出错: {e}")
             return []
     
+    def nearest_scooters(self, count=None):
+        """
+        按信号强度列出附近已注册的车辆
+        
+        Args:
+            count (int, optional): 最多返回的车辆数
+            
+        Returns:
+            list: 车辆信息字典（附带平滑后的rssi），信号最强的在前
+        """
+        scooters = {scooter['bluetooth_address'].upper(): scooter
+                    for scooter in self.scooter_manager.get_all_scooters() if scooter['bluetooth_address']}
+        return [dict(scooters[address], rssi=rssi)
+                for address, rssi in presence_cache.nearest(count, addresses=scooters)]
+
+    async def preconnect_nearest(self, count=None):
+        """
+        为信号最强的已注册车辆预先建立连接，之后的操作可以直接复用
+        
+        Args:
+            count (int, optional): 预连接的车辆数，默认并且最多为连接池容量
+            
+        Returns:
+            list: 成功建立连接的车辆ID
+        """
+        limit = self.connection_pool.max_connections
+        count = min(count, limit) if count is not None else limit
+        nearest = self.nearest_scooters(count)
+        clients = await asyncio.gather(
+            *(self.connect_scooter(scooter['bluetooth_address']) for scooter in nearest))
+        return [scooter['scooter_id'] for scooter, client in zip(nearest, clients) if client]
+
+    def order_by_proximity(self, scooter_ids):
+        """
+        按信号强度对车辆ID排序，信号强的在前，不在附近的保持原有顺序排在最后
+        
+        Args:
+            scooter_ids (list): 车辆ID列表
+            
+        Returns:
+            list: 排序后的车辆ID列表
+        """
+        addresses = {}
+        for scooter in self.scooter_manager.get_all_scooters():
+            if scooter['bluetooth_address']:
+                addresses[scooter['scooter_id']] = scooter['bluetooth_address']
+        ranked = presence_cache.rank(addresses[scooter_id] for scooter_id in scooter_ids if scooter_id in addresses)
+        position = {address: index for index, address in enumerate(ranked)}
+        # 未注册蓝牙地址的车辆排在最后；sorted是稳定排序，保持原有顺序
+        return sorted(scooter_ids, key=lambda scooter_id: position.get(addresses.get(scooter_id), len(position)))
+
     async def connect_scooter(self, device):
         """
         连接到指定的蓝牙设备
         
         Args:
-            device: 蓝牙设备对象
+            device: 蓝牙设备对象或设备地址字符串
             
         Returns:
             client: 连接的客户端对象，失败则返回None
         """
         try:
-            client = await connect_to_device(device.address)
-            if client and client.is_connected:
-                self.connected_clients[device.address] = client
-                return client
-            return None
+            address = device if isinstance(device, str) else device.address
+            return await self.connection_pool.acquire(address)
         except Exception as e:
             print(f"连接车辆时出错: {e}")
             return None
@@ -137,7 +218,7 @@ class ScooterController:
             ble_password (str): 蓝牙密码
             
         Returns:
-            tuple: (蓝牙解锁结果, MQTT解锁结果)
+            tuple: (蓝牙解锁结果, MQTT解锁结果)，MQTT解锁结果只有收到锁控制器的开锁上报才为True
         """
         try:
             # 获取车辆信息
@@ -148,26 +229,18 @@ class ScooterController:
             
             # 1. 先通过蓝牙解锁车辆 (ECU解锁)
             ble_success = False
-            # 检查是否有连接的客户端
-            client = self.connected_clients.get(scooter_info['bluetooth_address'])
-            if not client or not client.is_connected:
-                # 尝试连接
-                device_info = {"address": scooter_info['bluetooth_address']}
-                type("BluetoothDevice", (), device_info)  # 创建一个简单的设备对象
-                client = await self.connect_scooter(device_info)
-                if not client:
-                    print(f"无法连接到车辆: {scooter_id}")
-                    return False, False
+            # 从连接池获取连接，没有可用连接时自动建立
+            client = await self.connect_scooter(scooter_info['bluetooth_address'])
+            if not client:
+                print(f"无法连接到车辆: {scooter_id}")
+                return False, False
             
             command = f"AT+BKSCT={ble_password},0"
             char_uuid = "00002c10-0000-1000-8000-00805f9b34fb"
-            ble_result = await send_command(client, command, char_uuid)
+            with self.connection_pool.in_use(scooter_info['bluetooth_address']):
+                ble_result = await send_command(client, command, char_uuid, retry_policy=self.retry_policy)
             ble_success = ble_result is not None
             
-            # 给ECU一些时间解锁
-            if ble_success:
-                await asyncio.sleep(1.0)
-            
             # 2. 再通过MQTT解锁物理锁
             mqtt_success = False
             
@@ -178,8 +251,9 @@ class ScooterController:
                 controller_id = scooter_info['lock_controller_id']
                 sub_lock_number = scooter_info['sub_lock_number']
                 
-                # 直接使用同步方法解锁
-                mqtt_success = self.mqtt_controller.unlock(controller_id, sub_lock_number)
+                # 等待锁控制器上报开锁状态，确认物理锁确实已打开
+                mqtt_result = await self.mqtt_controller.unlock_and_confirm(controller_id, sub_lock_number)
+                mqtt_success = mqtt_result["confirmed"]
             else:
                 # 车辆没有关联锁信息，使用硬编码的第一个映射（备用方案）
                 print(f"车辆 {scooter_id} 未关联锁控制器，使用默认锁")
@@ -187,10 +261,11 @@ class ScooterController:
                 controller_info = self.controller_mapping.get(lock_number)
                 if controller_info:
                     print(f"使用默认锁: 控制器={controller_info['controller_id']}, 子锁号={controller_info['sub_lock_number']}")
-                    mqtt_success = self.mqtt_controller.unlock(
+                    mqtt_result = await self.mqtt_controller.unlock_and_confirm(
                         controller_info['controller_id'], 
                         controller_info['sub_lock_number']
                     )
+                    mqtt_success = mqtt_result["confirmed"]
             
             # 记录操作日志
             if ble_success or mqtt_success:
@@ -240,21 +315,17 @@ class ScooterController:
                 print(f"找不到车辆信息: {scooter_id}")
                 return False, False
             
-            # 检查是否有连接的客户端
-            client = self.connected_clients.get(scooter_info['bluetooth_address'])
-            if not client or not client.is_connected:
-                # 尝试连接
-                device_info = {"address": scooter_info['bluetooth_address']}
-                type("BluetoothDevice", (), device_info)  # 创建一个简单的设备对象
-                client = await self.connect_scooter(device_info)
-                if not client:
-                    print(f"无法连接到车辆: {scooter_id}")
-                    return False, False
+            # 从连接池获取连接，没有可用连接时自动建立
+            client = await self.connect_scooter(scooter_info['bluetooth_address'])
+            if not client:
+                print(f"无法连接到车辆: {scooter_id}")
+                return False, False
             
             # 通过蓝牙锁定车辆 (ECU上锁)
             command = f"AT+BKSCT={ble_password},1"
             char_uuid = "00002c10-0000-1000-8000-00805f9b34fb"
-            ble_result = await send_command(client, command, char_uuid)
+            with self.connection_pool.in_use(scooter_info['bluetooth_address']):
+                ble_result = await send_command(client, command, char_uuid, retry_policy=self.retry_policy)
             ble_success = ble_result is not None
             
             # 记录操作日志
@@ -275,7 +346,189 @@ class ScooterController:
         except Exception as e:
             print(f"锁定车辆时出错: {e}")
             return False, False
-    
+
+    async def query_scooter(self, scooter_id, ble_password):
+        """
+        查询车辆设备信息
+
+        Args:
+            scooter_id (str): 车辆ID
+            ble_password (str): 蓝牙密码
+
+        Returns:
+            str: 设备返回的原始响应，失败则返回None
+        """
+        try:
+            scooter_info = self.scooter_manager.get_scooter(scooter_id=scooter_id)
+            if not scooter_info:
+                print(f"找不到车辆信息: {scooter_id}")
+                return None
+
+            client = await self.connect_scooter(scooter_info['bluetooth_address'])
+            if not client:
+                print(f"无法连接到车辆: {scooter_id}")
+                return None
+
+            command = f"AT+BKINF={ble_password},0"
+            char_uuid = "00002c10-0000-1000-8000-00805f9b34fb"
+            with self.connection_pool.in_use(scooter_info['bluetooth_address']):
+                return await send_command(client, command, char_uuid, retry_policy=self.retry_policy)
+
+        except Exception as e:
+            print(f"查询车辆时出错: {e}")
+            return None
+
+    async def unlock_many(self, scooter_ids, ble_password, concurrency=4):
+        """
+        批量解锁车辆和对应的锁
+
+        Args:
+            scooter_ids (list): 车辆ID列表
+            ble_password (str): 蓝牙密码
+            concurrency (int): 同时操作的车辆数上限
+
+        Returns:
+            dict: 批量操作结果，格式见 _run_batch
+        """
+        return await self._run_batch(
+            scooter_ids,
+            lambda scooter_id: self.unlock_scooter(scooter_id, ble_password),
+            lambda result: all(result),
+            concurrency
+        )
+
+    async def lock_many(self, scooter_ids, ble_password, concurrency=4):
+        """
+        批量锁定车辆
+
+        Args:
+            scooter_ids (list): 车辆ID列表
+            ble_password (str): 蓝牙密码
+            concurrency (int): 同时操作的车辆数上限
+
+        Returns:
+            dict: 批量操作结果，格式见 _run_batch
+        """
+        return await self._run_batch(
+            scooter_ids,
+            lambda scooter_id: self.lock_scooter(scooter_id, ble_password),
+            lambda result: result[0],
+            concurrency
+        )
+
+    async def query_many(self, scooter_ids, ble_password, concurrency=4):
+        """
+        批量查询车辆设备信息
+
+        Args:
+            scooter_ids (list): 车辆ID列表
+            ble_password (str): 蓝牙密码
+            concurrency (int): 同时操作的车辆数上限
+
+        Returns:
+            dict: 批量操作结果，格式见 _run_batch
+        """
+        return await self._run_batch(
+            scooter_ids,
+            lambda scooter_id: self.query_scooter(scooter_id, ble_password),
+            lambda result: result is not None,
+            concurrency
+        )
+
+    async def _run_batch(self, scooter_ids, operation, is_success, concurrency):
+        """
+        以有限并发对多辆车执行同一操作
+
+        并发数不会超过连接池的最大连接数，否则连接会被反复淘汰重建。
+        信号最强的车辆最先执行，单辆车的失败或异常不影响其他车辆。
+
+        Args:
+            scooter_ids (list): 车辆ID列表
+            operation: 接收scooter_id并返回协程的函数
+            is_success: 判断单个操作结果是否成功的函数
+            concurrency (int): 同时操作的车辆数上限
+
+        Returns:
+            dict: {
+                "results": {scooter_id: 操作结果},
+                "succeeded": [成功的车辆ID],
+                "failed": {scooter_id: 失败原因},
+                "elapsed": 总耗时（秒）
+            }
+        """
+        concurrency = max(1, min(concurrency, self.connection_pool.max_connections))
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {}
+        succeeded = []
+        failed = {}
+
+        async def run_one(scooter_id):
+            async with semaphore:
+                try:
+                    result = await operation(scooter_id)
+                except Exception as e:
+                    failed[scooter_id] = f"异常: {e}"
+                    return
+                results[scooter_id] = result
+                if is_success(result):
+                    succeeded.append(scooter_id)
+                else:
+                    failed[scooter_id] = f"操作失败: {result}"
+
+        # 去重后按信号强度排序，信号最强的车辆最先获得并发名额
+        unique_ids = self.order_by_proximity(list(dict.fromkeys(scooter_ids)))
+        start_time = asyncio.get_running_loop().time()
+        await asyncio.gather(*(run_one(scooter_id) for scooter_id in unique_ids))
+        elapsed = asyncio.get_running_loop().time() - start_time
+
+        print(f"批量操作完成: 共{len(unique_ids)}辆, 成功{len(succeeded)}辆, "
+              f"失败{len(failed)}辆, 并发{concurrency}, 耗时{elapsed:.2f}秒")
+
+        return {
+            "results": results,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed": elapsed
+        }
+
+    async def rollout_firmware(self, firmware_path, firmware_version=None, scooter_ids=None, **options):
+        """
+        分波次为车队升级固件，中断后再次调用会继续未完成的批次
+        
+        Args:
+            firmware_path (str): 固件文件路径
+            firmware_version (str, optional): 固件版本号
+            scooter_ids (list, optional): 要升级的车辆ID，默认全部已注册车辆
+            options: 传给 FirmwareRollout 的参数（金丝雀数量、波次比例、适配器并发数等）
+            
+        Returns:
+            dict: 升级批次ID、最终状态和进度信息
+        """
+        rollout = FirmwareRollout(self.scooter_manager, self.rollout_manager, self.connection_pool, **options)
+        return await rollout.run(firmware_path, firmware_version, scooter_ids)
+
+    def start_telemetry(self, ble_password="zk301", **options):
+        """
+        在当前事件循环中启动后台遥测轮询
+        
+        Args:
+            ble_password (str): 蓝牙密码
+            options: 传给 TelemetryPoller 的参数（轮询间隔、抖动比例、并发数等）
+            
+        Returns:
+            TelemetryPoller: 轮询器实例
+        """
+        if self.telemetry_poller is None:
+            self.telemetry_poller = TelemetryPoller(
+                self.scooter_manager, self.telemetry_manager, self.connection_pool, ble_password, **options)
+        self.telemetry_poller.start()
+        return self.telemetry_poller
+
+    async def stop_telemetry(self):
+        """停止后台遥测轮询"""
+        if self.telemetry_poller is not None:
+            await self.telemetry_poller.stop()
+
     def register_scooter(self, scooter_id, scooter_name, bluetooth_address, lock_controller_id=None, sub_lock_number=None):
         """
         注册新车辆
@@ -355,8 +608,9 @@ class ScooterController:
         query += " ORDER BY operation_time DESC LIMIT ?"
         params.append(limit)
         
-        self.db.cursor.execute(query, params)
-        return [dict(row) for row in self.db.cursor.fetchall()]
+        with self.db.lock:
+            self.db.cursor.execute(query, params)
+            return [dict(row) for row in self.db.cursor.fetchall()]
     
     def enable_auto_association_update(self):
         """启用自动更新车辆和锁的关联关系，通过监听MQTT的data_report消息"""
@@ -423,23 +677,10 @@ class ScooterController:
                     print(f"锁已打开，openType={open_type}")
                 return
                 
-            # 从SN中提取锁号和共享物品ID
-            if len(sn) >= 16:
-                lock_controller_id = sn[1:4]  # 第2~4位为卡槽号/锁号
-                item_id = sn[4:16]     # 第5~16位表示插销ID/共享物品的ID
-                raw_sub_lock_number = int(item_id[-1]) if item_id[-1].isdigit() else 1  # 最后一位表示共享品种类
-                
-                # 使用控制器ID和子锁号映射到锁编号(1-10)
-                # 注意：这里我们尝试查找真实控制器ID，但如果控制器ID只是"002"这样的编号，
-                # 我们需要将其映射到我们定义的控制器ID
-                real_controller_id = None
-                if lock_controller_id == "002":  # 示例：如果SN中的锁号是"002"
-                    real_controller_id = "866846061120977"  # 映射到实际控制器ID
-                elif lock_controller_id == "003":  # 示例：如果SN中的锁号是"003"
-                    real_controller_id = "866846061051685"  # 映射到实际控制器ID
-                else:
-                    # 尝试使用SN中的锁号作为实际控制器ID
-                    real_controller_id = lock_controller_id
+            # 从SN中提取控制器ID和子锁号（与等待开锁确认使用同一套解析）
+            lock_key = parse_sn(sn)
+            if lock_key is not None:
+                real_controller_id, raw_sub_lock_number = lock_key
                 
                 # 使用原始子锁号计算锁编号
                 lock_number = None
@@ -460,31 +701,34 @@ class ScooterController:
                 if open_type == 1 and lock_number is not None:
                     print(f"检测到正常还车，锁编号={lock_number}")
                     
-                    # 查询最近锁定的车辆（通过操作日志）
-                    recent_lock_logs = self.get_recent_lock_operations(limit=10)
+                    # data_report由多个分发线程并发处理，查询最近锁定记录和更新关联要作为一个整体完成，
+                    # 否则两条报告可能同时把同一辆车关联到不同的锁
+                    with self.db.lock:
+                        # 查询最近锁定的车辆（通过操作日志）
+                        recent_lock_logs = self.get_recent_lock_operations(limit=10)
                     
-                    for log in recent_lock_logs:
-                        # 检查时间间隔是否在合理范围内（例如5分钟内）
-                        log_time = datetime.fromisoformat(log['operation_time'])
-                        current_time = datetime.fromisoformat(timestamp)
-                        time_diff = (current_time - log_time).total_seconds()
+                        for log in recent_lock_logs:
+                            # 检查时间间隔是否在合理范围内（例如5分钟内）
+                            log_time = datetime.fromisoformat(log['operation_time'])
+                            current_time = datetime.fromisoformat(timestamp)
+                            time_diff = (current_time - log_time).total_seconds()
                         
-                        # 如果时间间隔在5分钟内且操作类型为"锁定"
-                        if time_diff <= 300 and log['operation_type'] == "锁定":
-                            scooter_id = log['scooter_id']
+                            # 如果时间间隔在5分钟内且操作类型为"锁定"
+                            if time_diff <= 300 and log['operation_type'] == "锁定":
+                                scooter_id = log['scooter_id']
                             
-                            # 更新车辆和锁关联关系 - 使用锁编号(1-10)
-                            success = self.update_scooter_lock_association(
-                                scooter_id, real_controller_id, lock_number
-                            )
+                                # 更新车辆和锁关联关系 - 使用锁编号(1-10)
+                                success = self.update_scooter_lock_association(
+                                    scooter_id, real_controller_id, lock_number
+                                )
                             
-                            if success:
-                                print(f"已自动更新车辆 {scooter_id} 的锁关联关系：锁编号={lock_number}")
-                            else:
-                                print(f"自动更新车辆 {scooter_id} 的锁关联关系失败")
+                                if success:
+                                    print(f"已自动更新车辆 {scooter_id} 的锁关联关系：锁编号={lock_number}")
+                                else:
+                                    print(f"自动更新车辆 {scooter_id} 的锁关联关系失败")
                             
-                            # 更新成功后退出循环
-                            break
+                                # 更新成功后退出循环
+                                break
                 else:
                     print(f"非正常还车或无法找到锁编号映射，openType={open_type}, lockNumber={lock_number}")
         
@@ -504,8 +748,9 @@ class ScooterController:
             list: 操作日志列表
         """
         query = "SELECT * FROM operation_logs WHERE operation_type = '锁定' ORDER BY operation_time DESC LIMIT ?"
-        self.db.cursor.execute(query, (limit,))
-        return [dict(row) for row in self.db.cursor.fetchall()]
+        with self.db.lock:
+            self.db.cursor.execute(query, (limit,))
+            return [dict(row) for row in self.db.cursor.fetchall()]
     
     def get_controller_info(self, lock_number):
         """
@@ -0,0 +1,237 @@
+"""
+车队遥测轮询：定时通过 AT+BKINF 查询车辆状态并写入数据库
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from src.bluetooth.ble_communication import scan_devices_stream, send_command
+from src.bluetooth.command_handler import DeviceInfo, decode_response
+from src.bluetooth.presence_cache import presence_cache
+
+class _DeviceSchedule:
+    """单台车辆的轮询状态"""
+
+    __slots__ = ("scooter_id", "address", "interval", "last_data", "failures", "generation")
+
+    def __init__(self, scooter_id, address, interval, generation):
+        self.scooter_id = scooter_id
+        self.address = address
+        self.interval = interval
+        # 车辆每次加入调度时分配新的代号，堆中代号不一致的条目已失效
+        self.generation = generation
+        self.last_data = None
+        self.failures = 0
+
+
+class TelemetryPoller:
+    """
+    后台遥测轮询器
+
+    - 每辆车按各自的间隔轮询，间隔带随机抖动，避免所有车辆同时被查询
+    - 所有查询共享一个BLE并发预算
+    - 最近没有广播的车辆跳过本轮查询
+    - 数据没有变化的车辆逐步拉长轮询间隔，数据变化后恢复
+    """
+
+    def __init__(self, scooter_manager, telemetry_manager, connection_pool, ble_password="zk301",
+                 interval=60.0, max_interval=900.0, jitter=0.2, concurrency=2, ble_semaphore=None,
+                 skip_absent=True, scan_interval=60.0, scan_window=5.0, refresh_interval=60.0):
+        """
+        初始化轮询器
+
+        Args:
+            scooter_manager: 车辆管理器 ScooterManager
+            telemetry_manager: 遥测数据管理器 TelemetryManager
+            connection_pool: 蓝牙连接池 BLEConnectionPool
+            ble_password (str): 蓝牙密码
+            interval (float): 基础轮询间隔（秒）
+            max_interval (float): 数据无变化时轮询间隔的上限（秒）
+            jitter (float): 间隔抖动比例，0.2表示在±20%范围内随机
+            concurrency (int): 同时进行的查询数，未提供ble_semaphore时生效
+            ble_semaphore (asyncio.Semaphore, optional): 与其他BLE任务共享的并发预算
+            skip_absent (bool): 是否跳过最近没有广播的车辆
+            scan_interval (float): 刷新在场信息的扫描间隔（秒），0表示不主动扫描
+            scan_window (float): 每次扫描的时长（秒）
+            refresh_interval (float): 重新读取车辆注册表的间隔（秒）
+        """
+        self.scooter_manager = scooter_manager
+        self.telemetry_manager = telemetry_manager
+        self.connection_pool = connection_pool
+        self.ble_password = ble_password
+        self.interval = interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.ble_semaphore = ble_semaphore
+        self.skip_absent = skip_absent
+        self.scan_interval = scan_interval
+        self.scan_window = scan_window
+        self.refresh_interval = refresh_interval
+
+        self._devices = {}
+        # (下次轮询时间, scooter_id, 代号) 小顶堆
+        self._queue = []
+        self._generations = itertools.count()
+        self._next_refresh = 0.0
+        # 有更早到期的轮询加入堆中时唤醒调度主循环
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._scan_task = None
+        self._inflight = set()
+
+        self.stats = {"polled": 0, "stored": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+
+    def start(self):
+        """在当前事件循环中启动轮询"""
+        if self._task is None or self._task.done():
+            loop = asyncio.get_running_loop()
+            if self.ble_semaphore is None:
+                self.ble_semaphore = asyncio.Semaphore(self.concurrency)
+            self._task = loop.create_task(self._run())
+            if self.skip_absent and self.scan_interval > 0:
+                self._scan_task = loop.create_task(self._scan_loop())
+            print("遥测轮询已启动")
+
+    async def stop(self):
+        """停止轮询并等待进行中的查询结束"""
+        for task in (self._task, self._scan_task):
+            if task is not None:
+                task.cancel()
+        self._task = None
+        self._scan_task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        print("遥测轮询已停止")
+
+    def _next_delay(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _refresh_devices(self):
+        """同步车辆注册表：新车辆加入调度，已删除的车辆移出"""
+        now = time.monotonic()
+        registered = {}
+        for scooter in self.scooter_manager.get_all_scooters():
+            if scooter.get("bluetooth_address"):
+                registered[scooter["scooter_id"]] = scooter["bluetooth_address"]
+
+        for scooter_id in list(self._devices):
+            if scooter_id not in registered:
+                del self._devices[scooter_id]
+
+        for scooter_id, address in registered.items():
+            device = self._devices.get(scooter_id)
+            if device is None:
+                device = _DeviceSchedule(scooter_id, address, self.interval, next(self._generations))
+                self._devices[scooter_id] = device
+                # 首次轮询在一个间隔内随机分布
+                self._schedule(device, now + random.uniform(0, self.interval))
+            else:
+                device.address = address
+        self._next_refresh = now + self.refresh_interval
+
+    def _schedule(self, device, when):
+        heapq.heappush(self._queue, (when, device.scooter_id, device.generation))
+        if self._queue[0][0] == when:
+            self._wakeup.set()
+
+    def _is_current(self, device):
+        """调度对象是否仍是该车辆当前的调度（车辆被删除或删除后重新加入时不是）"""
+        return self._devices.get(device.scooter_id) is device
+
+    async def _run(self):
+        """调度主循环"""
+        while True:
+            now = time.monotonic()
+            if now >= self._next_refresh:
+                self._refresh_devices()
+
+            while self._queue and self._queue[0][0] <= now:
+                _, scooter_id, generation = heapq.heappop(self._queue)
+                device = self._devices.get(scooter_id)
+                if device is None or device.generation != generation:
+                    continue
+                task = asyncio.ensure_future(self._poll(device))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+            # 等到下一个到期时间或下一次读取车辆注册表，取较早者；查询完成后重新入堆会提前唤醒
+            wait = self._next_refresh
+            if self._queue:
+                wait = min(wait, self._queue[0][0])
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, wait - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _scan_loop(self):
+        """定期扫描，刷新在场缓存"""
+        while True:
+            try:
+                async for _ in scan_devices_stream(timeout=self.scan_window):
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"遥测扫描出错: {e}")
+            await asyncio.sleep(self.scan_interval)
+
+    def _is_present(self, device):
+        return device.address in self.connection_pool or presence_cache.is_present(device.address)
+
+    async def _poll(self, device):
+        """查询一台车辆并安排下一次轮询"""
+        try:
+            if self.skip_absent and not self._is_present(device):
+                self.stats["skipped"] += 1
+                device.interval = min(device.interval * 2, self.max_interval)
+                return
+
+            async with self.ble_semaphore:
+                data = await self.poll_once(device.address)
+
+            self.stats["polled"] += 1
+            if data is None:
+                self.stats["failed"] += 1
+                device.failures += 1
+                device.interval = min(device.interval * 2, self.max_interval)
+                return
+
+            device.failures = 0
+            if data == device.last_data:
+                # 数据没有变化，拉长轮询间隔
+                self.stats["unchanged"] += 1
+                device.interval = min(device.interval * 2, self.max_interval)
+                return
+
+            device.last_data = data
+            device.interval = self.interval
+            if self.telemetry_manager.add_telemetry(device.scooter_id, **data.as_dict()):
+                self.stats["stored"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"轮询车辆 {device.scooter_id} 时出错: {e}")
+        finally:
+            if self._is_current(device):
+                self._schedule(device, time.monotonic() + self._next_delay(device.interval))
+
+    async def poll_once(self, address):
+        """
+        查询一台车辆的设备信息
+
+        Args:
+            address (str): 车辆蓝牙地址
+
+        Returns:
+            DeviceInfo: 解码后的设备信息，失败返回None
+        """
+        client = await self.connection_pool.acquire(address)
+        if client is None:
+            return None
+        with self.connection_pool.in_use(address):
+            response = await send_command(client, f"AT+BKINF={self.ble_password},0", max_retries=1)
+        info = decode_response(response)
+        return info if isinstance(info, DeviceInfo) else None
@@ -4,7 +4,9 @@
 import sqlite3
 import os
 import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
 class Database:
     """数据库管理类，负责与SQLite数据库的交互"""
@@ -13,7 +15,6 @@ class Database:
         """初始化数据库连接"""
         self.db_path = db_path
         self.connection = None
-        self.cursor = None
         self.connect()
         self.create_tables()
         
@@ -23,9 +24,21 @@ class Database:
     
     def connect(self):
         """连接到数据库"""
-        self.connection = sqlite3.connect(self.db_path)
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
         self.connection.row_factory = sqlite3.Row  # 使查询结果可以通过列名访问
-        self.cursor = self.connection.cursor()
+        # 每个线程使用自己的游标，界面线程和后台事件循环线程可以共用同一个连接
+        self._local = threading.local()
+        # sqlite连接本身不能被多个线程同时使用，每组 execute...commit 都要在这把锁下完成
+        self.lock = threading.RLock()
+    
+    @property
+    def cursor(self):
+        """当前线程的游标"""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self.connection.cursor()
+            self._local.cursor = cursor
+        return cursor
     
     def close(self):
         """关闭数据库连接"""
@@ -77,6 +90,78 @@ class Database:
         )
         ''')
         
+        # 创建固件批量升级表
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS firmware_rollouts (
+            rollout_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            firmware_path TEXT,
+            firmware_version TEXT,
+            status TEXT DEFAULT '进行中',
+            created_time TEXT,
+            finished_time TEXT
+        )
+        ''')
+        
+        # 创建固件批量升级的设备进度表
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS firmware_rollout_devices (
+            rollout_id INTEGER,
+            scooter_id TEXT,
+            wave INTEGER,
+            status TEXT DEFAULT '待升级',
+            attempts INTEGER DEFAULT 0,
+            bytes_sent INTEGER DEFAULT 0,
+            elapsed REAL DEFAULT 0,
+            error TEXT,
+            updated_time TEXT,
+            PRIMARY KEY (rollout_id, scooter_id),
+            FOREIGN KEY (rollout_id) REFERENCES firmware_rollouts(rollout_id),
+            FOREIGN KEY (scooter_id) REFERENCES scooters(scooter_id)
+        )
+        ''')
+        
+        # 创建车辆遥测数据表
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scooter_telemetry (
+            telemetry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scooter_id TEXT,
+            lock_status INTEGER,
+            speed REAL,
+            current_mileage REAL,
+            total_mileage REAL,
+            ride_time INTEGER,
+            battery INTEGER,
+            headlamp INTEGER,
+            poll_time TEXT,
+            FOREIGN KEY (scooter_id) REFERENCES scooters(scooter_id)
+        )
+        ''')
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scooter_telemetry_scooter_time
+        ON scooter_telemetry (scooter_id, poll_time)
+        ''')
+        
+        # 创建MQTT待发送命令表（断线期间发出的命令，重连后补发）
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mqtt_outbox (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            expires_at REAL,
+            created_time TEXT,
+            sent_time TEXT
+        )
+        ''')
+        # 同一条命令只保留一条待发送记录
+        self.cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mqtt_outbox_pending_key
+        ON mqtt_outbox (dedupe_key) WHERE status = 'pending'
+        ''')
+        
         self.commit()
 
     def is_database_empty(self):
@@ -153,60 +238,65 @@ class ScooterManager:
     
     def add_scooter(self, scooter_id, scooter_name, bluetooth_address, lock_controller_id=None, sub_lock_number=None):
         """添加新车辆"""
-        try:
-            self.db.cursor.execute('''
-            INSERT INTO scooters (scooter_id, scooter_name, bluetooth_address, lock_controller_id, sub_lock_number, last_operation_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (scooter_id, scooter_name, bluetooth_address, lock_controller_id, sub_lock_number, datetime.now().isoformat()))
-            self.db.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                INSERT INTO scooters (scooter_id, scooter_name, bluetooth_address, lock_controller_id, sub_lock_number, last_operation_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', (scooter_id, scooter_name, bluetooth_address, lock_controller_id, sub_lock_number, datetime.now().isoformat()))
+                self.db.commit()
+                return True
+            except sqlite3.IntegrityError:
+                return False
     
     def get_scooter(self, scooter_id=None, bluetooth_address=None):
         """通过ID或蓝牙地址查询车辆"""
-        if scooter_id:
-            self.db.cursor.execute('SELECT * FROM scooters WHERE scooter_id = ?', (scooter_id,))
-        elif bluetooth_address:
-            self.db.cursor.execute('SELECT * FROM scooters WHERE bluetooth_address = ?', (bluetooth_address,))
-        else:
-            return None
+        with self.db.lock:
+            if scooter_id:
+                self.db.cursor.execute('SELECT * FROM scooters WHERE scooter_id = ?', (scooter_id,))
+            elif bluetooth_address:
+                self.db.cursor.execute('SELECT * FROM scooters WHERE bluetooth_address = ?', (bluetooth_address,))
+            else:
+                return None
         
-        result = self.db.cursor.fetchone()
-        return dict(result) if result else None
+            result = self.db.cursor.fetchone()
+            return dict(result) if result else None
     
     def get_all_scooters(self):
         """获取所有车辆"""
-        self.db.cursor.execute('SELECT * FROM scooters')
-        return [dict(row) for row in self.db.cursor.fetchall()]
+        with self.db.lock:
+            self.db.cursor.execute('SELECT * FROM scooters')
+            return [dict(row) for row in self.db.cursor.fetchall()]
     
     def update_scooter_lock(self, scooter_id, lock_controller_id, sub_lock_number):
         """更新车辆关联的锁信息"""
-        try:
-            self.db.cursor.execute('''
-            UPDATE scooters 
-            SET lock_controller_id = ?, sub_lock_number = ?, last_operation_time = ?
-            WHERE scooter_id = ?
-            ''', (lock_controller_id, sub_lock_number, datetime.now().isoformat(), scooter_id))
-            self.db.commit()
-            return True
-        except Exception as e:
-            print(f"更新车辆锁信息出错: {e}")
-            return False
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                UPDATE scooters 
+                SET lock_controller_id = ?, sub_lock_number = ?, last_operation_time = ?
+                WHERE scooter_id = ?
+                ''', (lock_controller_id, sub_lock_number, datetime.now().isoformat(), scooter_id))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新车辆锁信息出错: {e}")
+                return False
     
     def update_scooter_status(self, scooter_id, status):
         """更新车辆状态"""
-        try:
-            self.db.cursor.execute('''
-            UPDATE scooters 
-            SET status = ?, last_operation_time = ?
-            WHERE scooter_id = ?
-            ''', (status, datetime.now().isoformat(), scooter_id))
-            self.db.commit()
-            return True
-        except Exception as e:
-            print(f"更新车辆状态出错: {e}")
-            return False
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                UPDATE scooters 
+                SET status = ?, last_operation_time = ?
+                WHERE scooter_id = ?
+                ''', (status, datetime.now().isoformat(), scooter_id))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新车辆状态出错: {e}")
+                return False
 
 class LockManager:
     """锁管理类，提供添加、查询、更新锁信息的功能"""
@@ -217,36 +307,325 @@ class LockManager:
     
     def add_lock_controller(self, controller_id, controller_name, mqtt_topic_prefix):
         """添加新的锁控制器"""
-        try:
-            self.db.cursor.execute('''
-            INSERT INTO lock_controllers (controller_id, controller_name, mqtt_topic_prefix)
-            VALUES (?, ?, ?)
-            ''', (controller_id, controller_name, mqtt_topic_prefix))
-            self.db.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                INSERT INTO lock_controllers (controller_id, controller_name, mqtt_topic_prefix)
+                VALUES (?, ?, ?)
+                ''', (controller_id, controller_name, mqtt_topic_prefix))
+                self.db.commit()
+                return True
+            except sqlite3.IntegrityError:
+                return False
     
     def get_lock_controller(self, controller_id):
         """通过ID查询锁控制器"""
-        self.db.cursor.execute('SELECT * FROM lock_controllers WHERE controller_id = ?', (controller_id,))
-        result = self.db.cursor.fetchone()
-        return dict(result) if result else None
+        with self.db.lock:
+            self.db.cursor.execute('SELECT * FROM lock_controllers WHERE controller_id = ?', (controller_id,))
+            result = self.db.cursor.fetchone()
+            return dict(result) if result else None
     
     def get_all_lock_controllers(self):
         """获取所有锁控制器"""
-        self.db.cursor.execute('SELECT * FROM lock_controllers')
-        return [dict(row) for row in self.db.cursor.fetchall()]
+        with self.db.lock:
+            self.db.cursor.execute('SELECT * FROM lock_controllers')
+            return [dict(row) for row in self.db.cursor.fetchall()]
     
     def log_operation(self, scooter_id, controller_id, sub_lock_number, operation_type, status):
         """记录操作日志"""
-        try:
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                INSERT INTO operation_logs (scooter_id, controller_id, sub_lock_number, operation_type, operation_time, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', (scooter_id, controller_id, sub_lock_number, operation_type, datetime.now().isoformat(), status))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"记录操作日志出错: {e}")
+                return False
+
+class FirmwareRolloutManager:
+    """固件批量升级管理类，持久化升级批次和每台设备的进度"""
+    
+    def __init__(self, database):
+        """初始化固件批量升级管理器"""
+        self.db = database
+    
+    def create_rollout(self, firmware_path, firmware_version, assignments):
+        """
+        创建升级批次
+        
+        Args:
+            firmware_path (str): 固件文件路径
+            firmware_version (str): 固件版本号
+            assignments (list): [(scooter_id, 波次序号)] 列表
+            
+        Returns:
+            int: 升级批次ID，失败返回None
+        """
+        with self.db.lock:
+            try:
+                now = datetime.now().isoformat()
+                self.db.cursor.execute('''
+                INSERT INTO firmware_rollouts (firmware_path, firmware_version, created_time)
+                VALUES (?, ?, ?)
+                ''', (firmware_path, firmware_version, now))
+                rollout_id = self.db.cursor.lastrowid
+                self.db.cursor.executemany('''
+                INSERT INTO firmware_rollout_devices (rollout_id, scooter_id, wave, updated_time)
+                VALUES (?, ?, ?, ?)
+                ''', [(rollout_id, scooter_id, wave, now) for scooter_id, wave in assignments])
+                self.db.commit()
+                return rollout_id
+            except Exception as e:
+                print(f"创建固件升级批次出错: {e}")
+                if self.db.connection:
+                    self.db.connection.rollback()
+                return None
+    
+    def get_rollout(self, rollout_id):
+        """通过ID查询升级批次"""
+        with self.db.lock:
+            self.db.cursor.execute('SELECT * FROM firmware_rollouts WHERE rollout_id = ?', (rollout_id,))
+            result = self.db.cursor.fetchone()
+            return dict(result) if result else None
+    
+    def get_unfinished_rollout(self, firmware_path, scooter_ids=None):
+        """
+        查询指定固件最近一次未完成的升级批次
+        
+        Args:
+            firmware_path (str): 固件文件路径
+            scooter_ids (list, optional): 只查找设备集合与之完全相同的批次
+            
+        Returns:
+            dict: 升级批次信息，没有返回None
+        """
+        with self.db.lock:
+            self.db.cursor.execute('''
+            SELECT * FROM firmware_rollouts
+            WHERE firmware_path = ? AND status != '已完成'
+            ORDER BY rollout_id DESC
+            ''', (firmware_path,))
+            rollouts = [dict(row) for row in self.db.cursor.fetchall()]
+            for rollout in rollouts:
+                if scooter_ids is None or self.get_rollout_scooter_ids(rollout['rollout_id']) == set(scooter_ids):
+                    return rollout
+            return None
+    
+    def get_rollout_scooter_ids(self, rollout_id):
+        """升级批次包含的车辆ID集合"""
+        with self.db.lock:
+            self.db.cursor.execute('''
+            SELECT scooter_id FROM firmware_rollout_devices WHERE rollout_id = ?
+            ''', (rollout_id,))
+            return {row['scooter_id'] for row in self.db.cursor.fetchall()}
+    
+    def get_rollout_devices(self, rollout_id, wave=None):
+        """获取升级批次中的设备进度，可按波次过滤"""
+        with self.db.lock:
+            if wave is None:
+                self.db.cursor.execute('''
+                SELECT * FROM firmware_rollout_devices WHERE rollout_id = ? ORDER BY wave, scooter_id
+                ''', (rollout_id,))
+            else:
+                self.db.cursor.execute('''
+                SELECT * FROM firmware_rollout_devices WHERE rollout_id = ? AND wave = ? ORDER BY scooter_id
+                ''', (rollout_id, wave))
+            return [dict(row) for row in self.db.cursor.fetchall()]
+    
+    def update_device_progress(self, rollout_id, scooter_id, status, bytes_sent=0, elapsed=0, error=None):
+        """记录一台设备的升级结果"""
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                UPDATE firmware_rollout_devices
+                SET status = ?, attempts = attempts + 1, bytes_sent = ?, elapsed = ?, error = ?, updated_time = ?
+                WHERE rollout_id = ? AND scooter_id = ?
+                ''', (status, bytes_sent, elapsed, error, datetime.now().isoformat(), rollout_id, scooter_id))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新固件升级进度出错: {e}")
+                return False
+    
+    def update_rollout_status(self, rollout_id, status):
+        """更新升级批次状态，状态为"已完成"时记录完成时间"""
+        with self.db.lock:
+            try:
+                finished_time = datetime.now().isoformat() if status == '已完成' else None
+                self.db.cursor.execute('''
+                UPDATE firmware_rollouts SET status = ?, finished_time = ? WHERE rollout_id = ?
+                ''', (status, finished_time, rollout_id))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新固件升级批次状态出错: {e}")
+                return False
+
+class TelemetryManager:
+    """车辆遥测数据管理类，保存定时查询得到的设备信息"""
+    
+    def __init__(self, database):
+        """初始化遥测数据管理器"""
+        self.db = database
+    
+    def add_telemetry(self, scooter_id, lock_status, speed, current_mileage, total_mileage,
+                      ride_time, battery, headlamp):
+        """记录一条遥测数据"""
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                INSERT INTO scooter_telemetry (scooter_id, lock_status, speed, current_mileage, total_mileage,
+                                               ride_time, battery, headlamp, poll_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (scooter_id, lock_status, speed, current_mileage, total_mileage,
+                      ride_time, battery, headlamp, datetime.now().isoformat()))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"记录遥测数据出错: {e}")
+                return False
+    
+    def get_latest_telemetry(self, scooter_id):
+        """获取车辆最近一条遥测数据"""
+        with self.db.lock:
             self.db.cursor.execute('''
-            INSERT INTO operation_logs (scooter_id, controller_id, sub_lock_number, operation_type, operation_time, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (scooter_id, controller_id, sub_lock_number, operation_type, datetime.now().isoformat(), status))
-            self.db.commit()
-            return True
+            SELECT * FROM scooter_telemetry WHERE scooter_id = ? ORDER BY poll_time DESC LIMIT 1
+            ''', (scooter_id,))
+            result = self.db.cursor.fetchone()
+            return dict(result) if result else None
+    
+    def get_telemetry_history(self, scooter_id, limit=100):
+        """获取车辆的遥测历史，按时间倒序"""
+        with self.db.lock:
+            self.db.cursor.execute('''
+            SELECT * FROM scooter_telemetry WHERE scooter_id = ? ORDER BY poll_time DESC LIMIT ?
+            ''', (scooter_id, limit))
+            return [dict(row) for row in self.db.cursor.fetchall()]
+
+class OutboxManager:
+    """MQTT待发送命令管理类，断线期间的命令持久化保存，重连后按顺序补发"""
+    
+    PENDING = 'pending'
+    SENT = 'sent'
+    EXPIRED = 'expired'
+    
+    def __init__(self, database):
+        """初始化待发送命令管理器"""
+        self.db = database
+    
+    def enqueue(self, topic, payload, ttl, dedupe_key=None):
+        """
+        保存一条待发送命令
+        
+        Args:
+            topic (str): MQTT主题
+            payload (str): 已编码的消息内容
+            ttl (float): 有效期（秒），过期后不再补发
+            dedupe_key (str): 去重键，已有相同键的待发送命令时只延长其有效期，默认使用主题+内容
+            
+        Returns:
+            int: 命令ID，保存失败返回None
+        """
+        dedupe_key = dedupe_key or f"{topic}:{payload}"
+        expires_at = time.time() + ttl
+        try:
+            with self.db.lock:
+                cursor = self.db.cursor
+                cursor.execute('''
+                SELECT message_id FROM mqtt_outbox WHERE dedupe_key = ? AND status = ?
+                ''', (dedupe_key, self.PENDING))
+                existing = cursor.fetchone()
+                if existing:
+                    message_id = existing['message_id']
+                    cursor.execute('''
+                    UPDATE mqtt_outbox SET expires_at = MAX(expires_at, ?) WHERE message_id = ?
+                    ''', (expires_at, message_id))
+                else:
+                    cursor.execute('''
+                    INSERT INTO mqtt_outbox (topic, payload, dedupe_key, status, expires_at, created_time)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (topic, payload, dedupe_key, self.PENDING, expires_at, datetime.now().isoformat()))
+                    message_id = cursor.lastrowid
+                self.db.commit()
+            return message_id
         except Exception as e:
-            print(f"记录操作日志出错: {e}")
-            return False 
\ No newline at end of file
+            print(f"保存待发送命令出错: {e}")
+            return None
+    
+    def expire_stale(self, now=None):
+        """
+        把已过期的待发送命令标记为过期
+        
+        Returns:
+            int: 过期的命令数
+        """
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                UPDATE mqtt_outbox SET status = ? WHERE status = ? AND expires_at <= ?
+                ''', (self.EXPIRED, self.PENDING, now if now is not None else time.time()))
+                self.db.commit()
+                return self.db.cursor.rowcount
+            except Exception as e:
+                print(f"标记过期命令出错: {e}")
+                return 0
+    
+    def get_pending(self, limit=500):
+        """获取未过期的待发送命令，按保存顺序排列"""
+        with self.db.lock:
+            self.db.cursor.execute('''
+            SELECT * FROM mqtt_outbox WHERE status = ? AND expires_at > ? ORDER BY message_id LIMIT ?
+            ''', (self.PENDING, time.time(), limit))
+            return [dict(row) for row in self.db.cursor.fetchall()]
+    
+    def count_pending(self):
+        """待发送命令数"""
+        with self.db.lock:
+            self.db.cursor.execute("SELECT COUNT(*) FROM mqtt_outbox WHERE status = ?", (self.PENDING,))
+            return self.db.cursor.fetchone()[0]
+    
+    def mark_sent(self, message_ids):
+        """把一批命令标记为已发送（在一个事务中提交）"""
+        with self.db.lock:
+            if not message_ids:
+                return True
+            try:
+                sent_time = datetime.now().isoformat()
+                self.db.cursor.executemany('''
+                UPDATE mqtt_outbox SET status = ?, sent_time = ?, attempts = attempts + 1 WHERE message_id = ?
+                ''', [(self.SENT, sent_time, message_id) for message_id in message_ids])
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新待发送命令状态出错: {e}")
+                return False
+    
+    def mark_failed(self, message_id, error):
+        """记录一次补发失败，命令保留到过期为止"""
+        with self.db.lock:
+            try:
+                self.db.cursor.execute('''
+                UPDATE mqtt_outbox SET attempts = attempts + 1, last_error = ? WHERE message_id = ?
+                ''', (error, message_id))
+                self.db.commit()
+                return True
+            except Exception as e:
+                print(f"更新待发送命令状态出错: {e}")
+                return False
+    
+    def purge_finished(self, keep_days=7):
+        """删除保存超过keep_days天的已发送和已过期命令"""
+        with self.db.lock:
+            try:
+                before = (datetime.now() - timedelta(days=keep_days)).isoformat()
+                self.db.cursor.execute('''
+                DELETE FROM mqtt_outbox WHERE status != ? AND created_time < ?
+                ''', (self.PENDING, before))
+                self.db.commit()
+                return self.db.cursor.rowcount
+            except Exception as e:
+                print(f"清理待发送命令出错: {e}")
+                return 0
@@ -0,0 +1,226 @@
+# 固件批量升级调度：分波次（金丝雀 + 按比例扩大）推送，进度持久化到SQLite
+import asyncio
+import math
+import os
+import time
+
+from src.firmware.updater import update_firmware
+
+# 默认所有车辆使用同一个蓝牙适配器
+DEFAULT_ADAPTER = "default"
+
+
+class FirmwareRollout:
+    """
+    车队固件升级调度器。
+
+    - 先升级少量金丝雀设备，再按累计百分比分波次扩大范围
+    - 每个波次失败率超过阈值时暂停，后续波次不再执行
+    - 每个蓝牙适配器同时进行的传输数量有上限
+    - 每台设备的结果写入数据库，对同一固件和同一组车辆重新运行会继续未完成的批次，跳过已成功的设备
+    """
+
+    def __init__(self, scooter_manager, rollout_manager, connection_pool,
+                 canary_count=1, wave_percentages=(10, 50, 100), adapter_concurrency=2,
+                 adapter_for=None, max_failure_rate=0.2, transfer=None):
+        """
+        初始化调度器
+
+        Args:
+            scooter_manager: 车辆管理器 ScooterManager
+            rollout_manager: 固件升级管理器 FirmwareRolloutManager
+            connection_pool: 蓝牙连接池 BLEConnectionPool
+            canary_count (int): 金丝雀波次的设备数量
+            wave_percentages (tuple): 后续各波次累计覆盖的车队百分比
+            adapter_concurrency (int): 每个蓝牙适配器同时传输的设备数上限
+            adapter_for: 可选，接收车辆信息返回所用适配器名称的函数
+            max_failure_rate (float): 单个波次允许的最大失败率，超过则暂停升级
+            transfer: 可选，自定义单台设备传输的协程函数，接收(车辆信息, 固件路径)返回结果字典
+        """
+        self.scooter_manager = scooter_manager
+        self.rollout_manager = rollout_manager
+        self.connection_pool = connection_pool
+        self.canary_count = canary_count
+        self.wave_percentages = wave_percentages
+        self.adapter_concurrency = adapter_concurrency
+        self.adapter_for = adapter_for or (lambda scooter: DEFAULT_ADAPTER)
+        self.max_failure_rate = max_failure_rate
+        self.transfer = transfer or self._transfer
+
+        self._adapter_semaphores = {}
+        self._reset_stats(0, 0)
+
+    def _reset_stats(self, image_size, total_devices):
+        self._stats = {
+            "image_size": image_size,
+            "total_devices": total_devices,
+            "completed_devices": 0,
+            "failed_devices": 0,
+            "bytes_sent": 0,
+            "started_at": time.perf_counter(),
+        }
+
+    def plan_waves(self, scooter_ids):
+        """
+        把设备分配到各个波次
+
+        Args:
+            scooter_ids (list): 车辆ID列表
+
+        Returns:
+            list: [(scooter_id, 波次序号)]，波次0为金丝雀
+        """
+        total = len(scooter_ids)
+        assignments = []
+        start = min(self.canary_count, total)
+        assignments.extend((scooter_id, 0) for scooter_id in scooter_ids[:start])
+
+        for wave, percentage in enumerate(self.wave_percentages, start=1):
+            end = max(start, min(total, math.ceil(total * percentage / 100.0)))
+            assignments.extend((scooter_id, wave) for scooter_id in scooter_ids[start:end])
+            start = end
+
+        # 百分比没有覆盖到的设备放在最后一个波次
+        assignments.extend((scooter_id, len(self.wave_percentages)) for scooter_id in scooter_ids[start:])
+        return assignments
+
+    def progress(self):
+        """
+        当前升级进度
+
+        Returns:
+            dict: 完成/失败/剩余设备数、车队总吞吐量（字节/秒）和预计剩余时间（秒）
+        """
+        stats = self._stats
+        elapsed = time.perf_counter() - stats["started_at"]
+        throughput = stats["bytes_sent"] / elapsed if elapsed > 0 else 0.0
+        remaining = stats["total_devices"] - stats["completed_devices"] - stats["failed_devices"]
+        eta = remaining * stats["image_size"] / throughput if throughput > 0 else None
+        return {
+            "completed": stats["completed_devices"],
+            "failed": stats["failed_devices"],
+            "remaining": remaining,
+            "elapsed": elapsed,
+            "throughput": throughput,
+            "eta": eta,
+        }
+
+    async def run(self, firmware_path, firmware_version=None, scooter_ids=None, rollout_id=None):
+        """
+        执行（或继续）一次固件批量升级
+
+        Args:
+            firmware_path (str): 固件文件路径
+            firmware_version (str, optional): 固件版本号
+            scooter_ids (list, optional): 要升级的车辆ID，默认升级全部已注册车辆
+            rollout_id (int, optional): 要继续的升级批次ID，默认继续该固件最近一次车辆完全相同的未完成批次
+
+        Returns:
+            dict: 升级批次ID、最终状态和进度信息
+
+        Raises:
+            ValueError: 同时指定了rollout_id和scooter_ids，但两者的车辆不一致
+        """
+        if rollout_id is not None:
+            if scooter_ids is not None and set(scooter_ids) != self.rollout_manager.get_rollout_scooter_ids(rollout_id):
+                raise ValueError(f"升级批次 {rollout_id} 的车辆与指定的车辆不一致")
+        else:
+            if scooter_ids is None:
+                scooter_ids = [scooter["scooter_id"] for scooter in self.scooter_manager.get_all_scooters()]
+            # 按（固件, 车辆集合）查找可以继续的批次，车辆不同的批次不能继续
+            unfinished = self.rollout_manager.get_unfinished_rollout(firmware_path, scooter_ids)
+            if unfinished:
+                rollout_id = unfinished["rollout_id"]
+                print(f"继续未完成的固件升级批次: {rollout_id}")
+            else:
+                other = self.rollout_manager.get_unfinished_rollout(firmware_path)
+                if other:
+                    print(f"固件的未完成批次 {other['rollout_id']} 包含的车辆不同，不继续该批次")
+
+        if rollout_id is None:
+            rollout_id = self.rollout_manager.create_rollout(
+                firmware_path, firmware_version, self.plan_waves(scooter_ids))
+            if rollout_id is None:
+                return {"rollout_id": None, "status": "失败", "progress": self.progress()}
+            print(f"创建固件升级批次: {rollout_id}, 共{len(scooter_ids)}辆车")
+
+        devices = self.rollout_manager.get_rollout_devices(rollout_id)
+        pending_count = sum(1 for device in devices if device["status"] != "成功")
+        self._reset_stats(os.path.getsize(firmware_path), pending_count)
+
+        status = "已完成"
+        for wave in sorted({device["wave"] for device in devices}):
+            wave_devices = [device for device in devices if device["wave"] == wave]
+            pending = [device for device in wave_devices if device["status"] != "成功"]
+            if not pending:
+                continue
+
+            print(f"开始第{wave}波次升级: {len(pending)}辆车")
+            results = await asyncio.gather(
+                *(self._upgrade_one(rollout_id, device["scooter_id"], firmware_path) for device in pending))
+
+            failures = results.count(False)
+            failure_rate = failures / len(pending)
+            progress = self.progress()
+            eta = f"{progress['eta']:.0f}秒" if progress["eta"] is not None else "未知"
+            print(f"第{wave}波次完成: 失败{failures}辆, 车队吞吐量 {progress['throughput']:.0f} 字节/秒, "
+                  f"剩余{progress['remaining']}辆, 预计剩余时间 {eta}")
+
+            if failure_rate > self.max_failure_rate:
+                status = "已暂停"
+                print(f"第{wave}波次失败率 {failure_rate:.0%} 超过阈值 {self.max_failure_rate:.0%}，暂停升级")
+                break
+            if failures:
+                status = "部分失败"
+
+        self.rollout_manager.update_rollout_status(rollout_id, status)
+        return {"rollout_id": rollout_id, "status": status, "progress": self.progress()}
+
+    async def _upgrade_one(self, rollout_id, scooter_id, firmware_path):
+        """在所属适配器的并发限制内升级一台设备，并记录结果"""
+        scooter = self.scooter_manager.get_scooter(scooter_id=scooter_id)
+        if not scooter:
+            self.rollout_manager.update_device_progress(rollout_id, scooter_id, "失败", error="找不到车辆信息")
+            self._stats["failed_devices"] += 1
+            return False
+
+        adapter = self.adapter_for(scooter)
+        semaphore = self._adapter_semaphores.get(adapter)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.adapter_concurrency)
+            self._adapter_semaphores[adapter] = semaphore
+
+        async with semaphore:
+            try:
+                result = await self.transfer(scooter, firmware_path)
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+
+        self._stats["bytes_sent"] += result.get("bytes_sent", 0)
+        if result.get("success"):
+            self._stats["completed_devices"] += 1
+            status = "成功"
+        else:
+            self._stats["failed_devices"] += 1
+            status = "失败"
+            print(f"车辆 {scooter_id} 固件升级失败: {result.get('error')}")
+
+        self.rollout_manager.update_device_progress(
+            rollout_id, scooter_id, status,
+            result.get("bytes_sent", 0), result.get("elapsed", 0), result.get("error"))
+        return result.get("success", False)
+
+    async def _transfer(self, scooter, firmware_path):
+        """默认的单台设备传输：通过连接池连接后流式升级"""
+        address = scooter["bluetooth_address"]
+        client = await self.connection_pool.acquire(address)
+        if client is None:
+            return {"success": False, "error": "无法连接设备"}
+        try:
+            # 传输期间（包括重连后）连接不会被LRU淘汰或保活任务断开
+            with self.connection_pool.in_use(address):
+                return await update_firmware(
+                    client, firmware_path, reconnect=lambda: self.connection_pool.acquire(address))
+        finally:
+            # 升级后设备通常会重启，释放连接
+            await self.connection_pool.release(address)
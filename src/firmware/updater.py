@@ -1,4 +1,20 @@
 # 固件更新逻辑
+import mmap
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+
+# OTA数据特征UUID (0x2C04)
+OTA_CHARACTERISTIC_UUID = "00002c04-0000-1000-8000-00805f9b34fb"
+
+# 每个数据包的头部：4字节小端偏移量，设备按偏移写入，重复发送同一段数据是幂等的
+OTA_PACKET_HEADER = struct.Struct("<I")
+# ATT写操作的协议开销
+ATT_WRITE_OVERHEAD = 3
+# 无法获取MTU时使用BLE默认MTU
+DEFAULT_MTU = 23
+
 
 def read_firmware_file(file_path):
     """
@@ -9,16 +25,162 @@ def read_firmware_file(file_path):
     with open(file_path, 'rb') as file:
         return file.read()
 
-def update_firmware(client, firmware_data):
+
+@contextmanager
+def open_firmware_image(firmware):
+    """
+    打开固件镜像，文件以内存映射方式只读打开，避免把整个镜像读入内存。
+    :param firmware: 固件文件路径，或已在内存中的bytes数据。
+    :return: 上下文管理器，产生可切片的memoryview。
+    """
+    if isinstance(firmware, (bytes, bytearray, memoryview)):
+        yield memoryview(firmware)
+        return
+
+    with open(firmware, 'rb') as file:
+        # 空文件无法做内存映射
+        if file.seek(0, 2) == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def ota_payload_size(client):
+    """
+    根据连接的MTU计算每个数据包可携带的固件字节数。
+    :param client: BLE客户端。
+    :return: 每包固件字节数。
+    """
+    mtu = getattr(client, "mtu_size", None) or DEFAULT_MTU
+    return max(1, mtu - ATT_WRITE_OVERHEAD - OTA_PACKET_HEADER.size)
+
+
+class OTASession:
+    """
+    单台设备的OTA传输状态，断线重连后可从最后确认的偏移量继续传输。
+    """
+
+    def __init__(self, total_size, crc):
+        self.total_size = total_size
+        self.crc = crc
+        # 设备已确认收到的字节数
+        self.acked_offset = 0
+        # 实际发送的字节数（包括断线后重发的部分）
+        self.bytes_sent = 0
+        self.resumes = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @property
+    def throughput(self):
+        """按已确认字节计算的吞吐量（字节/秒）"""
+        elapsed = self.elapsed
+        return self.acked_offset / elapsed if elapsed > 0 else 0.0
+
+
+async def _stream_image(client, image, session, window, progress_callback):
+    """
+    从 session.acked_offset 开始分块发送镜像。
+
+    每个窗口内前面的数据包使用无响应写入，窗口最后一包使用有响应写入；
+    GATT写入按顺序处理，收到写响应即说明该窗口内的数据都已送达，据此推进确认偏移。
+    """
+    payload_size = ota_payload_size(client)
+    total = session.total_size
+    offset = session.acked_offset
+    in_window = 0
+
+    while offset < total:
+        end = min(offset + payload_size, total)
+        packet = OTA_PACKET_HEADER.pack(offset) + image[offset:end]
+        in_window += 1
+        with_response = in_window >= window or end >= total
+
+        await client.write_gatt_char(OTA_CHARACTERISTIC_UUID, packet, response=with_response)
+        session.bytes_sent += end - offset
+        offset = end
+
+        if with_response:
+            in_window = 0
+            session.acked_offset = offset
+            if progress_callback is not None:
+                progress_callback(session.acked_offset, total, session.throughput)
+
+
+async def _verify_crc(client, session):
+    """读取设备计算的CRC32并与镜像比对"""
+    data = await client.read_gatt_char(OTA_CHARACTERISTIC_UUID)
+    if len(data) < 4:
+        raise ValueError("设备未返回CRC校验值")
+    device_crc = struct.unpack_from("<I", bytes(data))[0]
+    return device_crc == session.crc
+
+
+async def update_firmware(client, firmware, window=16, reconnect=None, max_resumes=3,
+                          progress_callback=None):
     """
-    通过BLE更新固件。
+    通过BLE流式更新固件。
+
+    按MTU分块发送，窗口内使用无响应写入，每个窗口用一次有响应写入做流控确认；
+    传输完成后读取设备CRC32校验；连接中断时如果提供了reconnect，则重连并从最后确认的偏移继续。
+
     :param client: BLE客户端。
-    :param firmware_data: 固件数据。
-    """
-    try:
-        # 假设特征UUID为0x2C04
-        CHARACTERISTIC_UUID = "00002c04-0000-1000-8000-00805f9b34fb"
-        client.write_gatt_char(CHARACTERISTIC_UUID, firmware_data)
-        print("固件更新成功")
-    except Exception as e:
-        print(f"固件更新失败: {e}") 
\ No newline at end of file
+    :param firmware: 固件文件路径或固件数据。
+    :param window: 每个流控窗口的数据包数量。
+    :param reconnect: 可选。断线时调用的协程函数，返回新的已连接客户端。
+    :param max_resumes: 最大断点续传次数。
+    :param progress_callback: 可选。进度回调，接收(已确认字节数, 总字节数, 吞吐量字节/秒)。
+    :return: 结果字典，包含success、bytes、elapsed、throughput、resumes、error。
+    """
+    with open_firmware_image(firmware) as image:
+        session = OTASession(len(image), zlib.crc32(image) & 0xFFFFFFFF)
+        print(f"开始固件更新: {session.total_size} 字节, CRC32={session.crc:08X}, "
+              f"每包 {ota_payload_size(client)} 字节, 窗口 {window} 包")
+
+        error = None
+        while True:
+            try:
+                await _stream_image(client, image, session, window, progress_callback)
+                if await _verify_crc(client, session):
+                    break
+                error = "CRC校验失败"
+                print(f"固件更新失败: {error}")
+                break
+            except Exception as e:
+                if reconnect is None or session.resumes >= max_resumes:
+                    error = str(e)
+                    print(f"固件更新失败: {e}")
+                    break
+                session.resumes += 1
+                print(f"固件传输中断 ({e})，从偏移 {session.acked_offset} 续传，第{session.resumes}次")
+                try:
+                    client = await reconnect()
+                except Exception as reconnect_error:
+                    print(f"重连失败: {reconnect_error}")
+                    client = None
+                if client is None or not client.is_connected:
+                    error = "重连失败"
+                    print(f"固件更新失败: {error}")
+                    break
+
+    result = {
+        "success": error is None,
+        "bytes": session.total_size,
+        "bytes_sent": session.bytes_sent,
+        "elapsed": session.elapsed,
+        "throughput": session.throughput,
+        "resumes": session.resumes,
+        "error": error,
+    }
+    if error is None:
+        print(f"固件更新成功: {session.total_size} 字节, 耗时 {session.elapsed:.2f}秒, "
+              f"吞吐量 {session.throughput:.0f} 字节/秒, 续传 {session.resumes} 次")
+    return result
@@ -0,0 +1,237 @@
+# asyncio版MQTT传输：由事件循环驱动paho客户端的套接字读写，发布、订阅和连接状态都可以await
+import asyncio
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+from src.mqtt.publisher import encode_payload
+
+# loop_misc（保活、重发）的调用间隔（秒）
+MISC_INTERVAL = 1.0
+
+
+class AsyncMQTTTransport:
+    """
+    用asyncio事件循环代替paho的loop_start()后台线程。
+
+    - 套接字可读时调用loop_read，有数据待发时调用loop_write，不再轮询
+    - 后台任务每秒调用一次loop_misc处理保活和超时重发
+    - publish/subscribe返回时已收到PUBACK/SUBACK，connected是可以等待的事件
+
+    套接字回调依赖loop.add_reader/add_writer，Windows上需要使用SelectorEventLoop。
+    """
+
+    def __init__(self, client):
+        """
+        初始化传输层并接管client的套接字回调
+
+        Args:
+            client: paho MQTT客户端，调用方设置的on_connect/on_disconnect/on_publish/on_subscribe会被保留并继续调用
+        """
+        self.client = client
+        self.loop = None
+        self.connected = None
+        self._misc_task = None
+        # mid -> future，等待PUBACK / SUBACK
+        self._publish_waiters = {}
+        self._subscribe_waiters = {}
+
+        self._user_on_connect = client.on_connect
+        self._user_on_disconnect = client.on_disconnect
+        self._user_on_publish = client.on_publish
+        self._user_on_subscribe = client.on_subscribe
+
+    async def start(self):
+        """
+        在当前事件循环中接管客户端。
+
+        如果客户端已经由loop_start()后台线程驱动并已连接，会先停止该线程，再把现有连接交给事件循环。
+
+        Raises:
+            NotImplementedError: 当前事件循环不支持监听套接字（Windows上的ProactorEventLoop）
+        """
+        loop = asyncio.get_running_loop()
+        if sys.platform == "win32" and not isinstance(loop, asyncio.SelectorEventLoop):
+            raise NotImplementedError("当前事件循环不支持add_reader，需要SelectorEventLoop")
+        self.loop = loop
+        self.connected = asyncio.Event()
+
+        client = self.client
+        client.loop_stop()
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.on_subscribe = self._on_subscribe
+
+        sock = client.socket()
+        if sock is not None:
+            self.loop.add_reader(sock, client.loop_read)
+            if client.want_write():
+                self.loop.add_writer(sock, client.loop_write)
+            if client.is_connected():
+                self.connected.set()
+
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    async def connect(self, host, port=1883, keepalive=60, timeout=10.0):
+        """
+        连接到MQTT服务器并等待CONNACK
+
+        Args:
+            host (str): 服务器地址
+            port (int): 端口
+            keepalive (int): 保活间隔（秒）
+            timeout (float): 等待连接建立的超时（秒）
+
+        Returns:
+            bool: 是否连接成功
+        """
+        if self.loop is None:
+            await self.start()
+        # DNS解析和TCP握手是阻塞调用，放到线程池中执行
+        await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+        return await self.wait_connected(timeout)
+
+    async def reconnect(self, timeout=10.0):
+        """使用上次的连接参数重新连接"""
+        await self.loop.run_in_executor(None, self.client.reconnect)
+        return await self.wait_connected(timeout)
+
+    async def wait_connected(self, timeout=10.0):
+        """
+        等待连接建立
+
+        Args:
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            bool: 超时前是否已连接
+        """
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def publish(self, topic, payload, qos=1, timeout=10.0):
+        """
+        发布消息，QoS>0时等待服务器确认
+
+        Args:
+            topic (str): 主题
+            payload: 字典、字符串或字节
+            qos (int): 服务质量等级
+            timeout (float): 等待PUBACK的超时（秒）
+
+        Returns:
+            float: 从发布到收到确认的时延（秒）
+
+        Raises:
+            ConnectionError: 发布失败
+            asyncio.TimeoutError: 等待确认超时
+        """
+        sent_at = time.perf_counter()
+        info = self.client.publish(topic, encode_payload(payload), qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"发布失败: {mqtt.error_string(info.rc)}")
+        await self._wait_ack(self._publish_waiters, info.mid, timeout)
+        return time.perf_counter() - sent_at
+
+    async def subscribe(self, topic, qos=0, timeout=10.0):
+        """
+        订阅主题并等待SUBACK
+
+        Raises:
+            ConnectionError: 订阅请求发送失败
+            asyncio.TimeoutError: 等待确认超时
+        """
+        result, mid = self.client.subscribe(topic, qos)
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"订阅失败: {mqtt.error_string(result)}")
+        await self._wait_ack(self._subscribe_waiters, mid, timeout)
+
+    async def _wait_ack(self, waiters, mid, timeout):
+        # 确认回调总是通过call_soon延后处理，在此之前等待已经登记
+        future = self.loop.create_future()
+        waiters[mid] = future
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            waiters.pop(mid, None)
+
+    async def close(self):
+        """断开连接并停止后台任务"""
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+        self.client.disconnect()
+        sock = self.client.socket()
+        if sock is not None:
+            self._on_socket_close(self.client, None, sock)
+
+    async def _misc_loop(self):
+        """定期处理保活和超时重发"""
+        while True:
+            await asyncio.sleep(MISC_INTERVAL)
+            self.client.loop_misc()
+
+    # 以下回调由paho在读写套接字时调用，可能来自线程池中的connect调用
+    def _call_in_loop(self, callback, *args):
+        # 事件循环关闭后客户端析构仍会触发套接字关闭回调，此时已无需处理
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_reader, sock)
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if rc == 0:
+            self._call_in_loop(self.connected.set)
+        if self._user_on_connect is not None:
+            self._user_on_connect(client, userdata, flags, rc, *args)
+
+    def _on_disconnect(self, client, userdata, rc, *args):
+        self._call_in_loop(self.connected.clear)
+        self._call_in_loop(self._fail_waiters, ConnectionError("MQTT连接已断开"))
+        if self._user_on_disconnect is not None:
+            self._user_on_disconnect(client, userdata, rc, *args)
+
+    def _on_publish(self, client, userdata, mid, *args):
+        self._call_in_loop(self._resolve, self._publish_waiters, mid)
+        if self._user_on_publish is not None:
+            self._user_on_publish(client, userdata, mid, *args)
+
+    def _on_subscribe(self, client, userdata, mid, *args):
+        self._call_in_loop(self._resolve, self._subscribe_waiters, mid)
+        if self._user_on_subscribe is not None:
+            self._user_on_subscribe(client, userdata, mid, *args)
+
+    def _resolve(self, waiters, mid):
+        # 其他线程中同步发布的消息没有等待者，直接忽略
+        future = waiters.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _fail_waiters(self, exc):
+        for waiters in (self._publish_waiters, self._subscribe_waiters):
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(exc)
+            waiters.clear()
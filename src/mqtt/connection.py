@@ -0,0 +1,184 @@
+# MQTT连接状态机：未连接 / 连接中 / 已连接 / 退避中，调用方通过条件变量或future等待连接就绪
+import asyncio
+import threading
+
+from src.bluetooth.retry_policy import RetryPolicy
+
+# 默认重连退避：1秒起，每次翻倍，最长60秒
+DEFAULT_RECONNECT_POLICY = RetryPolicy(base_delay=1.0, max_delay=60.0, jitter=0.5)
+
+
+class ConnectionStateMachine:
+    """
+    MQTT连接状态机。
+
+    - 未连接：尚未发起连接，或服务器正常断开
+    - 连接中：已发起连接，等待CONNACK
+    - 已连接：收到CONNACK，等待者全部唤醒，退避次数清零
+    - 退避中：异常断开或连接失败，按指数退避等待下一次重连
+    - 已关闭：调用了close()，不再重连
+
+    状态在MQTT网络线程、重连定时器和事件循环中都会被修改，所有转换都在同一把锁下进行。
+    """
+
+    DISCONNECTED = "未连接"
+    CONNECTING = "连接中"
+    CONNECTED = "已连接"
+    BACKING_OFF = "退避中"
+    CLOSED = "已关闭"
+
+    def __init__(self, policy=None):
+        """
+        初始化状态机
+
+        Args:
+            policy (RetryPolicy): 重连退避策略，默认使用 DEFAULT_RECONNECT_POLICY
+        """
+        self.policy = policy or DEFAULT_RECONNECT_POLICY
+        # 上次连接成功后的连续重连次数
+        self.attempts = 0
+        self._state = self.DISCONNECTED
+        self._cond = threading.Condition()
+        self._timer = None
+        # 事件循环中待执行的重连：(事件循环, TimerHandle)
+        self._handle = None
+        # 异步等待连接的请求：[(事件循环, future)]
+        self._async_waiters = []
+
+    @property
+    def state(self):
+        with self._cond:
+            return self._state
+
+    @property
+    def is_connected(self):
+        return self.state == self.CONNECTED
+
+    @property
+    def closed(self):
+        return self.state == self.CLOSED
+
+    def mark_connecting(self):
+        """发起一次连接"""
+        self._set_state(self.CONNECTING)
+
+    def mark_connected(self):
+        """收到CONNACK，唤醒所有等待连接的调用方"""
+        with self._cond:
+            if self._state == self.CLOSED:
+                return
+            self.attempts = 0
+            self._state = self.CONNECTED
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._set_future_result, future, True)
+
+    def mark_disconnected(self):
+        """正常断开；退避中的状态保持不变，避免重复安排重连"""
+        with self._cond:
+            if self._state not in (self.CLOSED, self.BACKING_OFF):
+                self._state = self.DISCONNECTED
+
+    def schedule_reconnect(self, reconnect, loop=None):
+        """
+        进入退避状态，延迟后执行一次重连
+
+        已经在退避中或已关闭时不做任何事，因此断开回调和连接失败可以同时调用本方法。
+
+        Args:
+            reconnect: 执行一次重连的函数；提供loop时为协程函数
+            loop: 可选，在该事件循环中执行重连，否则使用定时器线程
+
+        Returns:
+            float: 退避时间（秒），没有安排重连时为None
+        """
+        with self._cond:
+            if self._state in (self.CLOSED, self.BACKING_OFF):
+                return None
+            delay = self.policy.delay(self.attempts)
+            self.attempts += 1
+            self._state = self.BACKING_OFF
+            if loop is None:
+                self._timer = threading.Timer(delay, reconnect)
+                self._timer.daemon = True
+                self._timer.start()
+        if loop is not None:
+            loop.call_soon_threadsafe(self._arm, loop, delay, reconnect)
+        print(f"MQTT将在{delay:.1f}秒后重连（第{self.attempts}次）")
+        return delay
+
+    def close(self):
+        """关闭状态机，取消待执行的重连，唤醒所有等待者"""
+        with self._cond:
+            self._state = self.CLOSED
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._handle is not None:
+                loop, handle = self._handle
+                loop.call_soon_threadsafe(handle.cancel)
+                self._handle = None
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._set_future_result, future, False)
+
+    def wait_connected(self, timeout=10.0):
+        """
+        阻塞等待连接就绪（条件变量等待，不轮询）
+
+        Args:
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            bool: 超时前是否已连接
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._state in (self.CONNECTED, self.CLOSED), timeout)
+            return self._state == self.CONNECTED
+
+    async def wait_connected_async(self, timeout=10.0):
+        """
+        在事件循环中等待连接就绪，不占用线程
+
+        Args:
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            bool: 超时前是否已连接
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._state == self.CONNECTED:
+                return True
+            if self._state == self.CLOSED:
+                return False
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                self._async_waiters = [waiter for waiter in self._async_waiters if waiter[1] is not future]
+
+    def _arm(self, loop, delay, reconnect):
+        """在事件循环线程中登记延迟重连；关闭后不再登记"""
+        with self._cond:
+            if self._state == self.CLOSED:
+                return
+            handle = loop.call_later(delay, lambda: loop.create_task(reconnect()))
+            self._handle = (loop, handle)
+
+    def _set_state(self, state):
+        with self._cond:
+            if self._state != self.CLOSED:
+                self._state = state
+                self._cond.notify_all()
+
+    @staticmethod
+    def _set_future_result(future, result):
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,49 @@
+# 锁控制器data_report解析：从SN或显式字段中取出控制器ID和子锁号
+
+# data_report中SN的第2~4位是锁号，对应的控制器ID
+SN_CONTROLLER_IDS = {
+    "002": "866846061120977",
+    "003": "866846061051685",
+}
+
+
+def parse_sn(sn):
+    """
+    从data_report的SN解析 (控制器ID, 子锁号)
+
+    第2~4位为锁号（映射到控制器ID，未知锁号原样作为控制器ID），
+    第5~16位为插销ID，其最后一位为子锁号，不是数字时按1处理。
+
+    Args:
+        sn (str): data_report中的SN
+
+    Returns:
+        tuple: (控制器ID, 子锁号)，SN不足16位返回None
+    """
+    if not sn or len(sn) < 16:
+        return None
+    lock_number = sn[1:4]
+    sub_lock = sn[15]
+    return SN_CONTROLLER_IDS.get(lock_number, lock_number), int(sub_lock) if sub_lock.isdigit() else 1
+
+
+def report_lock_key(data):
+    """
+    从data_report消息中取出 (控制器ID, 子锁号)
+
+    消息带有controllerId/subLock字段时直接使用；否则按 parse_sn 从SN解析。
+
+    Args:
+        data (dict): 解析后的data_report消息
+
+    Returns:
+        tuple: (控制器ID, 子锁号)，无法识别返回None
+    """
+    controller_id = data.get("controllerId")
+    sub_lock = data.get("subLock")
+    if controller_id is None or sub_lock is None:
+        return parse_sn(data.get("SN"))
+    try:
+        return str(controller_id), int(sub_lock)
+    except (TypeError, ValueError):
+        return None
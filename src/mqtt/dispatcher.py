@@ -0,0 +1,168 @@
+# MQTT消息分发：把主题处理函数从paho网络线程移到工作线程池，同一个键的消息按到达顺序处理
+import queue
+import threading
+import time
+
+from src.mqtt.data_report import report_lock_key
+from src.mqtt.metrics import LatencyHistogram
+
+
+def message_key(topic, data=None):
+    """
+    消息的分发键，同一个键的消息按到达顺序处理
+
+    能识别出锁控制器的消息按控制器ID分发，其余按主题分发。
+
+    Args:
+        topic (str): 主题
+        data: 解析后的消息内容，非字典时忽略
+
+    Returns:
+        str: 分发键
+    """
+    if isinstance(data, dict):
+        key = report_lock_key(data)
+        if key is not None:
+            return key[0]
+    return topic
+
+
+class MessageDispatcher:
+    """
+    按键分片的工作线程池。
+
+    每个工作线程有自己的有界队列，消息按键的哈希分到固定的线程，
+    因此同一个键（如同一个锁控制器）的消息严格按到达顺序处理，不同键之间并行处理。
+
+    队列满时submit先阻塞最多put_timeout秒（网络线程放慢读取，形成背压），仍然放不进去才丢弃并计数。
+    """
+
+    def __init__(self, workers=4, queue_size=256, put_timeout=1.0, name="mqtt-dispatch"):
+        """
+        初始化并启动工作线程
+
+        Args:
+            workers (int): 工作线程数
+            queue_size (int): 每个工作线程队列的容量
+            put_timeout (float): 队列满时最多等待的时间（秒）
+            name (str): 线程名前缀
+        """
+        self.put_timeout = put_timeout
+        # 从放入队列到处理完成的时延
+        self.latency = LatencyHistogram("消息分发时延")
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        # submit因队列满而等待的次数
+        self.blocked = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(work_queue,), name=f"{name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, handler, *args):
+        """
+        提交一条消息
+
+        Args:
+            key: 分片键，相同键的消息按提交顺序处理
+            handler: 处理函数
+            *args: 传给处理函数的参数
+
+        Returns:
+            bool: 是否已放入队列（已停止或等待超时返回False）
+        """
+        if self._stopped:
+            return False
+        work_queue = self._queues[hash(key) % len(self._queues)]
+        item = (handler, args, time.perf_counter())
+        try:
+            work_queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.blocked += 1
+            try:
+                work_queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                print(f"消息分发队列已满，丢弃消息: 键={key}")
+                return False
+
+        depth = work_queue.qsize()
+        with self._lock:
+            self.submitted += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def _worker(self, work_queue):
+        """工作线程：按顺序处理自己队列中的消息，收到None时退出"""
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+            handler, args, queued_at = item
+            try:
+                handler(*args)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"处理MQTT消息时出错: {e}")
+            finally:
+                self.latency.observe(time.perf_counter() - queued_at)
+                work_queue.task_done()
+
+    def depths(self):
+        """各工作线程当前排队的消息数"""
+        return [work_queue.qsize() for work_queue in self._queues]
+
+    def join(self):
+        """等待已提交的消息全部处理完"""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def stats(self):
+        """
+        分发统计
+
+        Returns:
+            dict: 提交/处理/失败/丢弃/阻塞次数、当前和最大队列深度，以及分发时延快照
+        """
+        depths = self.depths()
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "depth": sum(depths),
+                "depths": depths,
+                "max_depth": self.max_depth,
+                "latency": self.latency.snapshot(),
+            }
+
+    def stop(self, timeout=5.0):
+        """处理完已排队的消息后停止工作线程"""
+        if self._stopped:
+            return
+        self._stopped = True
+        for work_queue in self._queues:
+            try:
+                work_queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
@@ -6,27 +6,70 @@ import asyncio
 import threading
 import time
 import paho.mqtt.client as mqtt
-from queue import Queue, Empty
+
+from src.mqtt.async_transport import AsyncMQTTTransport
+from src.mqtt.connection import ConnectionStateMachine
+from src.mqtt.data_report import report_lock_key
+from src.mqtt.dispatcher import MessageDispatcher, message_key
+from src.mqtt.message_buffer import MessageRingBuffer
+from src.mqtt.topic_router import TopicRouter
+from src.mqtt.metrics import LatencyHistogram
+from src.mqtt.publisher import PublishWindow, encode_payload
+
+# 锁控制器上报状态的主题
+DATA_REPORT_TOPIC = "data_report"
+# 时延统计发布的主题
+METRICS_TOPIC = "scooter_controller/metrics"
+# 入站消息缓冲：合计保留的条数，以及data_report最多保留的条数
+INBOX_CAPACITY = 1000
+INBOX_TOPIC_LIMITS = {DATA_REPORT_TOPIC: 500}
+# 执行主题处理函数的工作线程数
+DISPATCH_WORKERS = 4
+# 断线期间存入待发送表的命令默认有效期（秒），过期不再补发，避免很久以后才开锁
+OUTBOX_TTL = 120.0
+# 重连后补发待发送命令的在途窗口
+OUTBOX_REPLAY_WINDOW = 20
+
 
 class MQTTLockController:
     """
     使用MQTT协议控制车锁，基于paho-mqtt库
     """
     
-    def __init__(self, mqtt_host="mqtt.xcubesports.com.cn", mqtt_user="myuser", mqtt_password="kejin", mqtt_port=1883):
-        """初始化MQTT控制器"""
+    def __init__(self, mqtt_host="mqtt.xcubesports.com.cn", mqtt_user="myuser", mqtt_password="kejin", mqtt_port=1883,
+                 outbox=None):
+        """
+        初始化MQTT控制器
+        
+        Args:
+            outbox (OutboxManager): 可选，断线期间的命令存入该待发送表，重连后补发
+        """
         # 使用正确的MQTT服务器配置
         self.mqtt_host = mqtt_host
         self.mqtt_port = mqtt_port
         self.mqtt_user = mqtt_user
         self.mqtt_password = mqtt_password
         self.client = None
-        self.connected = False
-        self.response_queue = Queue()
+        # 连接状态与自动重连，见 ConnectionStateMachine
+        self.connection = ConnectionStateMachine()
+        # 切换到asyncio传输后由事件循环驱动客户端，见 use_asyncio_transport
+        self.transport = None
+        self.outbox = outbox
+        self._replay_lock = threading.Lock()
+        # 最近收到的消息，容量固定，满了覆盖最旧的
+        self.inbox = MessageRingBuffer(INBOX_CAPACITY, INBOX_TOPIC_LIMITS)
         self.subscribed_topics = set()
         
-        # 回调函数字典，用于处理特定主题的消息
-        self.topic_handlers = {}
+        # 主题过滤器（支持+/#）-> 处理函数，一个过滤器可以有多个处理函数
+        self.topic_handlers = TopicRouter()
+        # 处理函数在工作线程中执行，不阻塞网络线程的确认和保活
+        self.dispatcher = MessageDispatcher(workers=DISPATCH_WORKERS)
+        
+        # 等待开锁确认的请求：(控制器ID, 子锁号) -> [(事件循环, future, 发送时间)]
+        self._unlock_waiters = {}
+        self._waiters_lock = threading.Lock()
+        # 从发出开锁命令到收到data_report开锁上报的时延
+        self.ack_latency = LatencyHistogram("开锁确认时延")
         
         # 创建客户端并初始化连接
         self._init_client()
@@ -35,7 +78,8 @@ class MQTTLockController:
         """初始化MQTT客户端和连接"""
         # 创建客户端
         client_id = f"scooter_controller_{int(time.time())}"
-        self.client = mqtt.Client(client_id=client_id)
+        # 重连由状态机按退避策略安排，不使用paho网络线程内置的重连
+        self.client = mqtt.Client(client_id=client_id, reconnect_on_failure=False)
         
         # 设置认证信息
         self.client.username_pw_set(self.mqtt_user, self.mqtt_password)
@@ -44,12 +88,20 @@ class MQTTLockController:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        # 批量发布时按消息ID跟踪PUBACK
+        self.publisher = PublishWindow(self.client)
         
         # 启动连接线程
         self._connect()
     
+    @property
+    def connected(self):
+        """是否已连接"""
+        return self.connection.is_connected
+    
     def _connect(self):
         """连接到MQTT服务器"""
+        self.connection.mark_connecting()
         try:
             print(f"开始连接MQTT服务器: {self.mqtt_host}:{self.mqtt_port}, 用户: {self.mqtt_user}")
             self.client.connect(self.mqtt_host, self.mqtt_port, keepalive=60)
@@ -58,18 +110,63 @@ class MQTTLockController:
             print(f"MQTT连接请求已发送，等待连接回调...")
         except Exception as e:
             print(f"MQTT连接异常: {e}")
-            import traceback
-            traceback.print_exc()
-            self.connected = False
+            self._schedule_reconnect()
+    
+    def _schedule_reconnect(self):
+        """按退避策略安排下一次重连"""
+        if self.transport is not None:
+            self.connection.schedule_reconnect(self._async_reconnect, self.transport.loop)
+        else:
+            self.connection.schedule_reconnect(self._reconnect)
+    
+    def _reconnect(self):
+        """重连一次（在重连定时器线程中执行）"""
+        if self.connection.closed:
+            return
+        if self.transport is not None:
+            # 等待期间已切换到asyncio传输，改由事件循环重连
+            asyncio.run_coroutine_threadsafe(self._async_reconnect(), self.transport.loop)
+            return
+        self.connection.mark_connecting()
+        try:
+            # 异常断开后paho网络线程已退出，重连后重新启动
+            self.client.loop_stop()
+            self.client.reconnect()
+            self.client.loop_start()
+        except Exception as e:
+            print(f"MQTT重连失败: {e}")
+            self._schedule_reconnect()
+    
+    async def _async_reconnect(self):
+        """在事件循环中重连一次"""
+        if self.connection.closed:
+            return
+        self.connection.mark_connecting()
+        try:
+            connected = await self.transport.reconnect()
+        except Exception as e:
+            print(f"MQTT重连失败: {e}")
+            connected = False
+        if not connected:
+            self._schedule_reconnect()
     
     def _on_connect(self, client, userdata, flags, rc):
         """连接建立回调函数"""
         if rc == 0:
             print("MQTT连接成功")
-            self.connected = True
+            # 服务器不保留会话，重连后重新订阅之前的主题
+            if self.subscribed_topics:
+                client.subscribe([(topic, 0) for topic in sorted(self.subscribed_topics)])
+                print(f"已重新订阅主题: {', '.join(sorted(self.subscribed_topics))}")
+            # 先占住补发锁再标记已连接，补发完成前新命令继续进入待发送表，不会越过待补发的旧命令
+            replay = self.outbox is not None and self._replay_lock.acquire(blocking=False)
+            self.connection.mark_connected()
+            # 补发需要等待PUBACK，不能在网络线程中进行
+            if replay:
+                threading.Thread(target=self._replay_locked, name="mqtt-outbox-replay", daemon=True).start()
         else:
+            # 连接被拒绝后paho会接着调用断开回调，由那里安排重连
             print(f"MQTT连接失败，返回码: {rc}")
-            self.connected = False
     
     def _on_message(self, client, userdata, msg):
         """消息接收回调函数"""
@@ -78,10 +175,13 @@ class MQTTLockController:
             payload = msg.payload.decode()
             print(f"收到MQTT消息: 主题={topic}, 内容={payload}")
             
+            data = None
             # 对data_report主题进行特殊处理
-            if topic == "data_report":
+            if topic == DATA_REPORT_TOPIC:
                 try:
                     data = json.loads(payload)
+                    if isinstance(data, dict):
+                        self._resolve_unlock_waiters(data)
                     print("=" * 50)
                     print("收到锁控制器响应:")
                     print(f"响应内容: {payload}")
@@ -98,44 +198,108 @@ class MQTTLockController:
                 except json.JSONDecodeError:
                     print(f"无法解析data_report响应JSON: {payload}")
             
-            # 如果有特定主题的处理函数，则调用它
-            if topic in self.topic_handlers:
-                self.topic_handlers[topic](topic, payload)
+            # 匹配该主题的处理函数交给工作线程调用，同一个键的消息按顺序处理
+            handlers = self.topic_handlers.match(topic)
+            if handlers:
+                key = message_key(topic, data)
+                for handler in handlers:
+                    self.dispatcher.submit(key, handler, topic, payload)
             
-            # 将响应放入队列
-            self.response_queue.put((topic, payload))
+            # 放入入站缓冲，供需要时通过 get_message 读取
+            self.inbox.put(topic, payload)
         except Exception as e:
             print(f"处理MQTT消息时出错: {e}")
     
     def _on_disconnect(self, client, userdata, rc):
         """断开连接回调函数"""
         print(f"MQTT连接断开, 返回码: {rc}")
-        self.connected = False
         if rc != 0:
-            print("尝试重新连接...")
-            self._connect()
+            self._schedule_reconnect()
+        else:
+            self.connection.mark_disconnected()
+    
+    async def use_asyncio_transport(self):
+        """
+        改由当前事件循环驱动MQTT客户端，停止loop_start()后台线程
+        
+        之后的异步接口直接await发布、订阅确认和连接状态，不再占用线程池和轮询等待；
+        同步接口仍然可以在其他线程中调用。
+        
+        Returns:
+            bool: 是否已切换到asyncio传输
+        """
+        if self.transport is not None:
+            return True
+        transport = AsyncMQTTTransport(self.client)
+        try:
+            await transport.start()
+        except NotImplementedError as e:
+            print(f"无法使用asyncio传输，继续使用后台线程: {e}")
+            return False
+        self.transport = transport
+        print("MQTT已切换到asyncio传输")
+        if self.connection.state == ConnectionStateMachine.DISCONNECTED:
+            self.connection.mark_connecting()
+            try:
+                await transport.connect(self.mqtt_host, self.mqtt_port, keepalive=60)
+            except Exception as e:
+                print(f"MQTT连接异常: {e}")
+                self._schedule_reconnect()
+        return True
+    
+    async def _async_subscribe(self, topic, timeout=5.0):
+        """异步订阅主题，如果尚未订阅"""
+        if self.transport is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._subscribe_topic, topic)
+        if topic in self.subscribed_topics:
+            return True
+        if not await self.connection.wait_connected_async(timeout):
+            print(f"无法订阅主题 {topic}: MQTT未连接")
+            return False
+        try:
+            await self.transport.subscribe(topic, timeout=timeout)
+        except Exception as e:
+            print(f"订阅主题 {topic} 失败: {e}")
+            return False
+        print(f"已订阅主题: {topic}")
+        self.subscribed_topics.add(topic)
+        return True
+    
+    async def _async_publish(self, topic, payload, timeout=10.0, ttl=OUTBOX_TTL):
+        """异步发布命令；使用asyncio传输时等待PUBACK，未连接时存入待发送表"""
+        if self.transport is None or self._must_queue():
+            return self._send_command(topic, payload, ttl)
+        if not await self.connection.wait_connected_async(timeout):
+            print(f"MQTT命令发送失败: {topic} - MQTT未连接")
+            return False
+        try:
+            latency = await self.transport.publish(topic, payload, qos=1, timeout=timeout)
+        except ConnectionError as e:
+            if self.outbox is not None:
+                return self._queue_command(topic, payload, ttl)
+            print(f"MQTT命令发送失败: {topic} - {e}")
+            return False
+        except Exception as e:
+            print(f"MQTT命令发送失败: {topic} - {e or '等待PUBACK超时'}")
+            return False
+        print(f"MQTT命令发送: {topic} - {json.dumps(payload)}, PUBACK {latency * 1000:.0f}ms")
+        return True
     
     def _ensure_connected(self, timeout=5):
-        """确保MQTT客户端已连接"""
-        print(f"检查MQTT连接状态: {'已连接' if self.connected else '未连接'}")
-        start_time = time.time()
-        while not self.connected and time.time() - start_time < timeout:
-            time.sleep(0.1)
-        
-        if not self.connected:
-            print("MQTT未连接，尝试重连...")
-            self._connect()
-            start_time = time.time()
-            # 再次等待连接
-            while not self.connected and time.time() - start_time < timeout:
-                time.sleep(0.1)
-                
-            if self.connected:
-                print("MQTT重连成功")
-            else:
-                print("MQTT重连失败")
+        """
+        确保MQTT客户端已连接
         
-        return self.connected
+        连接中或退避中时等待状态机通知；只有在没有连接也没有安排重连时才主动发起连接。
+        """
+        state = self.connection.state
+        print(f"检查MQTT连接状态: {state}")
+        if state == ConnectionStateMachine.DISCONNECTED:
+            self._connect()
+        if self.connection.wait_connected(timeout):
+            return True
+        print(f"MQTT未连接（{self.connection.state}）")
+        return False
     
     def _subscribe_topic(self, topic):
         """订阅主题，如果尚未订阅"""
@@ -170,15 +334,7 @@ class MQTTLockController:
         topic = f"ULC{controller_id}"
         payload = {"taskId": 1, "payload": {"SLN": sub_lock_number}}
         
-        # 简化版本的命令发送
-        try:
-            payload_str = json.dumps(payload)
-            self.client.publish(topic, payload_str, qos=1)
-            print(f"MQTT开锁命令已发送: {topic} - {payload_str}")
-            return True
-        except Exception as e:
-            print(f"MQTT开锁命令发送失败: {e}")
-            return False
+        return self._send_command(topic, payload)
     
     def query_status(self, controller_id, sub_lock_number=1):
         """
@@ -195,29 +351,38 @@ class MQTTLockController:
         payload = {"taskId": 2, "payload": {"SLN": sub_lock_number}}
         
         # 确保订阅data_report主题用于接收反馈
-        self._subscribe_topic("data_report")
+        self._subscribe_topic(DATA_REPORT_TOPIC)
         
         # 发送命令
         return self._send_command(topic, payload)
     
-    def _send_command(self, topic, payload):
+    def _send_command(self, topic, payload, ttl=OUTBOX_TTL):
         """
         发送MQTT命令
         
+        配置了待发送表时，未连接、正在补发或发布失败的命令存入待发送表，重连后补发。
+        
         Args:
             topic (str): MQTT主题
             payload (dict): 命令载荷
+            ttl (float): 存入待发送表时的有效期（秒）
             
         Returns:
-            bool: 操作是否成功
+            bool: 操作是否成功（已存入待发送表也视为成功）
         """
+        if self._must_queue():
+            return self._queue_command(topic, payload, ttl)
         try:
-            # 直接使用client发送命令，不检查连接状态
             # 将字典转换为JSON字符串
             payload_str = json.dumps(payload)
             
             # 发布消息
             result = self.client.publish(topic, payload_str, qos=1)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                if self.outbox is not None:
+                    return self._queue_command(topic, payload, ttl)
+                print(f"MQTT命令发送失败: {topic} - {mqtt.error_string(result.rc)}")
+                return False
             print(f"MQTT命令发送: {topic} - {payload_str}")
             return True
                 
@@ -225,10 +390,220 @@ class MQTTLockController:
             print(f"发送MQTT命令时出错: {e}")
             return False
     
+    def _must_queue(self):
+        """新命令是否要先进入待发送表：未连接，或补发尚未完成（保证命令按发出顺序到达）"""
+        return self.outbox is not None and (not self.connected or self._replay_lock.locked())
+    
+    def _queue_command(self, topic, payload, ttl):
+        """把命令存入待发送表"""
+        message_id = self.outbox.enqueue(topic, encode_payload(payload), ttl)
+        if message_id is None:
+            return False
+        reason = "MQTT未连接" if not self.connected else "正在补发"
+        print(f"{reason}，命令已存入待发送表: {topic} (#{message_id}, {ttl:.0f}秒内有效)")
+        return True
+    
+    def replay_outbox(self, window=OUTBOX_REPLAY_WINDOW, timeout=10.0):
+        """
+        补发待发送表中未过期的命令
+        
+        命令收到PUBACK后才标记为已发送，失败的保留到过期；同一时间只有一个补发在进行。
+        补发期间新发出的命令也进入待发送表，本次补发会一直发到表中没有待发送命令为止。
+        
+        Args:
+            window (int): 最多同时在途的消息数
+            timeout (float): 单条消息等待PUBACK的超时（秒）
+            
+        Returns:
+            int: 补发成功的命令数
+        """
+        if self.outbox is None or not self._replay_lock.acquire(blocking=False):
+            return 0
+        return self._replay_locked(window, timeout)
+    
+    def _replay_locked(self, window=OUTBOX_REPLAY_WINDOW, timeout=10.0):
+        """补发待发送命令并释放补发锁（调用方已持有补发锁）"""
+        total = 0
+        try:
+            expired = self.outbox.expire_stale()
+            if expired:
+                print(f"待发送表中有{expired}条命令已过期，不再补发")
+            while self.connected:
+                pending = self.outbox.get_pending()
+                if not pending:
+                    break
+                print(f"补发待发送命令: {len(pending)}条")
+                summary = self.publisher.publish_many(
+                    ((message["topic"], message["payload"]) for message in pending), window=window, timeout=timeout
+                )
+                sent = []
+                for message, result in zip(pending, summary["results"]):
+                    if result["error"] is None:
+                        sent.append(message["message_id"])
+                    else:
+                        self.outbox.mark_failed(message["message_id"], result["error"])
+                self.outbox.mark_sent(sent)
+                total += len(sent)
+                # 有命令补发失败时留到下次重连，避免在同一批命令上反复重试
+                if len(sent) < len(pending):
+                    break
+            self.outbox.purge_finished()
+            return total
+        finally:
+            self._replay_lock.release()
+    
+    def publish_many(self, messages, window=20, timeout=10.0):
+        """
+        流水线发布多条命令，在途消息数不超过窗口大小，并等待每条消息的PUBACK
+        
+        Args:
+            messages: (主题, 载荷字典) 的可迭代对象
+            window (int): 最多同时在途的消息数
+            timeout (float): 单条消息等待PUBACK的超时（秒）
+            
+        Returns:
+            dict: 每条消息的PUBACK时延和失败原因，格式见 PublishWindow.publish_many
+        """
+        return self.publisher.publish_many(messages, window=window, timeout=timeout, qos=1)
+    
+    def unlock_many(self, controller_id, sub_lock_numbers, window=20, timeout=10.0):
+        """
+        一次打开同一控制器的多个子锁
+        
+        Args:
+            controller_id (str): 控制器ID
+            sub_lock_numbers (list): 子锁号码列表
+            window (int): 最多同时在途的消息数
+            timeout (float): 单条消息等待PUBACK的超时（秒）
+            
+        Returns:
+            dict: 批量发布结果，results与sub_lock_numbers一一对应
+        """
+        topic = f"ULC{controller_id}"
+        print(f"执行MQTT批量解锁: 控制器 {controller_id} 的子锁 {list(sub_lock_numbers)}")
+        return self.publish_many(
+            ((topic, {"taskId": 1, "payload": {"SLN": sub_lock_number}}) for sub_lock_number in sub_lock_numbers),
+            window=window, timeout=timeout
+        )
+    
+    async def async_unlock_many(self, controller_id, sub_lock_numbers, window=20, timeout=10.0):
+        """异步批量解锁，在线程池中等待PUBACK，不阻塞事件循环"""
+        return await self._async_send_command(
+            lambda: self.unlock_many(controller_id, sub_lock_numbers, window, timeout)
+        )
+    
+    async def unlock_and_confirm(self, controller_id, sub_lock_number=1, timeout=10.0):
+        """
+        发送开锁命令，并等待锁控制器通过data_report上报开锁状态（state为"0"）
+        
+        Args:
+            controller_id (str): 控制器ID
+            sub_lock_number (int, optional): 子锁号码，默认为1
+            timeout (float): 等待开锁上报的超时时间（秒）
+            
+        Returns:
+            dict: {
+                "confirmed": 是否收到开锁确认,
+                "status": "已确认" / "超时" / "发送失败",
+                "latency": 发送到确认的时延（秒），未确认为None
+            }
+        """
+        loop = asyncio.get_running_loop()
+        key = (str(controller_id), int(sub_lock_number))
+        future = loop.create_future()
+        sent_at = time.perf_counter()
+        # 先登记再发送，避免上报早于登记到达
+        with self._waiters_lock:
+            self._unlock_waiters.setdefault(key, []).append((loop, future, sent_at))
+        
+        try:
+            subscribed = await self._async_subscribe(DATA_REPORT_TOPIC)
+            if not subscribed and self.outbox is not None:
+                # 命令会存入待发送表，记下主题，重连后与其他主题一起重新订阅
+                self.subscribed_topics.add(DATA_REPORT_TOPIC)
+                subscribed = True
+            topic = f"ULC{controller_id}"
+            payload = {"taskId": 1, "payload": {"SLN": sub_lock_number}}
+            # 命令在等待超时的同时过期，调用方放弃后不会再被补发
+            if not subscribed or not await self._async_publish(topic, payload, ttl=timeout):
+                return {"confirmed": False, "status": "发送失败", "latency": None}
+            
+            try:
+                latency = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self.ack_latency.observe_timeout()
+                print(f"等待开锁确认超时: 控制器 {controller_id} 的子锁 {sub_lock_number}, 超时 {timeout}秒")
+                return {"confirmed": False, "status": "超时", "latency": None}
+            
+            self.ack_latency.observe(latency)
+            print(f"开锁已确认: 控制器 {controller_id} 的子锁 {sub_lock_number}, 时延 {latency * 1000:.0f}ms")
+            return {"confirmed": True, "status": "已确认", "latency": latency}
+        finally:
+            self._remove_unlock_waiter(key, future)
+    
+    def _resolve_unlock_waiters(self, data):
+        """收到开锁状态上报时，完成所有等待该锁的请求（在MQTT网络线程中调用）"""
+        if str(data.get("state")) != "0":
+            return
+        key = report_lock_key(data)
+        if key is None:
+            return
+        received_at = time.perf_counter()
+        with self._waiters_lock:
+            waiters = self._unlock_waiters.pop(key, [])
+        for loop, future, sent_at in waiters:
+            loop.call_soon_threadsafe(self._set_future_result, future, received_at - sent_at)
+    
+    @staticmethod
+    def _set_future_result(future, result):
+        if not future.done():
+            future.set_result(result)
+    
+    def _remove_unlock_waiter(self, key, future):
+        """移除一个等待中的开锁请求"""
+        with self._waiters_lock:
+            waiters = self._unlock_waiters.get(key)
+            if not waiters:
+                return
+            waiters[:] = [waiter for waiter in waiters if waiter[1] is not future]
+            if not waiters:
+                del self._unlock_waiters[key]
+    
+    def get_message(self, timeout=None, topic=None):
+        """
+        读取入站缓冲中最早的一条消息
+        
+        Args:
+            timeout (float): 没有消息时最多等待的时间（秒），None表示一直等待
+            topic (str): 只读取该主题的消息（不等待）
+            
+        Returns:
+            tuple: (主题, 内容, 接收时间)，没有消息返回None
+        """
+        if topic is not None:
+            messages = self.inbox.drain(topic, max_items=1)
+            return messages[0] if messages else None
+        return self.inbox.get(timeout)
+    
+    def publish_ack_latency(self, topic=METRICS_TOPIC):
+        """
+        发布开锁确认时延直方图
+        
+        Args:
+            topic (str): 发布的主题
+            
+        Returns:
+            bool: 是否发布成功
+        """
+        print(self.ack_latency)
+        return self._send_command(topic, self.ack_latency.snapshot())
+    
     def close(self):
         """
         关闭MQTT连接
         """
+        self.connection.close()
+        self.dispatcher.stop()
         if self.client:
             self.client.loop_stop()
             self.client.disconnect()
@@ -250,10 +625,9 @@ class MQTTLockController:
         print(f"异步解锁请求: 控制器={controller_id}, 子锁={sub_lock_number}")
         
         # 确保订阅data_report主题
-        self._subscribe_topic("data_report")
+        await self._async_subscribe(DATA_REPORT_TOPIC)
         
-        # 直接发送命令，不使用异步包装
-        return self._send_command(topic, payload)
+        return await self._async_publish(topic, payload)
     
     async def async_query_status(self, controller_id, sub_lock_number=1):
         """
@@ -266,9 +640,12 @@ class MQTTLockController:
         Returns:
             bool: 操作是否成功
         """
-        return await self._async_send_command(
-            lambda: self.query_status(controller_id, sub_lock_number)
-        )
+        if self.transport is None:
+            return await self._async_send_command(
+                lambda: self.query_status(controller_id, sub_lock_number)
+            )
+        await self._async_subscribe(DATA_REPORT_TOPIC)
+        return await self._async_publish(f"QRY{controller_id}", {"taskId": 2, "payload": {"SLN": sub_lock_number}})
     
     async def _async_send_command(self, command_func):
         """
@@ -300,10 +677,22 @@ class MQTTLockController:
         Returns:
             bool: 是否订阅成功
         """
-        topic = "data_report"
-        success = self._subscribe_topic(topic)
+        return self.subscribe(DATA_REPORT_TOPIC, callback_function)
+    
+    def subscribe(self, topic_filter, callback_function=None):
+        """
+        订阅主题并添加处理函数，已有的处理函数保留
+        
+        Args:
+            topic_filter (str): 主题或带+/#通配符的过滤器，如 "+/data_report"
+            callback_function: 收到匹配消息时的回调函数，接收(topic, payload)两个参数
+            
+        Returns:
+            bool: 是否订阅成功
+        """
+        success = self._subscribe_topic(topic_filter)
         
         if success and callback_function:
-            self.topic_handlers[topic] = callback_function
+            self.topic_handlers.add(topic_filter, callback_function)
             
         return success 
\ No newline at end of file
@@ -0,0 +1,154 @@
+# MQTT入站消息环形缓冲：容量固定，满了覆盖最旧的消息，可以按主题限制保留条数
+import threading
+import time
+from collections import deque
+
+
+class MessageRingBuffer:
+    """
+    固定容量的入站消息缓冲。
+
+    - 每个主题一个环形队列，保留条数由 topic_limits 单独指定，未指定的主题使用 default_topic_limit
+    - 所有主题合计不超过 capacity，超出时覆盖全局最旧的一条
+    - 被覆盖的消息按主题计数，消费者可以据此判断是否丢了消息
+
+    put 在MQTT网络线程中调用，get/drain 可以在任意线程中调用。
+    """
+
+    def __init__(self, capacity=1000, topic_limits=None, default_topic_limit=None):
+        """
+        初始化缓冲
+
+        Args:
+            capacity (int): 所有主题合计保留的消息数
+            topic_limits (dict): 主题 -> 该主题最多保留的消息数
+            default_topic_limit (int): 未在topic_limits中的主题最多保留的消息数，默认等于capacity
+        """
+        self.capacity = capacity
+        self.topic_limits = dict(topic_limits or {})
+        self.default_topic_limit = default_topic_limit or capacity
+        # 主题 -> deque[(序号, 主题, 内容, 接收时间)]
+        self._topics = {}
+        self._size = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+
+        self.received = 0
+        self.consumed = 0
+        self.overwritten = 0
+        self.overwritten_by_topic = {}
+
+    def put(self, topic, payload):
+        """
+        放入一条消息，缓冲已满时覆盖最旧的消息
+
+        Args:
+            topic (str): 主题
+            payload (str): 消息内容
+        """
+        with self._cond:
+            messages = self._topics.get(topic)
+            if messages and len(messages) >= self.topic_limits.get(topic, self.default_topic_limit):
+                self._drop_oldest(messages)
+            elif self._size >= self.capacity:
+                self._drop_oldest(self._oldest_queue())
+
+            # 覆盖后主题队列可能已被删除，重新获取
+            messages = self._topics.setdefault(topic, deque())
+            self._seq += 1
+            messages.append((self._seq, topic, payload, time.time()))
+            self._size += 1
+            self.received += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        取出最早的一条消息
+
+        Args:
+            timeout (float): 没有消息时最多等待的时间（秒），None表示一直等待，0表示不等待
+
+        Returns:
+            tuple: (主题, 内容, 接收时间)，超时返回None
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._size > 0, timeout):
+                return None
+            return self._pop(self._oldest_queue())
+
+    def drain(self, topic=None, max_items=None):
+        """
+        取出所有（或指定主题的）消息，不等待
+
+        Args:
+            topic (str): 只取该主题的消息，None表示所有主题
+            max_items (int): 最多取出的条数
+
+        Returns:
+            list: [(主题, 内容, 接收时间)]，按接收顺序排列
+        """
+        items = []
+        with self._cond:
+            while self._size and (max_items is None or len(items) < max_items):
+                messages = self._topics.get(topic) if topic is not None else self._oldest_queue()
+                if not messages:
+                    break
+                items.append(self._pop(messages))
+        return items
+
+    def latest(self, topic):
+        """
+        查看某个主题最新的一条消息，不取出
+
+        Returns:
+            tuple: (主题, 内容, 接收时间)，没有返回None
+        """
+        with self._cond:
+            messages = self._topics.get(topic)
+            if not messages:
+                return None
+            return messages[-1][1:]
+
+    def stats(self):
+        """
+        缓冲统计
+
+        Returns:
+            dict: 当前条数、容量、累计接收/取出/覆盖数，以及各主题当前条数和覆盖数
+        """
+        with self._cond:
+            return {
+                "size": self._size,
+                "capacity": self.capacity,
+                "received": self.received,
+                "consumed": self.consumed,
+                "overwritten": self.overwritten,
+                "topics": {topic: len(messages) for topic, messages in self._topics.items() if messages},
+                "overwritten_by_topic": dict(self.overwritten_by_topic),
+            }
+
+    def __len__(self):
+        with self._cond:
+            return self._size
+
+    def _oldest_queue(self):
+        """序号最小的消息所在的主题队列（需持有锁）"""
+        return min((messages for messages in self._topics.values() if messages), key=lambda messages: messages[0][0])
+
+    def _pop(self, messages):
+        """从主题队列头部取出一条消息（需持有锁）"""
+        _, topic, payload, received_at = messages.popleft()
+        self._size -= 1
+        self.consumed += 1
+        if not messages:
+            del self._topics[topic]
+        return topic, payload, received_at
+
+    def _drop_oldest(self, messages):
+        """覆盖主题队列中最旧的一条消息（需持有锁）"""
+        _, topic, _, _ = messages.popleft()
+        self._size -= 1
+        self.overwritten += 1
+        self.overwritten_by_topic[topic] = self.overwritten_by_topic.get(topic, 0) + 1
+        if not messages:
+            del self._topics[topic]
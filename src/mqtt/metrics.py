@@ -0,0 +1,127 @@
+# MQTT时延统计：固定分桶的直方图，用于根据实际数据确定超时时间
+import bisect
+import threading
+
+# 默认分桶上界（秒）
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+
+def percentile(sorted_values, percent, default=None):
+    """
+    已排序样本的百分位数，供压测统计原始样本使用
+
+    Args:
+        sorted_values (list): 从小到大排序的样本
+        percent (float): 百分位，如95
+        default: 没有样本时的返回值
+
+    Returns:
+        样本中的百分位值，没有样本返回default
+    """
+    if not sorted_values:
+        return default
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+class LatencyHistogram:
+    """
+    时延直方图。
+
+    每个样本落入第一个上界不小于它的分桶，超出最大上界的计入溢出桶；
+    超时的请求单独计数，不计入分桶。可以在多个线程中同时记录。
+    """
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        """
+        初始化直方图
+
+        Args:
+            name (str): 统计项名称
+            buckets (tuple): 递增的分桶上界（秒）
+        """
+        self.name = name
+        self.buckets = tuple(buckets)
+        # 最后一个是溢出桶
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """记录一个时延样本"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def observe_timeout(self):
+        """记录一次超时"""
+        with self._lock:
+            self.timeouts += 1
+
+    def percentile(self, percent):
+        """
+        估算百分位时延
+
+        Args:
+            percent (float): 百分位，如95
+
+        Returns:
+            float: 样本所在分桶的上界（溢出桶返回最大值），没有样本返回None
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = self.count * percent / 100.0
+            cumulative = 0
+            for index, bucket_count in enumerate(self.counts):
+                cumulative += bucket_count
+                if cumulative >= target:
+                    return self.buckets[index] if index < len(self.buckets) else self.max
+            return self.max
+
+    def snapshot(self):
+        """
+        当前统计的快照
+
+        Returns:
+            dict: 样本数、超时数、平均值、最大值、p50/p95/p99，以及 "≤上界" -> 样本数 的分桶计数
+        """
+        p50, p95, p99 = self.percentile(50), self.percentile(95), self.percentile(99)
+        with self._lock:
+            buckets = {f"≤{bound:g}s": count for bound, count in zip(self.buckets, self.counts)}
+            buckets[f">{self.buckets[-1]:g}s"] = self.counts[-1]
+            return {
+                "name": self.name,
+                "count": self.count,
+                "timeouts": self.timeouts,
+                "mean": self.total / self.count if self.count else None,
+                "max": self.max,
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "buckets": buckets,
+            }
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.timeouts = 0
+
+    def __str__(self):
+        stats = self.snapshot()
+        if not stats["count"]:
+            return f"{self.name}: 无样本, 超时{stats['timeouts']}次"
+        return (f"{self.name}: 样本{stats['count']}个, 超时{stats['timeouts']}次, "
+                f"平均{stats['mean'] * 1000:.0f}ms, p50≤{stats['p50']:g}s, "
+                f"p95≤{stats['p95']:g}s, p99≤{stats['p99']:g}s, 最大{stats['max'] * 1000:.0f}ms")
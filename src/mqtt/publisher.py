@@ -0,0 +1,142 @@
+# MQTT批量发布：在有限的在途窗口内流水线发布消息，按消息ID跟踪PUBACK
+import json
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from src.mqtt.metrics import LatencyHistogram
+
+
+def encode_payload(payload):
+    """把字典载荷编码为紧凑的JSON字符串，字符串和字节原样返回"""
+    if isinstance(payload, (str, bytes, bytearray)):
+        return payload
+    return json.dumps(payload, separators=(',', ':'))
+
+
+class PublishWindow:
+    """
+    在途窗口发布器。
+
+    连续发布多条消息而不逐条等待确认，同时在途（已发出、未收到PUBACK）的消息数不超过窗口大小；
+    通过client.on_publish按消息ID(mid)匹配确认，记录每条消息的PUBACK时延和失败原因。
+    """
+
+    def __init__(self, client):
+        """
+        初始化发布器并接管client的on_publish回调
+
+        Args:
+            client: paho MQTT客户端
+        """
+        self.client = client
+        self.puback_latency = LatencyHistogram("PUBACK时延")
+        self._cond = threading.Condition()
+        # mid -> 收到确认的时间，只在有批量发布进行时记录
+        self._acked = {}
+        self._active_batches = 0
+        client.on_publish = self._on_publish
+
+    def _on_publish(self, client, userdata, mid, *args):
+        """PUBACK回调（在MQTT网络线程中调用）"""
+        with self._cond:
+            if self._active_batches:
+                self._acked[mid] = time.perf_counter()
+                self._cond.notify_all()
+
+    def publish_many(self, messages, window=20, timeout=10.0, qos=1):
+        """
+        流水线发布多条消息
+
+        Args:
+            messages: (主题, 载荷) 的可迭代对象，载荷为字典或字符串
+            window (int): 最多同时在途的消息数
+            timeout (float): 单条消息等待PUBACK的超时（秒）
+            qos (int): 服务质量等级
+
+        Returns:
+            dict: {
+                "results": [{"topic", "mid", "latency", "error"}]，与输入顺序一致,
+                "acked": 确认成功数, "failed": 失败数,
+                "elapsed": 总耗时（秒）, "throughput": 每秒确认的消息数
+            }
+        """
+        results = []
+        # mid -> 结果字典（附带发送时间）
+        pending = {}
+        started_at = time.perf_counter()
+
+        with self._cond:
+            self._active_batches += 1
+        try:
+            for topic, payload in messages:
+                with self._cond:
+                    self._wait_for_slots(pending, window, timeout)
+
+                result = {"topic": topic, "mid": None, "latency": None, "error": None}
+                results.append(result)
+                sent_at = time.perf_counter()
+                try:
+                    info = self.client.publish(topic, encode_payload(payload), qos=qos)
+                except Exception as e:
+                    result["error"] = f"发布异常: {e}"
+                    continue
+                result["mid"] = info.mid
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    result["error"] = f"发布失败: {mqtt.error_string(info.rc)}"
+                    continue
+                result["_sent_at"] = sent_at
+                pending[info.mid] = result
+
+            with self._cond:
+                self._wait_for_slots(pending, 1, timeout)
+        finally:
+            with self._cond:
+                self._active_batches -= 1
+                if not self._active_batches:
+                    self._acked.clear()
+
+        elapsed = time.perf_counter() - started_at
+        acked = 0
+        for result in results:
+            result.pop("_sent_at", None)
+            if result["error"] is None:
+                acked += 1
+            else:
+                print(f"MQTT消息发送失败: 主题={result['topic']}, mid={result['mid']}, {result['error']}")
+        summary = {
+            "results": results,
+            "acked": acked,
+            "failed": len(results) - acked,
+            "elapsed": elapsed,
+            "throughput": acked / elapsed if elapsed > 0 else 0.0,
+        }
+        print(f"批量发布完成: 共{len(results)}条, 确认{acked}条, 失败{summary['failed']}条, "
+              f"窗口{window}, 耗时{elapsed:.3f}秒, {self.puback_latency}")
+        return summary
+
+    def _wait_for_slots(self, pending, limit, timeout):
+        """
+        等待在途消息数降到limit以下（需持有self._cond）
+
+        收到确认的消息移出在途集合并记录时延，超过timeout未确认的记为失败。
+        """
+        while True:
+            now = time.perf_counter()
+            for mid in list(pending):
+                result = pending[mid]
+                acked_at = self._acked.pop(mid, None)
+                if acked_at is not None:
+                    result["latency"] = acked_at - result["_sent_at"]
+                    self.puback_latency.observe(result["latency"])
+                    del pending[mid]
+                elif now - result["_sent_at"] >= timeout:
+                    result["error"] = "等待PUBACK超时"
+                    self.puback_latency.observe_timeout()
+                    del pending[mid]
+
+            if len(pending) < limit:
+                return
+            oldest = min(result["_sent_at"] for result in pending.values())
+            self._cond.wait(max(0.0, oldest + timeout - now))
@@ -0,0 +1,500 @@
+# 进程内的最小MQTT服务器和锁控制器data_report负载生成器，用于在没有生产服务器时压测MQTT链路和处理函数
+import asyncio
+import json
+import random
+import threading
+import time
+
+from src.database.models import Database, OutboxManager
+from src.mqtt.data_report import SN_CONTROLLER_IDS
+from src.mqtt.lock_controller import DATA_REPORT_TOPIC, MQTTLockController
+from src.mqtt.metrics import percentile
+from src.mqtt.topic_router import TopicRouter
+
+# MQTT 3.1.1 报文类型
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def _encode_length(length):
+    """剩余长度的变长编码"""
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(first_byte, body=b""):
+    return bytes((first_byte,)) + _encode_length(len(body)) + body
+
+
+def _string(value):
+    data = value.encode() if isinstance(value, str) else value
+    return len(data).to_bytes(2, "big") + data
+
+
+def encode_publish(topic, payload, qos=0, mid=0):
+    """编码PUBLISH报文"""
+    body = _string(topic)
+    if qos:
+        body += mid.to_bytes(2, "big")
+    return _packet((PUBLISH << 4) | (qos << 1), body + payload)
+
+
+def encode_connect(client_id, keepalive=60):
+    """编码CONNECT报文（clean session，无认证）"""
+    return _packet(CONNECT << 4, _string("MQTT") + bytes((4, 0x02)) + keepalive.to_bytes(2, "big") + _string(client_id))
+
+
+async def read_packet(reader):
+    """
+    读取一个报文
+
+    Returns:
+        tuple: (首字节, 报文体)
+
+    Raises:
+        asyncio.IncompleteReadError: 连接已关闭
+    """
+    first_byte = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return first_byte, await reader.readexactly(length)
+
+
+class _Session:
+    """服务器端的一个客户端连接"""
+
+    __slots__ = ("writer", "filters")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.filters = set()
+
+
+class LocalBroker:
+    """
+    进程内的最小MQTT服务器。
+
+    支持MQTT 3.1.1的连接、QoS 0/1发布、带+/#通配符的订阅、取消订阅和心跳；
+    不做认证，不保留会话和保留消息，转发给订阅者时统一降为QoS 0。
+    服务器在独立线程的事件循环中运行，paho客户端可以像连接生产服务器一样连接它。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """
+        初始化服务器
+
+        Args:
+            host (str): 监听地址
+            port (int): 监听端口，0表示由系统分配，启动后从port属性读取
+        """
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.delivered = 0
+        # 有客户端订阅成功时置位，压测据此确认订阅已生效再开始发布
+        self.subscribed = threading.Event()
+        self._router = TopicRouter()
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """在后台线程中启动服务器，返回时已开始监听"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mqtt-local-broker", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self, timeout=5.0):
+        """停止服务器并断开所有客户端"""
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        async def shutdown():
+            self._server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    async def _handle_client(self, reader, writer):
+        session = _Session(writer)
+        try:
+            while True:
+                first_byte, body = await read_packet(reader)
+                kind = first_byte >> 4
+                if kind == CONNECT:
+                    writer.write(_packet(CONNACK << 4, b"\x00\x00"))
+                elif kind == PUBLISH:
+                    await self._handle_publish(writer, first_byte, body)
+                elif kind == SUBSCRIBE:
+                    self._handle_subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    self._handle_unsubscribe(session, body)
+                elif kind == PINGREQ:
+                    writer.write(_packet(PINGRESP << 4))
+                elif kind == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for topic_filter in session.filters:
+                self._router.remove(topic_filter, session)
+            writer.close()
+
+    async def _handle_publish(self, writer, first_byte, body):
+        qos = (first_byte >> 1) & 0x03
+        topic_length = int.from_bytes(body[:2], "big")
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            writer.write(_packet(PUBACK << 4, body[offset:offset + 2]))
+            offset += 2
+        self.received += 1
+
+        packet = encode_publish(topic, body[offset:])
+        for session in self._router.match(topic):
+            session.writer.write(packet)
+            self.delivered += 1
+            # 订阅者读得慢时让发布者等待，而不是在内存中无限堆积
+            await session.writer.drain()
+
+    def _handle_subscribe(self, session, body):
+        mid, offset, granted = body[:2], 2, bytearray()
+        while offset < len(body):
+            length = int.from_bytes(body[offset:offset + 2], "big")
+            topic_filter = body[offset + 2:offset + 2 + length].decode()
+            offset += 3 + length
+            try:
+                self._router.add(topic_filter, session)
+                session.filters.add(topic_filter)
+                granted.append(0)
+                self.subscribed.set()
+            except ValueError:
+                granted.append(0x80)
+        session.writer.write(_packet(SUBACK << 4, mid + bytes(granted)))
+
+    def _handle_unsubscribe(self, session, body):
+        mid, offset = body[:2], 2
+        while offset < len(body):
+            length = int.from_bytes(body[offset:offset + 2], "big")
+            topic_filter = body[offset + 2:offset + 2 + length].decode()
+            offset += 2 + length
+            self._router.remove(topic_filter, session)
+            session.filters.discard(topic_filter)
+        session.writer.write(_packet(UNSUBACK << 4, mid))
+
+
+def make_serial_number(index, sub_lock_number):
+    """
+    生成第index个模拟锁控制器的SN
+
+    格式与真实上报一致：第2~4位为锁号，第5~16位为插销ID（最后一位为子锁号）。
+    前两个控制器使用"002"、"003"，对应 SN_CONTROLLER_IDS 中的真实控制器；
+    其余控制器直接以锁号作为控制器ID，由 seed_scooter_controller 加入控制器映射。
+    """
+    slot = (index + 2) % 1000
+    serial = index // 1000
+    return f"D{slot:03d}{serial:011d}{sub_lock_number}1"
+
+
+class DataReportGenerator:
+    """
+    模拟大量锁控制器上报data_report。
+
+    每条消息包含seq、state、batteryLevel、signalStrength、NO、openType和SN，
+    seq全局递增，发送时间记录在sent_at中，供接收端计算端到端时延。
+    """
+
+    def __init__(self, controllers=1000, sub_locks=5, open_ratio=0.3, seed=None):
+        """
+        初始化生成器
+
+        Args:
+            controllers (int): 模拟的锁控制器数
+            sub_locks (int): 每个控制器的子锁数
+            open_ratio (float): 开锁上报（state为"0"）所占比例
+            seed (int): 随机种子，便于复现
+        """
+        self.controllers = controllers
+        self.sub_locks = sub_locks
+        self.open_ratio = open_ratio
+        self.random = random.Random(seed)
+        self.seq = 0
+        # seq -> 发送时间
+        self.sent_at = {}
+
+    def next_report(self):
+        """生成下一条上报"""
+        self.seq += 1
+        index = self.random.randrange(self.controllers)
+        sub_lock_number = self.random.randint(1, self.sub_locks)
+        opened = self.random.random() < self.open_ratio
+        return {
+            "seq": self.seq,
+            "state": "0" if opened else "1",
+            "batteryLevel": self.random.randint(20, 100),
+            "signalStrength": self.random.randint(10, 31),
+            "NO": str(index * self.sub_locks + sub_lock_number),
+            # 开锁时为开锁方式，关锁时1表示正常还车
+            "openType": self.random.choice((0, 2)) if opened else self.random.choice((1, 1, 1, -1)),
+            "SN": make_serial_number(index, sub_lock_number),
+        }
+
+    async def run(self, host, port, rate=1000, duration=5.0, connections=4, topic=DATA_REPORT_TOPIC):
+        """
+        以固定速率发布上报，速率在多个连接之间平分
+
+        Args:
+            host (str): 服务器地址
+            port (int): 服务器端口
+            rate (float): 每秒发布的消息数
+            duration (float): 持续时间（秒）
+            connections (int): 发布使用的连接数
+            topic (str): 发布的主题
+
+        Returns:
+            int: 发布的消息数
+        """
+        writers = []
+        for number in range(connections):
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(encode_connect(f"report-generator-{number}"))
+            await read_packet(reader)
+            writers.append(writer)
+
+        sent = 0
+        tick = 0.01
+        start = time.perf_counter()
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+            # 按已过去的时间补齐应发的消息数，避免定时误差累积
+            due = min(int(rate * (elapsed + tick)), int(rate * duration)) - sent
+            for _ in range(due):
+                report = self.next_report()
+                self.sent_at[report["seq"]] = time.perf_counter()
+                writers[sent % connections].write(encode_publish(topic, json.dumps(report).encode()))
+                sent += 1
+            for writer in writers:
+                await writer.drain()
+            await asyncio.sleep(tick)
+
+        for writer in writers:
+            writer.write(_packet(DISCONNECT << 4))
+            await writer.drain()
+            writer.close()
+        return sent
+
+
+def controller_id_for(index):
+    """第index个模拟锁控制器在ScooterController中对应的控制器ID"""
+    slot = make_serial_number(index, 1)[1:4]
+    return SN_CONTROLLER_IDS.get(slot, slot)
+
+
+def seed_scooter_controller(scooter_controller, controllers, sub_locks=5, scooters=10):
+    """
+    为压测准备ScooterController的数据，使正常还车的上报走完整的数据库路径
+
+    - 把每个模拟锁控制器的子锁加入控制器映射（锁编号从现有最大编号之后开始）
+    - 注册若干车辆并记录刚刚发生的锁定操作，还车上报会据此更新车辆和锁的关联
+
+    Args:
+        scooter_controller: ScooterController实例
+        controllers (int): 模拟的锁控制器数
+        sub_locks (int): 每个控制器的子锁数
+        scooters (int): 注册的车辆数
+    """
+    mapping = scooter_controller.controller_mapping
+    known = {(info["controller_id"], info["sub_lock_number"]) for info in mapping.values()}
+    next_lock_number = max(mapping, default=0) + 1
+    for index in range(controllers):
+        controller_id = controller_id_for(index)
+        for sub_lock_number in range(1, sub_locks + 1):
+            if (controller_id, sub_lock_number) in known:
+                continue
+            known.add((controller_id, sub_lock_number))
+            mapping[next_lock_number] = {"controller_id": controller_id, "sub_lock_number": sub_lock_number}
+            next_lock_number += 1
+
+    for number in range(scooters):
+        scooter_id = f"BENCH{number:04d}"
+        scooter_controller.scooter_manager.add_scooter(scooter_id, f"压测车辆{number}", f"SIM:BENCH:{number:04d}")
+        scooter_controller.lock_manager.log_operation(scooter_id, None, None, "锁定", "成功")
+
+
+def _count_association_updates(db):
+    """数据库中由还车上报自动更新关联的次数"""
+    with db.lock:
+        db.cursor.execute("SELECT COUNT(*) FROM operation_logs WHERE operation_type = '更新关联'")
+        return db.cursor.fetchone()[0]
+
+
+def _build_scooter_controller(host, port, controllers):
+    """创建连接本地服务器、使用内存数据库并已准备好压测数据的ScooterController"""
+    from src.controller.scooter_controller import ScooterController
+
+    db = Database(":memory:")
+    mqtt_controller = MQTTLockController(mqtt_host=host, mqtt_port=port, outbox=OutboxManager(db))
+    scooter_controller = ScooterController(db=db, mqtt_controller=mqtt_controller)
+    seed_scooter_controller(scooter_controller, controllers)
+    return scooter_controller
+
+
+async def run_benchmark(controllers=1000, rate=1000, duration=5.0, handler="scooter", connections=4,
+                        drain_timeout=30.0, seed=None):
+    """
+    启动本地服务器，让MQTTLockController订阅data_report，按固定速率发布模拟上报
+
+    Args:
+        controllers (int): 模拟的锁控制器数
+        rate (float): 每秒发布的消息数
+        duration (float): 发布持续时间（秒）
+        handler (str): "scooter" 使用 ScooterController.handle_data_report（内存数据库，已按模拟控制器准备映射和车辆），
+            "noop" 只解析JSON
+        connections (int): 发布使用的连接数
+        drain_timeout (float): 发布结束后等待处理完的最长时间（秒）
+        seed (int): 随机种子
+
+    Returns:
+        dict: 发布/处理数、吞吐量、处理函数耗时和端到端时延的p50/p95/p99（秒）、分发队列统计，
+            以及走数据库路径的上报数
+    """
+    broker = LocalBroker().start()
+    generator = DataReportGenerator(controllers, seed=seed)
+    scooter_controller = None
+    if handler == "scooter":
+        scooter_controller = _build_scooter_controller(broker.host, broker.port, controllers)
+        mqtt_controller = scooter_controller.mqtt_controller
+        # 去掉构造时注册的处理函数，换成带计时的包装
+        mqtt_controller.topic_handlers.remove(DATA_REPORT_TOPIC)
+        handle = scooter_controller.handle_data_report
+    else:
+        mqtt_controller = MQTTLockController(mqtt_host=broker.host, mqtt_port=broker.port)
+        handle = lambda topic, payload: json.loads(payload)
+
+    handler_times = []
+    end_to_end = []
+    done = threading.Condition()
+
+    def timed_handler(topic, payload):
+        start = time.perf_counter()
+        handle(topic, payload)
+        finished = time.perf_counter()
+        sent_at = generator.sent_at.get(json.loads(payload).get("seq"))
+        with done:
+            handler_times.append(finished - start)
+            if sent_at is not None:
+                end_to_end.append(finished - sent_at)
+            done.notify_all()
+
+    try:
+        if not mqtt_controller.connection.wait_connected(5):
+            raise ConnectionError("无法连接本地MQTT服务器")
+        mqtt_controller.subscribe_data_report(timed_handler)
+        if not broker.subscribed.wait(5):
+            raise ConnectionError("订阅data_report超时")
+
+        start_time = time.perf_counter()
+        sent = await generator.run(broker.host, broker.port, rate, duration, connections)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: _wait_handled(done, handler_times, sent, drain_timeout))
+        elapsed = time.perf_counter() - start_time
+        dispatch = mqtt_controller.dispatcher.stats()
+        db_updates = _count_association_updates(scooter_controller.db) if scooter_controller is not None else 0
+    finally:
+        mqtt_controller.close()
+        if scooter_controller is not None:
+            scooter_controller.db.close()
+        broker.stop()
+
+    handled = len(handler_times)
+    handler_times.sort()
+    end_to_end.sort()
+    return {
+        "controllers": controllers,
+        "rate": rate,
+        "sent": sent,
+        "received": broker.received,
+        "handled": handled,
+        "elapsed": elapsed,
+        "throughput": handled / elapsed if elapsed > 0 else 0.0,
+        "handler_p50": percentile(handler_times, 50),
+        "handler_p95": percentile(handler_times, 95),
+        "handler_p99": percentile(handler_times, 99),
+        "e2e_p50": percentile(end_to_end, 50),
+        "e2e_p95": percentile(end_to_end, 95),
+        "e2e_p99": percentile(end_to_end, 99),
+        "max_queue_depth": dispatch["max_depth"],
+        "dropped": dispatch["dropped"],
+        # 走完整数据库路径（查询最近锁定记录并更新关联）的上报数，其余为开锁或非正常还车上报
+        "db_updates": db_updates,
+    }
+
+
+def _wait_handled(done, handled, expected, timeout):
+    """等待处理完expected条消息"""
+    with done:
+        done.wait_for(lambda: len(handled) >= expected, timeout)
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import os
+
+    parser = argparse.ArgumentParser(description="本地MQTT服务器data_report压测")
+    parser.add_argument("--controllers", type=int, default=1000, help="模拟锁控制器数")
+    parser.add_argument("--rate", type=float, default=1000, help="每秒发布的上报数")
+    parser.add_argument("--duration", type=float, default=5.0, help="发布持续时间（秒）")
+    parser.add_argument("--handler", choices=("scooter", "noop"), default="scooter", help="处理函数")
+    parser.add_argument("--connections", type=int, default=4, help="发布连接数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    # 压测时屏蔽逐条消息的打印输出，出错退出时也会恢复标准输出
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        stats = asyncio.run(run_benchmark(
+            args.controllers, args.rate, args.duration, args.handler, args.connections, seed=args.seed
+        ))
+
+    def ms(value):
+        return f"{value * 1000:.2f}ms" if value is not None else "-"
+
+    print(f"锁控制器数: {stats['controllers']}, 目标速率: {stats['rate']:.0f}条/秒")
+    print(f"发布: {stats['sent']}, 服务器收到: {stats['received']}, 处理: {stats['handled']}, "
+          f"耗时: {stats['elapsed']:.2f}秒, 吞吐量: {stats['throughput']:.1f}条/秒")
+    print(f"处理函数耗时 p50: {ms(stats['handler_p50'])}, p95: {ms(stats['handler_p95'])}, "
+          f"p99: {ms(stats['handler_p99'])}")
+    print(f"端到端时延 p50: {ms(stats['e2e_p50'])}, p95: {ms(stats['e2e_p95'])}, p99: {ms(stats['e2e_p99'])}")
+    print(f"分发队列最大深度: {stats['max_queue_depth']}, 丢弃: {stats['dropped']}")
+    if args.handler == "scooter":
+        print(f"走数据库路径的上报: {stats['db_updates']}/{stats['handled']}")
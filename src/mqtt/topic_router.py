@@ -0,0 +1,159 @@
+# MQTT主题路由：按主题层级组织的前缀树，支持+/#通配符，每个过滤器可以挂多个处理函数
+import threading
+
+
+def validate_filter(topic_filter):
+    """
+    检查主题过滤器是否合法
+
+    Raises:
+        ValueError: 过滤器为空，通配符没有独占一层，或#不在最后一层
+    """
+    if not topic_filter:
+        raise ValueError("主题过滤器不能为空")
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if ("+" in level or "#" in level) and len(level) > 1:
+            raise ValueError(f"通配符必须独占一层: {topic_filter}")
+        if level == "#" and index != len(levels) - 1:
+            raise ValueError(f"#只能出现在最后一层: {topic_filter}")
+
+
+class _Node:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class TopicRouter:
+    """
+    主题订阅路由。
+
+    过滤器按"/"分层存入前缀树，匹配一个主题只需沿层级向下查找精确层、+和#三个分支，
+    耗时与主题层数相关，与过滤器数量无关。按MQTT规范，以$开头的主题不被首层通配符匹配。
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, topic_filter, handler):
+        """
+        为过滤器添加处理函数，同一个处理函数重复添加只保留一个
+
+        Args:
+            topic_filter (str): 主题或带+/#的过滤器
+            handler: 处理函数，接收(topic, payload)两个参数
+
+        Returns:
+            bool: 是否新增（已存在返回False）
+        """
+        validate_filter(topic_filter)
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split("/"):
+                node = node.children.setdefault(level, _Node())
+            if handler in node.handlers:
+                return False
+            node.handlers.append(handler)
+            self._count += 1
+            return True
+
+    def remove(self, topic_filter, handler=None):
+        """
+        移除过滤器上的处理函数
+
+        Args:
+            topic_filter (str): 添加时使用的过滤器
+            handler: 要移除的处理函数，None表示移除该过滤器上的全部处理函数
+
+        Returns:
+            int: 移除的处理函数个数
+        """
+        with self._lock:
+            path = [self._root]
+            for level in topic_filter.split("/"):
+                node = path[-1].children.get(level)
+                if node is None:
+                    return 0
+                path.append(node)
+
+            node = path[-1]
+            if handler is None:
+                removed = len(node.handlers)
+                node.handlers = []
+            elif handler in node.handlers:
+                removed = 1
+                node.handlers = [h for h in node.handlers if h != handler]
+            else:
+                return 0
+            self._count -= removed
+
+            # 删除不再有处理函数和子节点的分支
+            levels = topic_filter.split("/")
+            for depth in range(len(levels), 0, -1):
+                node = path[depth]
+                if node.handlers or node.children:
+                    break
+                del path[depth - 1].children[levels[depth - 1]]
+            return removed
+
+    def match(self, topic):
+        """
+        查找匹配主题的所有处理函数
+
+        Args:
+            topic (str): 收到消息的主题（不含通配符）
+
+        Returns:
+            list: 处理函数列表，同一个处理函数只出现一次
+        """
+        levels = topic.split("/")
+        handlers = []
+        with self._lock:
+            self._match(self._root, levels, 0, handlers, topic.startswith("$"))
+        unique = []
+        for handler in handlers:
+            if handler not in unique:
+                unique.append(handler)
+        return unique
+
+    def _match(self, node, levels, depth, handlers, system_topic):
+        # 首层通配符不匹配$开头的系统主题
+        wildcards = not (system_topic and depth == 0)
+        if wildcards:
+            # "a/#" 同时匹配 "a" 本身和其下所有层级
+            multi = node.children.get("#")
+            if multi is not None:
+                handlers.extend(multi.handlers)
+        if depth == len(levels):
+            handlers.extend(node.handlers)
+            return
+        exact = node.children.get(levels[depth])
+        if exact is not None:
+            self._match(exact, levels, depth + 1, handlers, system_topic)
+        if wildcards:
+            single = node.children.get("+")
+            if single is not None:
+                self._match(single, levels, depth + 1, handlers, system_topic)
+
+    def filters(self):
+        """当前所有挂有处理函数的过滤器"""
+        result = []
+        with self._lock:
+            stack = [(self._root, [])]
+            while stack:
+                node, path = stack.pop()
+                if node.handlers:
+                    result.append("/".join(path))
+                for level, child in node.children.items():
+                    stack.append((child, path + [level]))
+        return sorted(result)
+
+    def __len__(self):
+        """处理函数总数"""
+        with self._lock:
+            return self._count
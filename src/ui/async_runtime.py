@@ -0,0 +1,92 @@
+# 界面后台异步运行时：一个常驻线程运行事件循环，所有蓝牙和MQTT协程都在其中执行
+import asyncio
+import concurrent.futures
+import threading
+
+
+class AsyncRuntime:
+    """
+    常驻的asyncio事件循环线程。
+
+    BleakClient、连接池和通知订阅都绑定在创建它们的事件循环上，
+    界面的所有异步操作都提交到同一个循环，连接可以在多次操作之间保持。
+    """
+
+    def __init__(self, name="asyncio-runtime"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def submit(self, coro):
+        """
+        把协程提交到事件循环线程执行（线程安全）
+
+        Args:
+            coro: 协程对象
+
+        Returns:
+            concurrent.futures.Future: 协程结果
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def submit_to_ui(self, root, coro, on_success=None, on_error=None):
+        """
+        提交协程，完成后在Tk主线程中回调，调用方不会被阻塞
+
+        Args:
+            root: Tk根窗口，用于通过after切回主线程
+            coro: 协程对象
+            on_success: 可选，接收协程返回值的回调
+            on_error: 可选，接收异常对象的回调；协程被取消时收到CancelledError
+
+        Returns:
+            concurrent.futures.Future: 协程结果
+        """
+        future = self.submit(coro)
+
+        def done(future):
+            try:
+                result = future.result()
+            except (Exception, asyncio.CancelledError, concurrent.futures.CancelledError) as e:
+                if on_error is not None:
+                    call_in_ui(on_error, e)
+                return
+            if on_success is not None:
+                call_in_ui(on_success, result)
+
+        def call_in_ui(callback, value):
+            # 关闭窗口时取消的任务在窗口销毁后才完成，此时已无法切回主线程
+            try:
+                root.after(0, callback, value)
+            except Exception as e:
+                print(f"界面已关闭，丢弃回调: {e}")
+
+        future.add_done_callback(done)
+        return future
+
+    def call_soon(self, callback, *args):
+        """在事件循环线程中调用普通函数（线程安全）"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self, timeout=5.0):
+        """取消未完成的任务并停止事件循环线程"""
+        if not self.loop.is_running():
+            return
+
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            self.submit(shutdown()).result(timeout)
+        except Exception as e:
+            print(f"停止事件循环时出错: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
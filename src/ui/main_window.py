@@ -1,8 +1,6 @@
 # 主界面 —— 电动车控制程序
 import sys
 import os
-import asyncio
-import threading
 import tkinter as tk
 from tkinter import messagebox, ttk, simpledialog
 from datetime import datetime
@@ -10,9 +8,11 @@ from datetime import datetime
 # 将项目根目录添加到Python搜索路径中
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from src.bluetooth.ble_communication import discover_devices, connect_to_device, send_command
+from src.bluetooth.ble_communication import scan_devices_stream, send_command
 from src.bluetooth.command_handler import format_command, parse_response
+from src.bluetooth.presence_cache import presence_cache
 from src.controller.scooter_controller import ScooterController
+from src.ui.async_runtime import AsyncRuntime
 
 class MainWindow:
     def __init__(self, root):
@@ -21,8 +21,14 @@ class MainWindow:
         self.root.title("智能滑板车管理系统")
         self.root.geometry("1200x700")
         
-        # 初始化控制器
-        self.scooter_controller = ScooterController()
+        # 初始化控制器，GATT特征缓存持久化到文件，重启后重连也可跳过完整的服务发现
+        self.scooter_controller = ScooterController(gatt_cache_path='gatt_cache.json')
+        
+        # 所有蓝牙和MQTT协程在同一个常驻事件循环线程中执行，界面线程只负责提交和显示结果
+        self.runtime = AsyncRuntime()
+        # MQTT客户端也交给这个事件循环驱动，不再单独占用网络线程
+        self.runtime.submit(self.scooter_controller.mqtt_controller.use_asyncio_transport())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # 设置变量
         self.device_var = tk.StringVar()
@@ -271,24 +277,52 @@ class MainWindow:
         # 刷新锁列表
         self.refresh_lock_list()
         
+    def on_close(self):
+        """关闭窗口时断开蓝牙和MQTT连接，再停止后台事件循环"""
+        try:
+            self.runtime.submit(self._shutdown()).result(timeout=5)
+        except Exception as e:
+            print(f"关闭连接时出错: {e}")
+        self.runtime.stop()
+        self.root.destroy()
+
+    async def _shutdown(self):
+        """断开连接池中的蓝牙连接并关闭MQTT客户端（在后台事件循环中运行）"""
+        await self.scooter_controller.connection_pool.close()
+        mqtt_controller = self.scooter_controller.mqtt_controller
+        # 先关闭状态机再断开，断开回调不会再安排重连
+        mqtt_controller.close()
+        if mqtt_controller.transport is not None:
+            await mqtt_controller.transport.close()
+
     def start_scan_thread(self):
-        """启动一个新线程扫描附近蓝牙设备，避免阻塞Tkinter主线程。"""
-        scan_thread = threading.Thread(target=self.scan_devices)
-        scan_thread.start()
-
-    def scan_devices(self):
-        """异步扫描附近的蓝牙设备，并更新设备列表（在新线程中运行）。"""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        self.device_list = loop.run_until_complete(discover_devices())
-        loop.close()
-        # 更新设备列表需在主线程中进行
-        self.root.after(0, self.update_device_menu)
+        """在后台事件循环中扫描附近蓝牙设备，避免阻塞Tkinter主线程。"""
+        self.runtime.submit_to_ui(
+            self.root, self.scan_devices(),
+            on_success=lambda _: self.update_device_menu(),
+            on_error=lambda e: self.log_message(f"扫描设备异常: {e}")
+        )
+
+    async def scan_devices(self):
+        """异步扫描附近的蓝牙设备，每发现一个设备即更新设备列表（在后台事件循环中运行）。"""
+        self.device_list = []
+        async for device, _ in scan_devices_stream(timeout=5.0):
+            self.device_list.append(device)
+            # 更新设备列表需在主线程中进行
+            self.root.after(0, self.update_device_menu)
+
+    def log_message(self, message):
+        """在反馈区追加一行信息"""
+        self.log_output.insert(tk.END, f"{message}\n")
+        self.log_output.see(tk.END)
 
     def update_device_menu(self):
-        """更新设备选择下拉菜单，若设备无名称则显示MAC地址。"""
-        device_names = [self.get_display_name(device) for device in self.device_list]
-        self.device_var.set(device_names[0] if device_names else "无设备")
+        """更新设备选择下拉菜单，若设备无名称则显示MAC地址；信号最强（最近）的设备排在前面。"""
+        devices = {device.address: device for device in list(self.device_list)}
+        device_names = [self.get_display_name(devices[address]) for address in presence_cache.rank(list(devices))]
+        # 扫描过程中会多次刷新，保留用户已选择的设备
+        if self.device_var.get() not in device_names:
+            self.device_var.set(device_names[0] if device_names else "无设备")
         self.device_menu['menu'].delete(0, 'end')
         for name in device_names:
             self.device_menu['menu'].add_command(label=name, command=tk._setit(self.device_var, name))
@@ -337,22 +371,12 @@ class MainWindow:
                 self.log_output.see(tk.END)
                 return
                 
-            # 启动解锁任务
-            def unlock_task():
-                try:
-                    ble_success, mqtt_success = asyncio.run(
-                        self.scooter_controller.unlock_scooter(scooter_id, ble_pwd)
-                    )
-                    
-                    # 在主线程中更新UI
-                    self.root.after(0, lambda: self._update_unlock_result(ble_success, mqtt_success, scooter_id))
-                except Exception as e:
-                    error_msg = str(e)
-                    self.root.after(0, lambda: self.log_output.insert(tk.END, f"解锁操作异常: {error_msg}\n"))
-                    self.root.after(0, lambda: self.log_output.see(tk.END))
-            
-            # 在新线程中执行解锁
-            threading.Thread(target=unlock_task).start()
+            # 在后台事件循环中执行解锁，完成后在主线程中更新UI
+            self.runtime.submit_to_ui(
+                self.root, self.scooter_controller.unlock_scooter(scooter_id, ble_pwd),
+                on_success=lambda result: self._update_unlock_result(result[0], result[1], scooter_id),
+                on_error=lambda e: self.log_message(f"解锁操作异常: {e}")
+            )
             return
             
         # 定义锁命令映射：键为操作名称，值为对应的 <Lock Command> 参数
@@ -397,26 +421,40 @@ class MainWindow:
         # 记录操作、发送命令及使用的UUID到反馈区
         self.log_output.insert(tk.END, f"操作: {operation}\n发送命令: {command}\n发送至 UUID: {char_uuid}\n")
         self.log_output.see(tk.END)
-        # 使用已建立的连接发送命令，如果当前没有有效的连接则尝试重新连接
-        try:
-            if self.connected_client is None or not self.connected_client.is_connected:
-                self.log_output.insert(tk.END, "当前未连接设备，正在尝试重新连接...\n")
-                self.log_output.see(tk.END)
-                self.connected_client = asyncio.run(connect_to_device(selected_device.address))
+        # 在后台事件循环中发送命令，界面线程不等待
+        self.runtime.submit_to_ui(
+            self.root, self._send_device_command(selected_device.address, command, char_uuid),
+            on_success=self._show_command_response,
+            on_error=lambda e: self.log_message(f"命令执行异常: {e}")
+        )
 
-            if self.connected_client and self.connected_client.is_connected:
-                response = asyncio.run(send_command(self.connected_client, command, char_uuid))
-                parsed_response = parse_response(response) if response else "无响应"
-                self.log_output.insert(tk.END, f"响应: {parsed_response}\n")
-                self.log_output.see(tk.END)
-                self.status_info.config(text=f"设备信息: {parsed_response}")
-            else:
-                self.log_output.insert(tk.END, "无法连接设备\n")
-                self.log_output.see(tk.END)
-        except Exception as e:
-            error_msg = str(e)
-            self.log_output.insert(tk.END, f"命令执行异常: {error_msg}\n")
-            self.log_output.see(tk.END)
+    async def _send_device_command(self, address, command, char_uuid):
+        """
+        使用已建立的连接发送命令，如果当前没有有效的连接则通过连接池重新连接（在后台事件循环中运行）
+
+        Returns:
+            tuple: (是否已连接, 响应字符串)
+        """
+        if self.connected_client is None or not self.connected_client.is_connected \
+                or self.connected_client.address != address:
+            self.root.after(0, self.log_message, "当前未连接设备，正在尝试重新连接...")
+            self.connected_client = await self.scooter_controller.connect_scooter(address)
+
+        if self.connected_client and self.connected_client.is_connected:
+            # 命令执行期间连接不会被连接池淘汰或被保活任务断开
+            with self.scooter_controller.connection_pool.in_use(address):
+                return True, await send_command(self.connected_client, command, char_uuid)
+        return False, None
+
+    def _show_command_response(self, result):
+        """显示命令响应（在主线程中运行）"""
+        connected, response = result
+        if not connected:
+            self.log_message("无法连接设备")
+            return
+        parsed_response = parse_response(response) if response else "无响应"
+        self.log_message(f"响应: {parsed_response}")
+        self.status_info.config(text=f"设备信息: {parsed_response}")
             
     def _update_unlock_result(self, ble_success, mqtt_success, scooter_id):
         """更新解锁结果到界面"""
@@ -442,22 +480,22 @@ class MainWindow:
             messagebox.showerror("错误", "请选择一个设备")
             return
 
-        def connect_thread():
-            try:
-                # 使用 asyncio.run 在新线程中进行连接操作
-                client = asyncio.run(connect_to_device(selected_device.address))
-                if client and client.is_connected:
-                    self.connected_client = client  # 保存连接对象
-                    self.root.after(0, lambda: self.connection_status.config(text="连接状态: 连接成功", fg="green"))
-                else:
-                    self.connected_client = None
-                    self.root.after(0, lambda: self.connection_status.config(text="连接状态: 连接失败", fg="red"))
-            except Exception as e:
-                self.connected_client = None
-                error_msg = str(e)
-                self.root.after(0, lambda: self.connection_status.config(text=f"连接状态: 异常 {error_msg}", fg="red"))
-
-        threading.Thread(target=connect_thread).start()
+        def on_connected(client):
+            self.connected_client = client  # 保存连接对象
+            if client and client.is_connected:
+                self.connection_status.config(text="连接状态: 连接成功", fg="green")
+            else:
+                self.connection_status.config(text="连接状态: 连接失败", fg="red")
+
+        def on_error(e):
+            self.connected_client = None
+            self.connection_status.config(text=f"连接状态: 异常 {e}", fg="red")
+
+        # 通过连接池在后台事件循环中连接，连接在之后的命令之间保持
+        self.runtime.submit_to_ui(
+            self.root, self.scooter_controller.connect_scooter(selected_device.address),
+            on_success=on_connected, on_error=on_error
+        )
 
     # 新增方法：车辆管理相关
     def refresh_scooter_list(self):
@@ -631,22 +669,12 @@ class MainWindow:
         progress_label = tk.Label(progress_window, text=f"正在解锁 {controller_id} 的子锁 {sub_lock_number}...\n请稍候")
         progress_label.pack(pady=20)
         
-        # 执行解锁
-        def run_unlock():
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                result = loop.run_until_complete(self.scooter_controller.mqtt_controller.async_unlock(controller_id, sub_lock_number))
-                loop.close()
-                
-                # 更新UI需在主线程中进行
-                self.root.after(0, lambda: self.show_unlock_result(result, controller_id, sub_lock_number, progress_window))
-            except Exception as e:
-                # 发生异常时，在主线程中显示错误
-                error_msg = str(e)
-                self.root.after(0, lambda: self.show_unlock_error(error_msg, controller_id, sub_lock_number, progress_window))
-        
-        threading.Thread(target=run_unlock).start()
+        # 在后台事件循环中执行解锁，结果在主线程中显示
+        self.runtime.submit_to_ui(
+            self.root, self.scooter_controller.mqtt_controller.async_unlock(controller_id, sub_lock_number),
+            on_success=lambda result: self.show_unlock_result(result, controller_id, sub_lock_number, progress_window),
+            on_error=lambda e: self.show_unlock_error(str(e), controller_id, sub_lock_number, progress_window)
+        )
     
     def show_unlock_result(self, result, controller_id, sub_lock_number, progress_window=None):
         """显示解锁结果"""
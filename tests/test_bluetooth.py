@@ -1,6 +1,17 @@
 # 蓝牙模块测试 
+import asyncio
 import unittest
-from src.bluetooth.command_handler import format_command, parse_response
+from unittest import mock
+from src.bluetooth.command_handler import format_command, parse_response, decode_responses, DeviceInfo, LockResult
+from src.bluetooth.ble_communication import (APP_CHARACTERISTIC_UUID, connect_to_device, resolve_device,
+                                             scan_devices_stream, send_command)
+from src.bluetooth.connection_pool import BLEConnectionPool
+from src.bluetooth.gatt_cache import gatt_cache
+from src.bluetooth.notify_dispatcher import get_dispatcher
+from src.bluetooth.presence_cache import PresenceCache, presence_cache
+from src.bluetooth.retry_policy import CircuitBreaker, RetryPolicy, circuit_breakers
+from src.bluetooth.simulator import (SIMULATED_CHARACTERISTIC_HANDLE, SimulatedDevice, SimulatedFleet,
+                                     SimulatedScooter, install_simulator)
 
 class TestBluetooth(unittest.TestCase):
     def test_format_command(self):
@@ -10,6 +21,366 @@ class TestBluetooth(unittest.TestCase):
     def test_parse_response(self):
         response = parse_response("+ACK:BKSCT,0")
         self.assertEqual(response, "BKSCT,0")
+        # 数字按设备返回的原样显示，头灯状态非0即为开启
+        self.assertEqual(parse_response("+ACK:BKINF,0,0,12,1139.30,30,70,2$"),
+                         "锁状态: 解锁, 速度: 0 km/h, 当前里程: 12 km, 总里程: 1139.30 km, "
+                         "骑行时长: 30 s, 电量: 70%, 头灯状态: 开启")
+        self.assertEqual(parse_response("+ACK:BKVER,V1.2$"), "BKVER,V1.2")
+        self.assertEqual(parse_response("+ACK:BKINF,1,2$"), "响应格式错误")
+        self.assertEqual(parse_response("ERROR"), "未知响应")
+
+    def test_decode_responses(self):
+        info, lock, bad, other = decode_responses([
+            "+ACK:BKINF,1,0.0,1.5,1139.3,30,70,1$", "+ACK:BKSCT,0,1$", "+ACK:BKINF,1,2$", "ERROR"])
+        self.assertIsInstance(info, DeviceInfo)
+        self.assertEqual((info.lock_status, info.total_mileage, info.battery), (1, 1139.3, 70))
+        self.assertTrue(info.headlamp_on)
+        self.assertEqual(lock, LockResult(0, 1))
+        self.assertIsNone(bad)
+        self.assertIsNone(other)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        breaker.reset_timeout = 60
+        self.assertFalse(breaker.allow_request())
+        # 超时后只放行一次探测
+        breaker.reset_timeout = 0
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_proximity_ranking(self):
+        cache = PresenceCache(rssi_alpha=0.5)
+        near, far = SimulatedDevice("SIM:NEAR", "zk301"), SimulatedDevice("SIM:FAR", "zk301")
+        cache.update(near, rssi=-80)
+        cache.update(near, rssi=-60)
+        cache.update(far, rssi=-75)
+        self.assertEqual(cache.get_rssi("sim:near"), -70)
+        self.assertEqual(cache.nearest(1), [("SIM:NEAR", -70)])
+        self.assertEqual(cache.rank(["SIM:GONE", "SIM:FAR", "SIM:NEAR"]), ["SIM:NEAR", "SIM:FAR", "SIM:GONE"])
+
+    def test_presence_expires_after_ttl(self):
+        cache = PresenceCache(ttl=10.0, rssi_alpha=0.5)
+        stale, fresh = SimulatedDevice("SIM:STALE", "zk301"), SimulatedDevice("SIM:FRESH", "zk301")
+        with mock.patch("src.bluetooth.presence_cache.time.monotonic") as monotonic:
+            monotonic.return_value = 100.0
+            cache.update(stale, rssi=-50)
+            cache.update(fresh, rssi=-80)
+            monotonic.return_value = 105.0
+            cache.update(fresh, rssi=-60)
+            self.assertIs(cache.get_device("sim:stale"), stale)
+
+            monotonic.return_value = 112.0
+            self.assertIsNone(cache.get("SIM:STALE"))
+            self.assertFalse(cache.is_present("SIM:STALE"))
+            self.assertEqual(cache.nearest(), [("SIM:FRESH", -70)])
+            cache.update(stale, rssi=-90)
+            # 过期后重新出现的设备不沿用旧的平滑值
+            self.assertEqual(cache.get_rssi("SIM:STALE"), -90)
+
+            monotonic.return_value = 130.0
+            cache.prune()
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.rank(["SIM:FRESH", "SIM:STALE"]), ["SIM:FRESH", "SIM:STALE"])
+
+class TestSimulatedScooter(unittest.TestCase):
+    def setUp(self):
+        # 连接和扫描会写入全局在场缓存，测试结束后清空，避免影响其他测试
+        self.addCleanup(presence_cache.clear)
+        self.fleet = SimulatedFleet()
+        self.scooter = self.fleet.add(SimulatedScooter("SIM:TEST:01", latency=(0.001, 0.005),
+                                                       connect_latency=(0, 0)))
+
+    def test_send_command_round_trip(self):
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                unlock = await send_command(client, "AT+BKSCT=zk301,0")
+                info = await send_command(client, "AT+BKINF=zk301,0")
+                await client.disconnect()
+                return unlock, info
+
+        unlock, info = asyncio.run(run())
+        self.assertEqual(unlock, "+ACK:BKSCT,0,1$")
+        self.assertTrue(info.startswith("+ACK:BKINF,0,"))
+        self.assertFalse(self.scooter.locked)
+
+    def test_concurrent_queries_are_coalesced(self):
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                responses = await asyncio.gather(
+                    send_command(client, "AT+BKINF=zk301,0"),
+                    send_command(client, "AT+BKINF=zk301,0"),
+                    send_command(client, "AT+BKSCT=zk301,1"),
+                    send_command(client, "AT+BKINF=zk301,0"),
+                )
+                await client.disconnect()
+                return responses
+
+        info1, info2, lock, info3 = asyncio.run(run())
+        self.assertEqual(info1, info2)
+        self.assertEqual(info1, info3)
+        self.assertEqual(lock, "+ACK:BKSCT,1,1$")
+        self.assertEqual(self.scooter.commands_received, 2)
+
+    def test_unmatched_named_ack_is_dropped(self):
+        self.scooter.latency = (0.1, 0.1)
+
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                dispatcher = get_dispatcher(client, APP_CHARACTERISTIC_UUID)
+                future = await dispatcher.send("AT+BKSCT=zk301,0$\r\n")
+                # 已超时请求的迟到响应不能交给其他命令
+                dispatcher._handle_notification(None, b"+ACK:BKINF,1,0.0,1.5,1139.3,30,70,1$")
+                self.assertFalse(future.done())
+                unlock = await dispatcher.wait(future, timeout=2)
+                # 没有命令名的通知仍交给最早发出的请求
+                future = await dispatcher.send("AT+BKINF=zk301,0$\r\n")
+                dispatcher._handle_notification(None, b"ERROR")
+                error = await dispatcher.wait(future, timeout=2)
+                await asyncio.sleep(0.2)
+                await client.disconnect()
+                return unlock, error
+
+        self.assertEqual(asyncio.run(run()), ("+ACK:BKSCT,0,1$", "ERROR"))
+
+    def test_reset_stops_notify_before_resubscribing(self):
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                dispatcher = get_dispatcher(client, APP_CHARACTERISTIC_UUID)
+                await dispatcher.request("AT+BKINF=zk301,0$\r\n", 2)
+                with mock.patch.object(client, "stop_notify", wraps=client.stop_notify) as stop_notify, \
+                        mock.patch.object(client, "start_notify", wraps=client.start_notify) as start_notify:
+                    await dispatcher.reset()
+                    response = await dispatcher.request("AT+BKINF=zk301,0$\r\n", 2)
+                await client.disconnect()
+                return stop_notify.await_count, start_notify.await_count, response
+
+        stopped, started, response = asyncio.run(run())
+        self.assertEqual((stopped, started), (1, 1))
+        self.assertTrue(response.startswith("+ACK:BKINF,"))
+
+    def test_stale_handle_invalidates_only_that_device(self):
+        self.addCleanup(gatt_cache.clear)
+        gatt_cache.put(self.scooter.address, APP_CHARACTERISTIC_UUID, 0x99)
+        gatt_cache.invalidate(self.scooter.address)
+        # 型号级默认值保留
+        self.assertEqual(gatt_cache.get_handle("SIM:OTHER:01", APP_CHARACTERISTIC_UUID), 0x99)
+
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                response = await send_command(client, "AT+BKINF=zk301,0",
+                                              retry_policy=RetryPolicy(timeout=1.0, base_delay=0))
+                await client.disconnect()
+                return response
+
+        # 句柄在设备上不存在，第一次失败后从已发现的服务重新解析
+        self.assertTrue(asyncio.run(run()).startswith("+ACK:BKINF,"))
+        self.assertEqual(gatt_cache.get_handle(self.scooter.address, APP_CHARACTERISTIC_UUID),
+                         SIMULATED_CHARACTERISTIC_HANDLE)
+
+    def test_write_error_keeps_cached_handle(self):
+        self.addCleanup(gatt_cache.clear)
+
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                dispatcher = get_dispatcher(client, APP_CHARACTERISTIC_UUID)
+                await dispatcher.request("AT+BKINF=zk301,0$\r\n", 2)
+                with mock.patch.object(client, "write_gatt_char", side_effect=ConnectionError("写入超时")):
+                    with self.assertRaises(ConnectionError):
+                        await dispatcher.send("AT+BKINF=zk301,0$\r\n")
+                char = dispatcher._char
+                await client.disconnect()
+                return char
+
+        self.assertEqual(asyncio.run(run()), SIMULATED_CHARACTERISTIC_HANDLE)
+        self.assertEqual(gatt_cache.get_handle(self.scooter.address, APP_CHARACTERISTIC_UUID),
+                         SIMULATED_CHARACTERISTIC_HANDLE)
+
+    def _half_open(self, address):
+        breaker = circuit_breakers.get(address)
+        self.addCleanup(circuit_breakers.reset, address)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        breaker.reset_timeout = 0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        return breaker
+
+    def test_half_open_probe_released_when_resolve_raises(self):
+        breaker = self._half_open("SIM:PROBE:01")
+        with mock.patch("src.bluetooth.ble_communication.resolve_device", side_effect=RuntimeError("扫描失败")):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(connect_to_device("SIM:PROBE:01"))
+        # 探测失败后重新打开，超时（此处为0）后可以再次探测
+        self.assertTrue(breaker.allow_request())
+
+    def test_half_open_probe_released_when_send_cancelled(self):
+        self.scooter.latency = (1.0, 1.0)
+
+        async def run():
+            with install_simulator(self.fleet):
+                client = await connect_to_device(self.scooter.address)
+                breaker = self._half_open(self.scooter.address)
+                task = asyncio.ensure_future(send_command(client, "AT+BKINF=zk301,0"))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                await client.disconnect()
+                return breaker
+
+        breaker = asyncio.run(run())
+        self.assertTrue(breaker.allow_request())
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(presence_cache.clear)
+        self.fleet = SimulatedFleet()
+        self.addresses = [self.fleet.add(SimulatedScooter(f"SIM:POOL:{i:02d}", connect_latency=(0, 0))).address
+                          for i in range(3)]
+
+    def run_pool(self, scenario, **options):
+        async def run():
+            with install_simulator(self.fleet):
+                pool = BLEConnectionPool(keepalive_interval=60, **options)
+                try:
+                    return await scenario(pool)
+                finally:
+                    await pool.close()
+
+        return asyncio.run(run())
+
+    def test_evicts_least_recently_used(self):
+        a, b, c = self.addresses
+
+        async def scenario(pool):
+            first = await pool.acquire(a)
+            evicted = await pool.acquire(b)
+            # 再次使用a后，b成为最久未使用的连接
+            self.assertIs(await pool.acquire(a), first)
+            await pool.acquire(c)
+            return pool.addresses, evicted.is_connected
+
+        addresses, evicted_connected = self.run_pool(scenario, max_connections=2)
+        self.assertEqual(addresses, [a, c])
+        self.assertFalse(evicted_connected)
+
+    def test_connection_in_use_is_not_evicted(self):
+        a, b, c = self.addresses
+
+        async def scenario(pool):
+            busy = await pool.acquire(a)
+            with pool.in_use(a):
+                await pool.acquire(b)
+                # a最久未使用，但命令还没有完成，淘汰空闲的b
+                await pool.acquire(c)
+                connected = busy.is_connected
+            return pool.addresses, connected
+
+        addresses, busy_connected = self.run_pool(scenario, max_connections=2)
+        self.assertTrue(busy_connected)
+        self.assertEqual(addresses, [c, a])
+
+    def test_keepalive_skips_connection_in_use(self):
+        a = self.addresses[0]
+
+        async def scenario(pool):
+            client = await pool.acquire(a)
+            with pool.in_use(a):
+                # 长时间传输期间超过空闲时间，保活任务不能断开连接
+                pool._last_used[a] -= pool.idle_timeout + 1
+                await pool._keepalive_once()
+                return client.is_connected
+
+        self.assertTrue(self.run_pool(scenario))
+
+    def test_disconnect_callback_removes_client(self):
+        a = self.addresses[0]
+
+        async def scenario(pool):
+            client = await pool.acquire(a)
+            client._drop_link()
+            removed = a not in pool._clients
+            reconnected = await pool.acquire(a)
+            return removed, reconnected is not client and reconnected.is_connected
+
+        self.assertEqual(self.run_pool(scenario), (True, True))
+
+    def test_keepalive_releases_idle_and_reconnects_hot_devices(self):
+        idle, hot, failing = self.addresses
+
+        async def keepalive(client):
+            if client.address == failing:
+                raise ConnectionError("保活无响应")
+
+        async def scenario(pool):
+            for address in self.addresses:
+                await pool.acquire(address)
+            pool._last_used[idle] -= pool.idle_timeout + 1
+            pool.get(hot)._drop_link()
+            await pool._keepalive_once()
+            return pool.addresses
+
+        addresses = self.run_pool(scenario, keepalive_func=keepalive)
+        # 空闲连接和保活失败的连接被释放，掉线的热点设备在后台重连
+        self.assertEqual(addresses, [hot])
+
+class TestScanning(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(presence_cache.clear)
+        self.fleet = SimulatedFleet()
+        self.scooters = [self.fleet.add(SimulatedScooter(f"SIM:SCAN:{i:02d}")) for i in range(3)]
+        self.fleet.add(SimulatedScooter("SIM:SCAN:OTHER", name="other"))
+
+    def scan(self, **options):
+        async def run():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            with install_simulator(self.fleet):
+                found = [device.address async for device, _ in scan_devices_stream(**options)]
+            return found, loop.time() - started
+
+        return asyncio.run(run())
+
+    def test_stream_stops_once_all_addresses_found(self):
+        wanted = [self.scooters[0].address.lower(), self.scooters[1].address]
+        found, elapsed = self.scan(timeout=10.0, addresses=wanted)
+        self.assertLessEqual({scooter.address for scooter in self.scooters[:2]}, set(found))
+        # 全部找到即结束，不等到超时
+        self.assertLess(elapsed, 2.0)
+
+    def test_name_filter_skips_other_devices(self):
+        found, _ = self.scan(timeout=0.6, name_filter="zk301")
+        self.assertEqual(sorted(found), sorted(scooter.address for scooter in self.scooters))
+        # 被过滤的设备仍然写入在场缓存
+        self.assertTrue(presence_cache.is_present("SIM:SCAN:OTHER"))
+
+    def test_resolve_device_uses_presence_cache(self):
+        cached = SimulatedDevice("SIM:SCAN:CACHED", "zk301")
+        presence_cache.update(cached, rssi=-60)
+        missing = self.scooters[2].address
+
+        async def run():
+            with install_simulator(self.fleet):
+                # 不在模拟车队中的地址一旦扫描就会等到超时返回None
+                hit = await resolve_device("sim:scan:cached", timeout=5.0)
+                with mock.patch.object(presence_cache, "get_device", return_value=None):
+                    scanned = await resolve_device(missing, timeout=1.0)
+                return hit, scanned
+
+        hit, scanned = asyncio.run(run())
+        self.assertIs(hit, cached)
+        self.assertEqual(scanned.address, missing)
+        self.assertIs(presence_cache.get_device(missing), scanned)
 
 if __name__ == '__main__':
-    unittest.main() 
\ No newline at end of file
+    unittest.main() 
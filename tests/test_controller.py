@@ -0,0 +1,208 @@
+# 控制器模块测试
+import asyncio
+import heapq
+import unittest
+from src.bluetooth.connection_pool import BLEConnectionPool
+from src.bluetooth.presence_cache import presence_cache
+from src.bluetooth.simulator import SimulatedDevice, SimulatedFleet, SimulatedScooter, install_simulator
+from src.controller.scooter_controller import ScooterController
+from src.controller.telemetry_poller import TelemetryPoller
+from src.database.models import Database, TelemetryManager
+from src.mqtt.lock_controller import MQTTLockController
+
+class _OfflineLockController(MQTTLockController):
+    """不连接服务器的锁控制器"""
+    def _connect(self):
+        self.connection.mark_connected()
+
+    def _subscribe_topic(self, topic):
+        return True
+
+class _Registry:
+    """代替ScooterManager，记录读取注册表的次数"""
+    def __init__(self, scooters):
+        self.scooters = list(scooters)
+        self.reads = 0
+
+    def get_all_scooters(self):
+        self.reads += 1
+        return list(self.scooters)
+
+class TestTelemetryPoller(unittest.TestCase):
+    def setUp(self):
+        # 连接和扫描会写入全局在场缓存，测试结束后清空，避免影响其他测试
+        self.addCleanup(presence_cache.clear)
+        self.fleet = SimulatedFleet()
+        self.scooter = self.fleet.add(SimulatedScooter("SIM:POLL:01", latency=(0.001, 0.002),
+                                                       connect_latency=(0, 0)))
+        self.registry = _Registry([{"scooter_id": "S1", "bluetooth_address": self.scooter.address}])
+        self.db = Database(":memory:")
+        self.telemetry = TelemetryManager(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def make_poller(self, pool, **options):
+        options.setdefault("jitter", 0)
+        options.setdefault("skip_absent", False)
+        return TelemetryPoller(self.registry, self.telemetry, pool, **options)
+
+    async def wait_polled(self, poller, count, timeout=2.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while poller.stats["polled"] < count and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    def test_unchanged_data_backs_off_until_it_changes(self):
+        async def run():
+            with install_simulator(self.fleet):
+                pool = BLEConnectionPool(keepalive_interval=60)
+                poller = self.make_poller(pool, interval=1.0, max_interval=3.0, ble_semaphore=asyncio.Semaphore(1))
+                poller._refresh_devices()
+                device = poller._devices["S1"]
+                intervals = []
+                for _ in range(4):
+                    await poller._poll(device)
+                    intervals.append(device.interval)
+                self.scooter.battery = 5 if self.scooter.battery != 5 else 6
+                await poller._poll(device)
+                intervals.append(device.interval)
+                await pool.close()
+                return poller, intervals
+
+        poller, intervals = asyncio.run(run())
+        self.assertEqual(intervals, [1.0, 2.0, 3.0, 3.0, 1.0])
+        self.assertEqual((poller.stats["stored"], poller.stats["unchanged"]), (2, 3))
+        self.assertEqual(self.telemetry.get_latest_telemetry("S1")["battery"], self.scooter.battery)
+
+    def test_removed_and_readded_scooter_is_polled_once(self):
+        async def run():
+            with install_simulator(self.fleet):
+                pool = BLEConnectionPool(keepalive_interval=60)
+                poller = self.make_poller(pool, interval=10.0, refresh_interval=10.0)
+                poller._refresh_devices()
+                scooters, self.registry.scooters = self.registry.scooters, []
+                poller._refresh_devices()
+                self.registry.scooters = scooters
+                poller._refresh_devices()
+                # 旧调度的条目仍留在堆中；让两个条目都立即到期
+                poller._queue = [(0.0, scooter_id, generation) for _, scooter_id, generation in poller._queue]
+                heapq.heapify(poller._queue)
+                stale = len(poller._queue)
+
+                poller.start()
+                await self.wait_polled(poller, 1)
+                await asyncio.sleep(0.05)
+                await poller.stop()
+                await pool.close()
+                return poller, stale
+
+        poller, stale = asyncio.run(run())
+        self.assertEqual(stale, 2)
+        self.assertEqual(poller.stats["polled"], 1)
+        self.assertEqual(self.scooter.commands_received, 1)
+        # 只有当前调度被重新放入堆中
+        self.assertEqual([entry[2] for entry in poller._queue], [poller._devices["S1"].generation])
+
+    def test_registry_refreshed_on_its_own_interval(self):
+        async def run():
+            with install_simulator(self.fleet):
+                pool = BLEConnectionPool(keepalive_interval=60)
+                poller = self.make_poller(pool, interval=0.01, refresh_interval=10.0)
+                poller.start()
+                await self.wait_polled(poller, 5)
+                await poller.stop()
+                await pool.close()
+                return poller
+
+        poller = asyncio.run(run())
+        self.assertGreaterEqual(poller.stats["polled"], 5)
+        self.assertEqual(self.registry.reads, 1)
+
+class TestBatchOperations(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(presence_cache.clear)
+        self.fleet = SimulatedFleet()
+        self.ids = []
+        self.db = Database(":memory:")
+        self.mqtt = _OfflineLockController()
+        self.controller = ScooterController(db=self.db, mqtt_controller=self.mqtt)
+        self.controller.connection_pool = BLEConnectionPool(max_connections=3, keepalive_interval=60)
+        for index in range(6):
+            scooter = self.fleet.add(SimulatedScooter(f"SIM:BATCH:{index:02d}", latency=(0.02, 0.03),
+                                                      connect_latency=(0, 0)))
+            scooter.locked = index % 2 == 0
+            # 预先写入在场缓存，连接时不需要定向扫描
+            presence_cache.update(SimulatedDevice(scooter.address, scooter.name), rssi=-50 - index)
+            self.controller.scooter_manager.add_scooter(f"B{index}", f"batch-{index}", scooter.address,
+                                                        "866846061120977", index % 5 + 1)
+            self.ids.append(f"B{index}")
+
+    def tearDown(self):
+        self.mqtt.close()
+        self.db.close()
+
+    def count_concurrency(self, name):
+        """包装控制器的单车操作，记录同时进行的最大数量"""
+        operation = getattr(self.controller, name)
+        counter = {"active": 0, "peak": 0}
+
+        async def counted(*args):
+            counter["active"] += 1
+            counter["peak"] = max(counter["peak"], counter["active"])
+            try:
+                return await operation(*args)
+            finally:
+                counter["active"] -= 1
+
+        setattr(self.controller, name, counted)
+        return counter
+
+    def run_batch(self, batch):
+        async def run():
+            with install_simulator(self.fleet):
+                try:
+                    return await batch
+                finally:
+                    await self.controller.connection_pool.close()
+
+        return asyncio.run(run())
+
+    def test_query_many_limited_by_pool_size(self):
+        counter = self.count_concurrency("query_scooter")
+        result = self.run_batch(self.controller.query_many(self.ids, "zk301", concurrency=10))
+        self.assertEqual(sorted(result["succeeded"]), self.ids)
+        # 并发数不超过连接池的最大连接数
+        self.assertEqual(counter["peak"], 3)
+
+    def test_lock_many_isolates_failures(self):
+        counter = self.count_concurrency("lock_scooter")
+        result = self.run_batch(self.controller.lock_many(self.ids + ["MISSING"], "zk301", concurrency=2))
+        self.assertEqual(counter["peak"], 2)
+        self.assertEqual(sorted(result["succeeded"]), self.ids)
+        self.assertEqual(list(result["failed"]), ["MISSING"])
+        self.assertTrue(all(scooter.locked for scooter in self.fleet.scooters.values()))
+
+    def test_unlock_many_dedupes_and_starts_nearest_first(self):
+        async def confirmed(controller_id, sub_lock_number):
+            return {"confirmed": True}
+
+        self.mqtt.unlock_and_confirm = confirmed
+        counter = self.count_concurrency("unlock_scooter")
+        started = []
+        unlock = self.controller.unlock_scooter
+
+        async def recorded(scooter_id, password):
+            started.append(scooter_id)
+            return await unlock(scooter_id, password)
+
+        self.controller.unlock_scooter = recorded
+        result = self.run_batch(self.controller.unlock_many(list(reversed(self.ids)) * 2, "zk301", concurrency=1))
+        self.assertEqual(counter["peak"], 1)
+        self.assertEqual(len(result["results"]), 6)
+        # 信号最强的车辆最先执行
+        self.assertEqual(started, self.ids)
+        self.assertFalse(any(scooter.locked for scooter in self.fleet.scooters.values()))
+
+if __name__ == '__main__':
+    unittest.main()
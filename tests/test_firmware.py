@@ -1 +1,153 @@
-# 固件更新测试 
\ No newline at end of file
+# 固件更新模块测试
+import asyncio
+import os
+import tempfile
+import unittest
+from src.bluetooth.ble_communication import connect_to_device
+from src.bluetooth.connection_pool import BLEConnectionPool
+from src.bluetooth.presence_cache import presence_cache
+from src.bluetooth.retry_policy import circuit_breakers
+from src.bluetooth.simulator import SimulatedFleet, SimulatedScooter, install_simulator
+from src.database.models import Database, FirmwareRolloutManager, ScooterManager
+from src.firmware.rollout import FirmwareRollout
+from src.firmware.updater import update_firmware
+
+class TestFirmwareUpdate(unittest.TestCase):
+    def setUp(self):
+        # 连接和扫描会写入全局在场缓存，测试结束后清空，避免影响其他测试
+        self.addCleanup(presence_cache.clear)
+        self.image = os.urandom(50000)
+        fd, self.path = tempfile.mkstemp(suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.image)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_update(self, scooter):
+        fleet = SimulatedFleet()
+        fleet.add(scooter)
+
+        async def run():
+            with install_simulator(fleet):
+                client = await connect_to_device(scooter.address)
+                return await update_firmware(
+                    client, self.path, reconnect=lambda: connect_to_device(scooter.address))
+
+        return asyncio.run(run())
+
+    def test_update_firmware(self):
+        scooter = SimulatedScooter("SIM:OTA:01", connect_latency=(0, 0))
+        result = self.run_update(scooter)
+        self.assertTrue(result["success"])
+        self.assertEqual(bytes(scooter.firmware_buffer), self.image)
+
+    def test_resume_after_disconnect(self):
+        scooter = SimulatedScooter("SIM:OTA:02", connect_latency=(0, 0), ota_disconnect_at=20000)
+        result = self.run_update(scooter)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["resumes"], 1)
+        self.assertLess(result["bytes_sent"], 2 * len(self.image))
+        self.assertEqual(bytes(scooter.firmware_buffer), self.image)
+
+class TestFirmwareRollout(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(presence_cache.clear)
+        self.image = os.urandom(4000)
+        fd, self.path = tempfile.mkstemp(suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.image)
+        self.db = Database(":memory:")
+        self.scooters = ScooterManager(self.db)
+        self.rollouts = FirmwareRolloutManager(self.db)
+        self.fleet = SimulatedFleet()
+        self.ids = []
+        self.max_failure_rate = 0.2
+        self.add_scooters(4)
+
+    def add_scooters(self, count):
+        for index in range(len(self.ids), len(self.ids) + count):
+            scooter = self.fleet.add(SimulatedScooter(f"SIM:ROLL:{index:02d}", latency=(0.001, 0.002),
+                                                      connect_latency=(0, 0)))
+            self.scooters.add_scooter(f"R{index}", f"rollout-{index}", scooter.address)
+            self.ids.append(f"R{index}")
+
+    def tearDown(self):
+        self.db.close()
+        os.remove(self.path)
+
+    def make_rollout(self):
+        return FirmwareRollout(self.scooters, self.rollouts, BLEConnectionPool(keepalive_interval=60),
+                               canary_count=1, wave_percentages=(50, 100), max_failure_rate=self.max_failure_rate)
+
+    def run_rollout(self, scooter_ids=None, rollout_id=None):
+        async def run():
+            with install_simulator(self.fleet):
+                rollout = self.make_rollout()
+                try:
+                    return await rollout.run(self.path, "V2.0.0", scooter_ids=scooter_ids, rollout_id=rollout_id)
+                finally:
+                    await rollout.connection_pool.close()
+
+        return asyncio.run(run())
+
+    def break_device(self, address):
+        # 熔断打开后连接直接失败，模拟设备不可达
+        self.addCleanup(circuit_breakers.reset, address)
+        breaker = circuit_breakers.get(address)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+    def test_plan_waves(self):
+        rollout = FirmwareRollout(None, None, None, canary_count=1, wave_percentages=(10, 50, 100))
+        waves = [wave for _, wave in rollout.plan_waves([f"S{i}" for i in range(20)])]
+        self.assertEqual([waves.count(wave) for wave in range(4)], [1, 1, 8, 10])
+        self.assertEqual(rollout.plan_waves(["S0"]), [("S0", 0)])
+
+    def test_failed_canary_pauses_and_resume_skips_finished_devices(self):
+        self.break_device("SIM:ROLL:00")
+        result = self.run_rollout(self.ids)
+        self.assertEqual(result["status"], "已暂停")
+        rollout_id = result["rollout_id"]
+        devices = {d["scooter_id"]: d for d in self.rollouts.get_rollout_devices(rollout_id)}
+        self.assertEqual(devices["R0"]["status"], "失败")
+        # 金丝雀失败后后续波次没有执行
+        self.assertEqual({devices[i]["status"] for i in self.ids[1:]}, {"待升级"})
+        self.assertEqual(self.rollouts.get_rollout(rollout_id)["status"], "已暂停")
+
+        circuit_breakers.reset("SIM:ROLL:00")
+        result = self.run_rollout(self.ids)
+        self.assertEqual((result["rollout_id"], result["status"]), (rollout_id, "已完成"))
+        devices = self.rollouts.get_rollout_devices(rollout_id)
+        self.assertEqual({d["status"] for d in devices}, {"成功"})
+        self.assertEqual({d["scooter_id"]: d["attempts"] for d in devices}, {"R0": 2, "R1": 1, "R2": 1, "R3": 1})
+        for address in self.fleet.addresses:
+            self.assertEqual(bytes(self.fleet.get(address).firmware_buffer), self.image)
+
+    def test_resumed_wave_failure_rate_counts_only_retried_devices(self):
+        # 8辆车：金丝雀1辆，第1波次3辆，第2波次4辆
+        self.add_scooters(4)
+        self.max_failure_rate = 0.3
+        self.break_device("SIM:ROLL:04")
+        self.break_device("SIM:ROLL:05")
+        rollout_id = self.run_rollout(self.ids)["rollout_id"]
+        self.assertEqual(self.rollouts.get_rollout(rollout_id)["status"], "已暂停")
+
+        circuit_breakers.reset("SIM:ROLL:05")
+        result = self.run_rollout(self.ids)
+        # 重试的2辆中失败1辆，失败率50%；已成功的车辆不参与计算
+        self.assertEqual((result["rollout_id"], result["status"]), (rollout_id, "已暂停"))
+
+    def test_resume_requires_same_devices(self):
+        self.break_device("SIM:ROLL:00")
+        paused = self.run_rollout(self.ids)["rollout_id"]
+        with self.assertRaises(ValueError):
+            self.run_rollout(self.ids[1:], rollout_id=paused)
+        # 车辆不同的批次不会被继续，而是创建新批次
+        result = self.run_rollout(self.ids[1:])
+        self.assertNotEqual(result["rollout_id"], paused)
+        self.assertEqual(result["status"], "已完成")
+        self.assertEqual(self.rollouts.get_rollout(paused)["status"], "已暂停")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,436 @@
+# MQTT模块测试
+import asyncio
+import json
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+import paho.mqtt.client as mqtt
+from src.bluetooth.retry_policy import RetryPolicy
+from src.database.models import Database, OutboxManager
+from src.mqtt.async_transport import AsyncMQTTTransport
+from src.mqtt.connection import ConnectionStateMachine
+from src.mqtt.data_report import report_lock_key
+from src.mqtt.dispatcher import MessageDispatcher, message_key
+from src.mqtt.lock_controller import MQTTLockController
+from src.mqtt.message_buffer import MessageRingBuffer
+from src.mqtt.simulator import LocalBroker, make_serial_number, run_benchmark
+from src.mqtt.topic_router import TopicRouter
+from src.mqtt.publisher import PublishWindow
+
+class _Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode()
+
+class _OfflineLockController(MQTTLockController):
+    """不连接服务器的锁控制器，消息由测试直接注入"""
+    def _connect(self):
+        self.connection.mark_connected()
+
+    def _subscribe_topic(self, topic):
+        return True
+
+class _AckingClient:
+    """发布后延迟回调on_publish的客户端，mid为drop_mid的消息不回确认"""
+    def __init__(self, drop_mid=None):
+        self.on_publish = None
+        self.next_mid = 0
+        self.drop_mid = drop_mid
+        self.inflight = 0
+        self.max_inflight = 0
+        self.published = []
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=1):
+        with self.lock:
+            self.published.append((topic, payload))
+            self.next_mid += 1
+            mid = self.next_mid
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        if mid != self.drop_mid:
+            threading.Timer(0.01, self._ack, (mid,)).start()
+        return mqtt.MQTTMessageInfo(mid)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def _ack(self, mid):
+        with self.lock:
+            self.inflight -= 1
+        self.on_publish(self, None, mid)
+
+class TestUnlockConfirmation(unittest.TestCase):
+    def setUp(self):
+        self.controller = _OfflineLockController()
+        self.controller.client = _AckingClient()
+        self.controller.client.on_publish = lambda *args: None
+
+    def tearDown(self):
+        self.controller.close()
+
+    def report(self, payload):
+        self.controller._on_message(None, None, _Message("data_report", json.dumps(payload)))
+
+    async def wait_registered(self, key):
+        """等待开锁请求登记完成，之后注入的上报不会早于登记到达"""
+        while key not in self.controller._unlock_waiters:
+            await asyncio.sleep(0)
+
+    def test_report_lock_key_from_sn(self):
+        self.assertEqual(report_lock_key({"SN": "D0020610490500531"}), ("866846061120977", 3))
+        self.assertEqual(report_lock_key({"controllerId": "X1", "subLock": "2"}), ("X1", 2))
+        self.assertIsNone(report_lock_key({"SN": "short"}))
+        # 子锁号不是数字时按1处理，与关联更新的解析一致
+        self.assertEqual(report_lock_key({"SN": "D00306104905005X1"}), ("866846061051685", 1))
+
+    def test_unlock_confirmed_by_data_report(self):
+        async def scenario():
+            task = asyncio.ensure_future(self.controller.unlock_and_confirm("866846061120977", 1, timeout=2))
+            await self.wait_registered(("866846061120977", 1))
+            # 关锁状态的上报不算确认
+            self.report({"state": "1", "SN": "D0020610490500511"})
+            await asyncio.sleep(0.1)
+            self.assertFalse(task.done())
+            self.report({"state": "0", "SN": "D0020610490500511"})
+            return await task
+
+        result = asyncio.run(scenario())
+        self.assertTrue(result["confirmed"])
+        self.assertEqual(self.controller.ack_latency.count, 1)
+        self.assertGreaterEqual(result["latency"], 0.1)
+
+    def test_unlock_times_out(self):
+        self.report({"state": "0", "SN": "D0020610490500521"})
+        result = asyncio.run(self.controller.unlock_and_confirm("866846061120977", 1, timeout=0.2))
+        self.assertEqual(result["status"], "超时")
+        self.assertEqual(self.controller.ack_latency.timeouts, 1)
+        self.assertFalse(self.controller._unlock_waiters)
+
+class TestPublishWindow(unittest.TestCase):
+    def test_window_limits_inflight_and_tracks_acks(self):
+        client = _AckingClient(drop_mid=3)
+        publisher = PublishWindow(client)
+        summary = publisher.publish_many((("ULC1", {"SLN": n}) for n in range(10)), window=4, timeout=0.3)
+        self.assertLessEqual(client.max_inflight, 4)
+        self.assertEqual(summary["acked"], 9)
+        self.assertEqual(summary["results"][2]["error"], "等待PUBACK超时")
+        self.assertTrue(all(r["latency"] is not None for i, r in enumerate(summary["results"]) if i != 2))
+        self.assertEqual(publisher.puback_latency.count, 9)
+
+class _SubscribingClient(_AckingClient):
+    def __init__(self):
+        super().__init__()
+        self.subscriptions = []
+
+    def subscribe(self, topics, qos=0):
+        self.subscriptions.append(topics)
+        return mqtt.MQTT_ERR_SUCCESS, 1
+
+class TestConnectionStateMachine(unittest.TestCase):
+    def test_backoff_reconnect_wakes_waiters(self):
+        connection = ConnectionStateMachine(RetryPolicy(base_delay=0.01, max_delay=0.02))
+        connection.mark_connecting()
+        self.assertIsNotNone(connection.schedule_reconnect(connection.mark_connected))
+        # 已在退避中，重复的断开通知不会再安排重连
+        self.assertIsNone(connection.schedule_reconnect(connection.mark_connected))
+        self.assertEqual(connection.state, ConnectionStateMachine.BACKING_OFF)
+        self.assertTrue(connection.wait_connected(1))
+        self.assertEqual(connection.attempts, 0)
+
+    def test_async_wait_and_close(self):
+        connection = ConnectionStateMachine()
+
+        async def scenario():
+            threading.Timer(0.05, connection.mark_connected).start()
+            connected = await connection.wait_connected_async(1)
+            connection.close()
+            return connected, await connection.wait_connected_async(1)
+
+        self.assertEqual(asyncio.run(scenario()), (True, False))
+        self.assertIsNone(connection.schedule_reconnect(connection.mark_connected))
+
+    def test_close_during_backoff_cancels_reconnect(self):
+        connection = ConnectionStateMachine(RetryPolicy(base_delay=0.05, max_delay=0.05, jitter=0))
+        reconnects = []
+
+        async def reconnect():
+            reconnects.append(True)
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            self.assertIsNotNone(connection.schedule_reconnect(reconnect, loop))
+            await asyncio.sleep(0.01)
+            connection.close()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        self.assertEqual(reconnects, [])
+
+        timer_reconnects = []
+        connection = ConnectionStateMachine(RetryPolicy(base_delay=0.05, max_delay=0.05, jitter=0))
+        connection.schedule_reconnect(lambda: timer_reconnects.append(True))
+        connection.close()
+        time.sleep(0.1)
+        self.assertEqual(timer_reconnects, [])
+
+    def test_closed_controller_does_not_reconnect(self):
+        controller = _OfflineLockController()
+        controller.client = _SubscribingClient()
+        controller.close()
+        controller.transport = mock.Mock()
+        asyncio.run(controller._async_reconnect())
+        controller.transport.reconnect.assert_not_called()
+
+    def test_resubscribes_after_reconnect(self):
+        controller = _OfflineLockController()
+        controller.client = _SubscribingClient()
+        controller.subscribed_topics = {"data_report", "QRY1"}
+        controller._on_disconnect(controller.client, None, 1)
+        self.assertEqual(controller.connection.state, ConnectionStateMachine.BACKING_OFF)
+        controller._on_connect(controller.client, None, {}, 0)
+        self.assertTrue(controller.connected)
+        self.assertEqual(controller.client.subscriptions, [[("QRY1", 0), ("data_report", 0)]])
+        controller.close()
+
+class TestMessageRingBuffer(unittest.TestCase):
+    def test_capacity_and_topic_limits(self):
+        buffer = MessageRingBuffer(capacity=5, topic_limits={"data_report": 2})
+        for n in range(4):
+            buffer.put("data_report", str(n))
+        for n in range(4):
+            buffer.put("ULC1", str(n))
+        stats = buffer.stats()
+        self.assertEqual(stats["size"], 5)
+        self.assertEqual(stats["overwritten_by_topic"], {"data_report": 3})
+        self.assertEqual(stats["overwritten"], 3)
+        self.assertEqual(buffer.latest("data_report")[1], "3")
+        self.assertEqual([item[1] for item in buffer.drain()], ["3", "0", "1", "2", "3"])
+        self.assertIsNone(buffer.get(timeout=0))
+
+    def test_get_waits_for_producer(self):
+        buffer = MessageRingBuffer(capacity=2)
+        threading.Timer(0.05, buffer.put, ("data_report", "{}")).start()
+        self.assertEqual(buffer.get(timeout=1)[:2], ("data_report", "{}"))
+        self.assertEqual(buffer.stats()["consumed"], 1)
+
+class TestMessageDispatcher(unittest.TestCase):
+    def test_keeps_per_key_order_and_runs_keys_in_parallel(self):
+        dispatcher = MessageDispatcher(workers=4, queue_size=8)
+        seen = {}
+        lock = threading.Lock()
+        # 两个键的第一条消息都要到达屏障才能继续，只有两个键同时在处理时才不会超时
+        barrier = threading.Barrier(2, timeout=2)
+
+        def handler(key, n):
+            if n == 0:
+                barrier.wait()
+            with lock:
+                seen.setdefault(key, []).append(n)
+
+        for n in range(10):
+            # 整数键的哈希固定，保证两个键分到不同的工作线程
+            for key in (1, 2):
+                dispatcher.submit(key, handler, key, n)
+        dispatcher.join()
+        dispatcher.stop()
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(seen[1], list(range(10)))
+        self.assertEqual(seen[2], list(range(10)))
+        stats = dispatcher.stats()
+        self.assertEqual((stats["submitted"], stats["processed"], stats["dropped"]), (20, 20, 0))
+        self.assertFalse(dispatcher.submit("x", handler, "x", 0))
+
+    def test_drops_when_queue_stays_full(self):
+        dispatcher = MessageDispatcher(workers=1, queue_size=1, put_timeout=0.01)
+        release = threading.Event()
+        results = [dispatcher.submit("k", release.wait) for _ in range(4)]
+        release.set()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertFalse(all(results))
+        self.assertGreater(dispatcher.stats()["dropped"], 0)
+        self.assertGreater(dispatcher.stats()["blocked"], 0)
+
+    def test_message_key_groups_by_controller(self):
+        self.assertEqual(message_key("data_report", {"SN": "D0020610490500531"}), "866846061120977")
+        self.assertEqual(message_key("data_report", "not a dict"), "data_report")
+
+class TestTopicRouter(unittest.TestCase):
+    def test_wildcard_matching(self):
+        router = TopicRouter()
+        exact, single, multi, everything = (lambda *a: None for _ in range(4))
+        router.add("866846061120977/data_report", exact)
+        router.add("+/data_report", single)
+        router.add("866846061120977/#", multi)
+        router.add("#", everything)
+        self.assertEqual(router.match("866846061120977/data_report"), [everything, multi, exact, single])
+        self.assertEqual(router.match("866846061051685/data_report"), [everything, single])
+        self.assertEqual(router.match("866846061120977"), [everything, multi])
+        self.assertEqual(router.match("$SYS/broker/uptime"), [])
+        with self.assertRaises(ValueError):
+            router.add("a/#/b", exact)
+
+    def test_multiple_handlers_and_remove(self):
+        router = TopicRouter()
+        first, second = (lambda *a: None), (lambda *a: None)
+        router.add("data_report", first)
+        router.add("data_report", second)
+        self.assertFalse(router.add("data_report", first))
+        self.assertEqual(router.match("data_report"), [first, second])
+        self.assertEqual(router.remove("data_report", first), 1)
+        self.assertEqual(router.match("data_report"), [second])
+        self.assertEqual(router.remove("data_report"), 1)
+        self.assertEqual((len(router), router.filters()), (0, []))
+
+    def test_controller_keeps_existing_handlers(self):
+        controller = _OfflineLockController()
+        received = []
+        controller.subscribe_data_report(lambda topic, payload: received.append("first"))
+        controller.subscribe_data_report(lambda topic, payload: received.append("second"))
+        controller._on_message(None, None, _Message("data_report", "{}"))
+        controller.dispatcher.join()
+        controller.close()
+        self.assertEqual(received, ["first", "second"])
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(":memory:")
+        self.outbox = OutboxManager(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_enqueue_dedupes_and_expires(self):
+        first = self.outbox.enqueue("ULC1", '{"SLN":1}', ttl=60)
+        self.assertEqual(self.outbox.enqueue("ULC1", '{"SLN":1}', ttl=60), first)
+        self.outbox.enqueue("ULC1", '{"SLN":2}', ttl=-1)
+        self.assertEqual(self.outbox.expire_stale(), 1)
+        self.assertEqual([m["message_id"] for m in self.outbox.get_pending()], [first])
+
+    def test_offline_commands_replayed_after_reconnect(self):
+        controller = _OfflineLockController(outbox=self.outbox)
+        controller.connection.mark_disconnected()
+        self.assertTrue(controller.unlock("866846061120977", 1))
+        self.assertTrue(controller.unlock("866846061120977", 1))
+        self.assertTrue(controller.query_status("866846061120977", 2))
+        self.assertEqual(self.outbox.count_pending(), 2)
+
+        client = _AckingClient()
+        controller.client = client
+        controller.publisher = PublishWindow(client)
+        controller.connection.mark_connected()
+        self.assertEqual(controller.replay_outbox(), 2)
+        self.assertEqual(self.outbox.count_pending(), 0)
+        self.assertEqual(client.next_mid, 2)
+        controller.close()
+
+    def test_commands_sent_during_replay_wait_behind_outbox(self):
+        controller = _OfflineLockController(outbox=self.outbox)
+        controller.connection.mark_disconnected()
+        self.assertTrue(controller.unlock("866846061120977", 1))
+
+        client = _AckingClient()
+        controller.client = client
+        controller.publisher = PublishWindow(client)
+        # 与重连回调相同：先占住补发锁再标记已连接
+        self.assertTrue(controller._replay_lock.acquire(blocking=False))
+        controller.connection.mark_connected()
+        self.assertTrue(controller.unlock("866846061120977", 2))
+        self.assertEqual(client.next_mid, 0)
+        self.assertEqual(self.outbox.count_pending(), 2)
+
+        self.assertEqual(controller._replay_locked(), 2)
+        self.assertEqual([json.loads(payload)["payload"]["SLN"] for _, payload in client.published], [1, 2])
+        self.assertFalse(controller._replay_lock.locked())
+        self.assertTrue(controller.unlock("866846061120977", 3))
+        self.assertEqual(client.next_mid, 3)
+        controller.close()
+
+def _serve_one_client(server):
+    """最小的MQTT服务端：回复CONNACK，对QoS1的PUBLISH回复PUBACK"""
+    conn, _ = server.accept()
+    with conn:
+        stream = conn.makefile("rb")
+        while True:
+            header = stream.read(1)
+            if not header:
+                return
+            length, shift = 0, 0
+            while True:
+                byte = stream.read(1)[0]
+                length |= (byte & 0x7F) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            body = stream.read(length)
+            kind = header[0] >> 4
+            if kind == 1:
+                conn.sendall(bytes((0x20, 0x02, 0x00, 0x00)))
+            elif kind == 3 and header[0] & 0x06:
+                topic_length = int.from_bytes(body[:2], "big")
+                conn.sendall(bytes((0x40, 0x02)) + body[2 + topic_length:4 + topic_length])
+            elif kind == 14:
+                return
+
+class TestAsyncTransport(unittest.TestCase):
+    def test_publish_waits_for_puback_on_event_loop(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        threading.Thread(target=_serve_one_client, args=(server,), daemon=True).start()
+
+        async def scenario():
+            client = mqtt.Client(client_id="test-async-transport")
+            transport = AsyncMQTTTransport(client)
+            self.assertTrue(await transport.connect("127.0.0.1", server.getsockname()[1], timeout=2))
+            latencies = await asyncio.gather(*(
+                transport.publish("ULC1", {"SLN": n}, timeout=2) for n in range(5)))
+            await transport.close()
+            return latencies
+
+        try:
+            latencies = asyncio.run(scenario())
+        finally:
+            server.close()
+        self.assertEqual(len(latencies), 5)
+        self.assertTrue(all(latency >= 0 for latency in latencies))
+
+class TestLocalBroker(unittest.TestCase):
+    def test_wildcard_subscription_through_local_broker(self):
+        broker = LocalBroker().start()
+        controller = MQTTLockController(mqtt_host=broker.host, mqtt_port=broker.port)
+        received = []
+        try:
+            self.assertTrue(controller.connection.wait_connected(5))
+            controller.subscribe("+/data_report", lambda topic, payload: received.append(topic))
+            self.assertTrue(broker.subscribed.wait(5))
+            self.assertTrue(controller._send_command("866846061120977/data_report", {"SN": make_serial_number(0, 1)}))
+            deadline = time.time() + 5
+            while not received and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            controller.close()
+            broker.stop()
+        self.assertEqual(received, ["866846061120977/data_report"])
+
+    def test_benchmark_handles_every_report(self):
+        stats = asyncio.run(run_benchmark(controllers=2000, rate=500, duration=0.3, handler="noop", seed=1))
+        self.assertGreater(stats["sent"], 0)
+        self.assertEqual(stats["handled"], stats["sent"])
+        self.assertIsNotNone(stats["e2e_p99"])
+
+    def test_benchmark_reports_reach_database_path(self):
+        stats = asyncio.run(run_benchmark(controllers=50, rate=200, duration=0.3, seed=1))
+        self.assertEqual(stats["handled"], stats["sent"])
+        # 约七成为关锁上报，其中四分之三为正常还车
+        self.assertGreater(stats["db_updates"], stats["handled"] * 0.3)
+
+if __name__ == '__main__':
+    unittest.main()
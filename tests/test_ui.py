@@ -1 +1,72 @@
-# 用户界面测试 
\ No newline at end of file
+# 用户界面测试
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+from src.database.models import Database, TelemetryManager
+from src.ui.async_runtime import AsyncRuntime
+
+class _FakeRoot:
+    """代替Tk根窗口，记录after回调"""
+    def __init__(self):
+        self.calls = []
+        self.done = threading.Event()
+
+    def after(self, delay, callback, *args):
+        self.calls.append((callback, args))
+        self.done.set()
+
+class TestAsyncRuntime(unittest.TestCase):
+    def setUp(self):
+        self.runtime = AsyncRuntime()
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def test_coroutines_share_one_loop(self):
+        async def current_loop():
+            return asyncio.get_running_loop()
+
+        first = self.runtime.submit(current_loop()).result(5)
+        second = self.runtime.submit(current_loop()).result(5)
+        self.assertIs(first, second)
+        self.assertIs(first, self.runtime.loop)
+
+    def test_submit_to_ui_callbacks(self):
+        async def fail():
+            raise ValueError("boom")
+
+        root = _FakeRoot()
+        results = []
+        self.runtime.submit_to_ui(root, fail(), on_success=results.append, on_error=results.append)
+        self.assertTrue(root.done.wait(5))
+        callback, args = root.calls[0]
+        callback(*args)
+        self.assertIsInstance(results[0], ValueError)
+
+    def test_cancelled_coroutine_reports_error(self):
+        root = _FakeRoot()
+        future = self.runtime.submit_to_ui(root, asyncio.sleep(10), on_error=lambda e: None)
+        future.cancel()
+        # 取消同样回调on_error，而不是在事件循环线程中抛出异常
+        self.assertTrue(root.done.wait(5))
+        callback, args = root.calls[0]
+        self.assertIsInstance(args[0], (asyncio.CancelledError, concurrent.futures.CancelledError))
+
+    def test_database_shared_with_loop_thread(self):
+        db = Database(":memory:")
+        self.addCleanup(db.close)
+        telemetry = TelemetryManager(db)
+
+        async def write_on_loop(count):
+            return [telemetry.add_telemetry("S1", "锁定", 0, 0, i, 0, 80, 0) for i in range(count)]
+
+        future = self.runtime.submit(write_on_loop(200))
+        local = [telemetry.add_telemetry("S2", "锁定", 0, 0, i, 0, 80, 0) for i in range(200)]
+        self.assertTrue(all(future.result(10)))
+        self.assertTrue(all(local))
+        self.assertEqual(len(telemetry.get_telemetry_history("S1", limit=500)), 200)
+        self.assertEqual(len(telemetry.get_telemetry_history("S2", limit=500)), 200)
+
+if __name__ == '__main__':
+    unittest.main()